@@ -1,16 +1,28 @@
 from flask import Flask
 from flask_restful import Api
 from flask_swagger_ui import get_swaggerui_blueprint
-from models.main import db
+from models.main import db, get_catalog_state
+from sqlalchemy import event
 import json
 import logging
+import secrets
+from cache.backends import create_response_cache
+from cache.genre_registry import GenreRegistry
+from cache.response_cache import ResponseCache
+from cache.title_index import TitleIndexRegistry
+from resources.cache_stats import CacheStatsResource
 from resources.doc import DocResource
 from resources.genre import GenreResource
 from resources.movie import MovieResource, MovieSingleResource
+from resources.movie_bulk import MovieBulkResource
+from resources.search import register_sqlite_functions
+from resources.suggest import MovieSuggestResource
 
 
 class MovieAPI:
-    def __init__(self, connectionString):
+    def __init__(self, connectionString, secret_key=None, db_json_rendering=False, response_cache=None,
+                 catalog_version_ttl=0, cache_control_max_age=0, title_index_dir=None, suggest_refresh_interval=0,
+                 suggest_rebuild_interval=0):
         logging.basicConfig()
         logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
         SWAGGER_URL = '/docs'  # URL for exposing Swagger UI (without trailing '/')
@@ -25,22 +37,53 @@ class MovieAPI:
             },
         )
         self.app = Flask(__name__)
+        self.setup_secret_key(secret_key)
+        # Postgres renders the /movies pages as JSON, other databases keep rendering them in Python
+        self.app.config['DB_JSON_RENDERING'] = db_json_rendering
+        self.app.extensions['response_cache'] = response_cache or ResponseCache()
+        self.app.extensions['genre_registry'] = GenreRegistry()
+        # Title suggestions are answered from memory, mapped from a file of title_index_dir shared by the workers
+        self.app.extensions['title_index'] = TitleIndexRegistry(title_index_dir, suggest_refresh_interval,
+                                                                suggest_rebuild_interval)
+        # Seconds a worker reuses the catalog version it read and clients may reuse a response before revalidating
+        self.app.config['CATALOG_VERSION_TTL'] = catalog_version_ttl
+        self.app.config['CACHE_CONTROL_MAX_AGE'] = cache_control_max_age
         self.api = Api(self.app)
         self.app.register_blueprint(swaggerui_blueprint)
         self.setup_database(connectionString)
         self.setup_resources()
 
+    def setup_secret_key(self, secret_key):
+        # Signs the pagination cursors, all the workers have to share it for a cursor to be valid in any of them
+        if not secret_key:
+            print('No SECRET_KEY configured, pagination cursors will only be valid in this process')
+            secret_key = secrets.token_hex(32)
+        self.app.config['SECRET_KEY'] = secret_key
+
     def setup_database(self, connectionString):
         self.app.config['SQLALCHEMY_DATABASE_URI'] = connectionString
         self.db = db
         self.db.init_app(self.app)
+        with self.app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                # Title search falls back to a Python pg_trgm similarity outside Postgres
+                event.listen(db.engine, 'connect', register_sqlite_functions)
 
     def setup_resources(self): # Add resources to the API
 
         self.api.add_resource(GenreResource, '/genres')
         self.api.add_resource(MovieResource, '/movies')
+        self.api.add_resource(MovieBulkResource, '/movies/bulk')
+        self.api.add_resource(MovieSuggestResource, '/movies/suggest')
         self.api.add_resource(MovieSingleResource, '/movies/<string:movie_id>')
         self.api.add_resource(DocResource, '/docs/openapi.yaml')
+        self.api.add_resource(CacheStatsResource, '/cache/stats')
+
+    def preload_catalog(self):
+        # Loads the genre registry and the title index before the first request instead of on it
+        with self.app.app_context():
+            self.app.extensions['genre_registry'].get(get_catalog_state()[0])
+            self.app.extensions['title_index'].get(get_catalog_state)
 
     def start(self, debug = True, host='0.0.0.0', port=5000):
         self.app.run(debug=debug, host=host, port=port)
@@ -60,5 +103,13 @@ if __name__ == '__main__':
             "database": config_data["DB_NAME"],
         }
         connectionString = 'postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}'.format(**db_params)
-        movie_api = MovieAPI(connectionString)
+        movie_api = MovieAPI(connectionString, config_data.get("SECRET_KEY"),
+                             str(config_data.get("DB_JSON_RENDERING")).lower() == "true",
+                             create_response_cache(config_data),
+                             float(config_data.get("CATALOG_VERSION_TTL") or 0),
+                             int(config_data.get("CACHE_CONTROL_MAX_AGE") or 0),
+                             config_data.get("TITLE_INDEX_DIR") or None,
+                             float(config_data.get("SUGGEST_REFRESH_INTERVAL") or 5),
+                             float(config_data.get("SUGGEST_REBUILD_INTERVAL") or 60))
+        movie_api.preload_catalog()
         movie_api.start()
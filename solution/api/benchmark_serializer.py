@@ -0,0 +1,52 @@
+import argparse
+import json
+import timeit
+
+from models.main import Genre, Movie, MovieSchema
+from resources.serializer import dumps, movie_fields, serialize_movie_rows, serialize_movies
+
+GENRES = ["Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Documentary", "Drama", "Family",
+          "Fantasy", "History", "Horror", "Music", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+
+
+def build_movies(rows):
+    genres = [Genre(id=str(bit), name=name, bit=bit) for bit, name in enumerate(GENRES)]
+    movies = []
+    for i in range(rows):
+        movie_genres = [genres[i % len(genres)], genres[i * 7 % len(genres)]] if i % 5 else []
+        movie = Movie(id=f'{i:036d}', title=f'Movie {i}', year=1950 + i % 70, rating=i % 100 / 10, runtime=90,
+                      imdb_id=f'tt{i:07d}' if i % 10 else None)
+        movie.genres = list({genre.name: genre for genre in movie_genres}.values())
+        movie.genre_mask = sum(1 << genre.bit for genre in movie.genres)
+        movies.append(movie)
+    return movies, [(genre.bit, genre.name) for genre in genres]
+
+
+def marshmallow_page(movies):
+    # The previous path: a schema per request, a dump and a second pass patching genres and imdb_link
+    serialized_movies = MovieSchema(many=True).dump(movies)
+    for serialized_movie, movie in zip(serialized_movies, movies):
+        serialized_movie['genres'] = [{'name': genre.name} for genre in movie.genres]
+        if serialized_movie['imdb_id'] is not None:
+            serialized_movie['imdb_link'] = f"https://www.imdb.com/title/{serialized_movie['imdb_id']}/"
+        serialized_movie.pop('imdb_id')
+    return json.dumps(serialized_movies).encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times serializing pages of movies with each serializer.")
+    parser.add_argument("--number", type=int, default=200, help="pages serialized per measure")
+    args = parser.parse_args()
+
+    print(f"{'rows':>6}{'marshmallow':>14}{'serializer':>14}{'mask genres':>14}{'core rows':>14}   (ms per page)")
+    for rows in [10, 100, 1000]:
+        movies, genre_names = build_movies(rows)
+        # What the list query returns, (id, title, year, rating, runtime, imdb_id, genre_mask) tuples
+        movie_rows = [movie_fields(movie) + (movie.genre_mask,) for movie in movies]
+        timings = [
+            timeit.timeit(lambda: marshmallow_page(movies), number=args.number),
+            timeit.timeit(lambda: dumps(serialize_movies(movies)), number=args.number),
+            timeit.timeit(lambda: dumps(serialize_movies(movies, genre_names)), number=args.number),
+            timeit.timeit(lambda: dumps(serialize_movie_rows(movie_rows, genre_names)), number=args.number),
+        ]
+        print(f"{rows:>6}" + "".join(f"{timing / args.number * 1000:>14.3f}" for timing in timings))
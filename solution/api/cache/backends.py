@@ -0,0 +1,16 @@
+from cache.redis_cache import RedisResponseCache
+from cache.response_cache import ResponseCache
+
+
+def create_response_cache(config_data):
+    '''Response cache selected by CACHE_BACKEND: local (default) keeps one cache per worker, redis shares one
+    between all the workers at REDIS_URL'''
+    backend = (config_data.get('CACHE_BACKEND') or 'local').lower()
+    if backend == 'local':
+        return ResponseCache.from_config(config_data)
+    if backend == 'redis':
+        return RedisResponseCache.from_url(config_data.get('REDIS_URL') or 'redis://localhost:6379/0',
+                                           timeout=float(config_data.get('REDIS_TIMEOUT') or 0.5),
+                                           ttl=float(config_data.get('CACHE_TTL') or 60),
+                                           max_bytes=int(config_data.get('CACHE_MAX_BYTES') or 64 * 1024 * 1024))
+    raise ValueError(f'Unknown CACHE_BACKEND {backend}, it must be local or redis')
@@ -0,0 +1,73 @@
+import threading
+from collections import namedtuple
+
+from sqlalchemy import func
+
+from models.main import Genre, Movie, db, movie_genre_association
+from resources.serializer import dumps
+
+# Genres of at most this share of the movies are selective, a genre filter finds their movies through movie_genres
+SELECTIVE_GENRE_SHARE = 0.02
+
+# by_name: genre name -> (id, bit), genre_bits: (bit, name) of the genres with a bit ordered by bit,
+# has_unmasked: some genre has no bit, selective: names of the selective genres, None until a genre filter needs
+# them, body: the /genres response
+GenreCatalog = namedtuple('GenreCatalog', ['version', 'by_name', 'genre_bits', 'has_unmasked', 'selective', 'body'])
+
+
+class GenreRegistry:
+    '''In-memory copy of the genres, loaded once per catalog version. Genres only change with a data load or a
+    POST creating one, both bump the catalog version, so a catalog of the current version is never stale'''
+
+    def __init__(self):
+        self.catalog = None
+        self.lock = threading.Lock()
+
+    def get(self, version):
+        catalog = self.catalog
+        if catalog is not None and catalog.version == version:
+            return catalog
+        with self.lock:
+            if self.catalog is None or self.catalog.version != version:
+                self.catalog = self.load(version, self.catalog)
+            return self.catalog
+
+    def get_selective(self, version):
+        # Counted the first time a genre filter is applied. New versions with the same genres keep them, whether
+        # this worker advanced the catalog or reloaded it after another worker's write: a few posted movies don't
+        # change which genres are selective
+        catalog = self.get(version)
+        if catalog.selective is not None:
+            return catalog.selective
+        selective = self.load_selective(catalog.by_name)
+        with self.lock:
+            if self.catalog is not None and self.catalog.version == version:
+                self.catalog = self.catalog._replace(selective=selective)
+        return selective
+
+    def advance(self, version, new_version):
+        # A write that didn't touch the genres moves the catalog to its new version without reloading it
+        with self.lock:
+            if self.catalog is not None and self.catalog.version == version:
+                self.catalog = self.catalog._replace(version=new_version)
+
+    @staticmethod
+    def load(version, previous=None):
+        genres = db.session.query(Genre.id, Genre.name, Genre.bit).order_by(Genre.name).all()
+        by_name = {name: (genre_id, bit) for genre_id, name, bit in genres}
+        return GenreCatalog(
+            version=version,
+            by_name=by_name,
+            genre_bits=sorted((bit, name) for _, name, bit in genres if bit is not None),
+            has_unmasked=any(bit is None for _, _, bit in genres),
+            selective=previous.selective if previous is not None and previous.by_name == by_name else None,
+            body=dumps([{'id': genre_id, 'name': name} for genre_id, name, _ in genres]))
+
+    @staticmethod
+    def load_selective(by_name):
+        # Movies per genre are counted on the (genre_id, movie_id) index
+        movie_count = db.session.query(func.count(Movie.id)).scalar()
+        genre_counts = dict(db.session.query(movie_genre_association.c.genre_id, func.count())
+                            .group_by(movie_genre_association.c.genre_id))
+        return frozenset(name for name, (genre_id, _) in by_name.items()
+                         if genre_counts.get(genre_id, 0) <= SELECTIVE_GENRE_SHARE * movie_count)
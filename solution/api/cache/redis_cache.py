@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+
+from cache.response_cache import CachedResponse
+
+try:
+    import redis
+    from redis.exceptions import RedisError
+except ImportError:  # Optional, only needed with CACHE_BACKEND=redis
+    redis = None
+
+    class RedisError(Exception):
+        pass
+
+logger = logging.getLogger(__name__)
+
+
+class RedisResponseCache:
+    '''Response cache shared by all the workers through a Redis compatible server, same interface as
+    ResponseCache. Entries expire after ttl seconds, LRU eviction and the memory bound are left to the server
+    (maxmemory and maxmemory-policy allkeys-lru). An unavailable server turns lookups into misses and stores into
+    no-ops, responses are then rendered as without cache'''
+
+    def __init__(self, client, ttl=60, max_bytes=64 * 1024 * 1024, prefix='movie-api', stats_flush_every=100):
+        self.client = client
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.version = None
+        # Hits and misses are counted in the worker and added to the shared counters every stats_flush_every
+        # lookups, instead of a write to the server on every lookup
+        self.stats_flush_every = stats_flush_every
+        self.pending = {'hits': 0, 'misses': 0}
+
+    @classmethod
+    def from_url(cls, url, timeout=0.5, **kwargs):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis requires the redis package')
+        # Bounds the time a request waits on an unreachable server before rendering the response itself
+        return cls(redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout), **kwargs)
+
+    def entry_key(self, key):
+        # The key tuple starts with the catalog version, so entries of older versions are never read again and expire
+        return f'{self.prefix}:response:{hashlib.sha1(repr(key).encode()).hexdigest()}'
+
+    def sync_version(self, version):
+        self.version = version
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.entry_key(key))
+        except RedisError as e:
+            logger.warning('Response cache lookup failed: %s', e)
+            value = None
+        self.count('misses' if value is None else 'hits')
+        if value is None:
+            return None
+        headers, body = value.split(b'\n', 1)
+        return CachedResponse(body, json.loads(headers), None, len(value))
+
+    def set(self, key, body, headers=None):
+        value = json.dumps(dict(headers or {})).encode() + b'\n' + body
+        if self.ttl <= 0 or len(value) > self.max_bytes:
+            return
+        try:
+            self.client.set(self.entry_key(key), value, ex=max(1, round(self.ttl)))
+        except RedisError as e:
+            logger.warning('Response cache store failed: %s', e)
+
+    def count(self, counter):
+        self.pending[counter] += 1
+        if sum(self.pending.values()) >= self.stats_flush_every:
+            self.flush_stats()
+
+    def flush_stats(self):
+        pending, self.pending = self.pending, {'hits': 0, 'misses': 0}
+        pipeline = self.client.pipeline(transaction=False)
+        for counter, amount in pending.items():
+            if amount:
+                pipeline.hincrby(f'{self.prefix}:stats', counter, amount)
+        try:
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning('Response cache stats update failed: %s', e)
+
+    def clear(self):
+        try:
+            for entry_key in self.client.scan_iter(f'{self.prefix}:response:*'):
+                self.client.delete(entry_key)
+        except RedisError as e:
+            logger.warning('Response cache clear failed: %s', e)
+
+    def stats(self):
+        # The shared counters can't be read from an unavailable server, they are reported as unknown
+        self.flush_stats()
+        try:
+            counters = {name.decode(): int(value)
+                        for name, value in self.client.hgetall(f'{self.prefix}:stats').items()}
+        except RedisError as e:
+            logger.warning('Response cache stats read failed: %s', e)
+            return {'backend': 'redis', 'version': self.version, 'available': False, 'hits': None, 'misses': None}
+        return {'backend': 'redis', 'version': self.version, 'available': True, 'hits': counters.get('hits', 0),
+                'misses': counters.get('misses', 0)}
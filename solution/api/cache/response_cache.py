@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'headers', 'expires_at', 'size'])
+
+
+class ResponseCache:
+    '''In-process cache of rendered responses with LRU eviction, a time to live and limits in entries and bytes.
+    Entries belong to a catalog version, they are dropped as soon as a newer version is seen'''
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_data):
+        return cls(max_entries=int(config_data.get('CACHE_MAX_ENTRIES') or 1024),
+                   max_bytes=int(config_data.get('CACHE_MAX_BYTES') or 64 * 1024 * 1024),
+                   ttl=float(config_data.get('CACHE_TTL') or 60))
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0 and self.ttl > 0
+
+    def sync_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.clear_entries()
+                self.version = version
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= self.clock():
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, body, headers=None):
+        headers = dict(headers or {})
+        size = len(body) + sum(len(name) + len(value) for name, value in headers.items())
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = CachedResponse(body, headers, self.clock() + self.ttl, size)
+            self.size += size
+            # Least recently used entries go first
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key).size
+
+    def clear(self):
+        with self.lock:
+            self.clear_entries()
+
+    def clear_entries(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'backend': 'local', 'entries': len(self.entries), 'bytes': self.size, 'version': self.version, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
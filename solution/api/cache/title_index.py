@@ -0,0 +1,256 @@
+import glob
+import heapq
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import unicodedata
+
+from models.main import Movie, db
+from resources.serializer import dumps
+
+# Header of the serialized index: magic, catalog version, movies, keys, hot prefixes and suggestions per prefix
+HEADER = struct.Struct('<8sqIIII')
+MAGIC = b'MVTIX001'
+# Suggestions returned at most, hot prefixes keep this many
+SUGGEST_MAX_LIMIT = 50
+# Prefixes matching more keys than this have their suggestions precomputed
+HOT_PREFIX_KEYS = 256
+NO_ENTRY = 0xFFFFFFFF
+LEADING_ARTICLE = re.compile(r'^(?:the|a|an) (?=.)')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title):
+    '''Titles and prefixes are compared casefolded, without accents and with single spaces'''
+    decomposed = unicodedata.normalize('NFKD', title)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def title_keys(title):
+    # A title is found by its start and, with a leading article, by what follows it ("godf" finds "The Godfather")
+    key = normalize_title(title or '')
+    if not key:
+        return []
+    keys = [key]
+    without_article = LEADING_ARTICLE.sub('', key)
+    if without_article != key:
+        keys.append(without_article)
+    return keys
+
+
+def build_index(version, movies, hot_prefix_keys=HOT_PREFIX_KEYS):
+    '''Serializes the index of (id, title, year, rating) movies. Movies are numbered best rated first, so the best
+    suggestions of a prefix are its smallest movie numbers'''
+    movies = sorted(movies, key=lambda movie: (movie[3] is None, -(movie[3] or 0), movie[1] or '', movie[0]))
+    documents = [dumps({'id': movie_id, 'title': title, 'year': year, 'rating': rating})
+                 for movie_id, title, year, rating in movies]
+    keys = sorted((key.encode(), entry) for entry, movie in enumerate(movies) for key in title_keys(movie[1]))
+    key_bytes = [key for key, _ in keys]
+    key_entries = [entry for _, entry in keys]
+
+    hot_prefixes = []
+    ranges = [(0, len(keys))] if len(keys) > hot_prefix_keys else []
+    length = 1
+    while ranges:
+        # Keys sharing their first length bytes, among the ranges that were hot one byte shorter
+        next_ranges = []
+        for start, end in ranges:
+            position = start
+            while position < end and len(key_bytes[position]) < length:
+                position += 1
+            while position < end:
+                prefix = key_bytes[position][:length]
+                group_end = position
+                while group_end < end and key_bytes[group_end][:length] == prefix:
+                    group_end += 1
+                if group_end - position > hot_prefix_keys:
+                    top = heapq.nsmallest(SUGGEST_MAX_LIMIT, set(key_entries[position:group_end]))
+                    hot_prefixes.append((prefix, top + [NO_ENTRY] * (SUGGEST_MAX_LIMIT - len(top))))
+                    next_ranges.append((position, group_end))
+                position = group_end
+        ranges = next_ranges
+        length += 1
+    hot_prefixes.sort()
+
+    sections = [
+        offsets(key_bytes), uint32s(key_entries),
+        offsets([prefix for prefix, _ in hot_prefixes]), uint32s([entry for _, top in hot_prefixes for entry in top]),
+        offsets(documents),
+        b''.join(key_bytes), b''.join(prefix for prefix, _ in hot_prefixes), b''.join(documents),
+    ]
+    header = HEADER.pack(MAGIC, version, len(movies), len(keys), len(hot_prefixes), SUGGEST_MAX_LIMIT)
+    return header + b''.join(sections)
+
+
+def offsets(blobs):
+    positions = [0]
+    for blob in blobs:
+        positions.append(positions[-1] + len(blob))
+    return uint32s(positions)
+
+
+def uint32s(values):
+    return struct.pack(f'<{len(values)}I', *values)
+
+
+class TitleIndex:
+    '''Read only view of a serialized index: sorted title keys searched with bisection, the JSON of the
+    suggestions and the precomputed suggestions of the prefixes matching many titles. It reads the bytes or the
+    mmap it is given in place, so workers mapping the same file share its pages'''
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        view = memoryview(buffer)
+        magic, self.version, movies, keys, hot_prefixes, self.top_size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('Not a title index')
+        position = HEADER.size
+
+        def section(size, integers=True):
+            nonlocal position
+            data = view[position:position + size * (4 if integers else 1)]
+            position += len(data)
+            return data.cast('I') if integers else data
+
+        self.key_offsets = section(keys + 1)
+        self.key_entries = section(keys)
+        self.hot_offsets = section(hot_prefixes + 1)
+        self.hot_entries = section(hot_prefixes * self.top_size)
+        self.document_offsets = section(movies + 1)
+        self.keys = section(self.key_offsets[keys], integers=False)
+        self.hot_keys = section(self.hot_offsets[hot_prefixes], integers=False)
+        self.documents = section(self.document_offsets[movies], integers=False)
+
+    def __len__(self):
+        return len(self.document_offsets) - 1
+
+    def suggest(self, prefix, limit=10):
+        '''JSON documents of the best rated movies whose title, or title without its leading article, starts with
+        prefix'''
+        prefix = normalize_title(prefix).encode()
+        hot = self.find(self.hot_keys, self.hot_offsets, prefix)
+        if hot is not None:
+            entries = self.hot_entries[hot * self.top_size:hot * self.top_size + limit].tolist()
+            entries = [entry for entry in entries if entry != NO_ENTRY]
+        else:
+            # UTF-8 has no 0xff byte, every key starting with the prefix sorts before prefix + 0xff
+            start = self.bisect(self.keys, self.key_offsets, prefix)
+            end = self.bisect(self.keys, self.key_offsets, prefix + b'\xff')
+            entries = heapq.nsmallest(limit, set(self.key_entries[start:end].tolist()))
+        return [bytes(self.documents[self.document_offsets[entry]:self.document_offsets[entry + 1]]).decode()
+                for entry in entries]
+
+    @staticmethod
+    def bisect(keys, key_offsets, key):
+        low, high = 0, len(key_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if keys[key_offsets[middle]:key_offsets[middle + 1]].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, keys, key_offsets, key):
+        position = self.bisect(keys, key_offsets, key)
+        if position < len(key_offsets) - 1 and keys[key_offsets[position]:key_offsets[position + 1]] == key:
+            return position
+        return None
+
+
+class TitleIndexRegistry:
+    '''Title index of the current catalog in this worker. The catalog version is checked at most once per
+    refresh_interval seconds and the index is rebuilt when it changed, while another request rebuilds it the
+    previous index keeps answering. Every POST changes the version, so an index is kept for at least
+    rebuild_interval seconds: a stream of writes costs one rebuild per interval instead of one per write. With a
+    directory the index is written there and mapped into memory, so every worker of the host shares a single copy,
+    and an index written by another worker within rebuild_interval is mapped instead of building one'''
+
+    def __init__(self, directory=None, refresh_interval=0, rebuild_interval=0):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.index = None
+        self.checked_at = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def get(self, read_state):
+        # read_state returns the (version, updated_at) of the catalog
+        now = time.monotonic()
+        index = self.index
+        if index is not None and self.checked_at is not None and now - self.checked_at < self.refresh_interval:
+            return index
+        state = read_state()
+        self.checked_at = now
+        if index is not None and index.version == state[0]:
+            return index
+        if index is not None and now - self.loaded_at < self.rebuild_interval:
+            return index
+        # Only the first request waits for the index to be built
+        if self.lock.acquire(blocking=index is None):
+            try:
+                if self.index is None or self.index.version != state[0]:
+                    self.index = self.load(state)
+                    self.loaded_at = time.monotonic()
+            finally:
+                self.lock.release()
+        return self.index
+
+    def expire(self):
+        # A write of this worker is checked for on the next suggestion
+        self.checked_at = None
+
+    def load(self, state):
+        version, updated_at = state
+        if self.directory is None:
+            return TitleIndex(build_index(version, self.read_movies()))
+
+        # The update time tells apart indexes of the same version of a database created again
+        stamp = updated_at.strftime('%Y%m%d%H%M%S%f') if updated_at is not None else '0'
+        path = os.path.join(self.directory, f'title-index-{version}-{stamp}.bin')
+        if not os.path.exists(path):
+            path = self.recent_path() or path
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(file_descriptor, 'wb') as index_file:
+                index_file.write(build_index(version, self.read_movies()))
+            os.replace(temporary_path, path)
+            self.remove_older(version)
+            logger.info('Title index of catalog version %s written to %s', version, path)
+        with open(path, 'rb') as index_file:
+            return TitleIndex(mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def recent_path(self):
+        # Index written by any worker less than rebuild_interval seconds ago, of the latest version
+        if self.rebuild_interval <= 0:
+            return None
+        recent = []
+        for path in glob.glob(os.path.join(self.directory, 'title-index-*.bin')):
+            try:
+                if time.time() - os.path.getmtime(path) < self.rebuild_interval:
+                    recent.append((int(os.path.basename(path).split('-')[2]), path))
+            except (ValueError, OSError):
+                pass
+        return max(recent)[1] if recent else None
+
+    def remove_older(self, version):
+        # Workers still mapping an older index keep reading it after the file is removed
+        for path in glob.glob(os.path.join(self.directory, 'title-index-*.bin')):
+            try:
+                if int(os.path.basename(path).split('-')[2]) < version:
+                    os.remove(path)
+            except (ValueError, OSError):
+                pass
+
+    @staticmethod
+    def read_movies():
+        return db.session.query(Movie.id, Movie.title, Movie.year, Movie.rating).all()
@@ -1,56 +1,140 @@
+import os
+import time
 import uuid
 
 from flask_sqlalchemy import SQLAlchemy
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+from sqlalchemy import event, func, inspect, update
+from sqlalchemy.exc import IntegrityError
 
 db = SQLAlchemy()
 
+# movies.genre_mask is a BIGINT, the sign bit is left unused so masks stay positive
+GENRE_MASK_BITS = 63
+# SQLSTATE of a unique or primary key violation on Postgres
+UNIQUE_VIOLATION = '23505'
+
 
 def generate_uuid():
-    return str(uuid.uuid4())
-
-def generate_uuid_genre():
-    while True:
-        new_uuid = generate_uuid()
-        existing_movie = Genre.query.filter_by(id=new_uuid).first()
-        if not existing_movie:
-            return new_uuid
-
-def generate_uuid_movie():
-    while True:
-        new_uuid = generate_uuid()
-        existing_movie = Movie.query.filter_by(id=new_uuid).first()
-        if not existing_movie:
-            return new_uuid
+    '''Time ordered UUIDv7 (RFC 9562): 48 bits of Unix milliseconds followed by 74 random bits. Ids created
+    together land next to each other in the primary key index instead of on random pages, and the 74 random bits
+    make a collision within a millisecond unlikely enough to be handled as a retry instead of checked for'''
+    value = time.time_ns() // 1_000_000 << 80 | int.from_bytes(os.urandom(10), 'big')
+    # Version 7 and RFC 4122 variant bits
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return str(uuid.UUID(int=value))
+
+def commit_with_retry(write, attempts=3):
+    '''Runs write() and commits, running it again with new ids when the commit violates a unique constraint.
+    Other violations aren't solved by new ids and are raised right away'''
+    for attempt in range(attempts):
+        try:
+            result = write()
+            db.session.commit()
+            return result
+        except IntegrityError as e:
+            db.session.rollback()
+            if attempt == attempts - 1 or not is_unique_violation(e):
+                raise
+
+def is_unique_violation(error):
+    pgcode = getattr(error.orig, 'pgcode', None)
+    if pgcode is not None:
+        return pgcode == UNIQUE_VIOLATION
+    # SQLite has no SQLSTATE, its primary key violations are reported as unique ones too
+    return 'UNIQUE constraint failed' in str(error.orig)
 
 movie_genre_association = db.Table(
     'movie_genres',
     db.Column("movie_id", db.String(36), db.ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True),
-    db.Column("genre_id", db.String(36), db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True)
+    db.Column("genre_id", db.String(36), db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Index("idx_movie_genres_genre_movie_id", "genre_id", "movie_id")
 )
 
 class Genre(db.Model):
     __tablename__ = "genres"
     #id = db.Column(db.String(36), default=db.text("uuid_generate_v4()"), primary_key=True) #exclusive to postgress
-    id = db.Column(db.String(36), default=generate_uuid_genre, primary_key=True)
+    id = db.Column(db.String(36), default=generate_uuid, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
+    # Bit of the genre in Movie.genre_mask, None once the 63 bits are taken
+    bit = db.Column(db.SmallInteger, unique=True)
     movies = db.relationship("Movie", secondary=movie_genre_association, back_populates='genres')
 
 class Movie(db.Model):
     __tablename__ = "movies"
-    id = db.Column(db.String(36), default=generate_uuid_movie, primary_key=True)
+    id = db.Column(db.String(36), default=generate_uuid, primary_key=True)
     title = db.Column(db.String(300), nullable=False)
     year = db.Column(db.Integer)
     rating = db.Column(db.Float)
     runtime = db.Column(db.Integer)
     imdb_id = db.Column(db.String(15))
+    genre_mask = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     genres = db.relationship("Genre", secondary=movie_genre_association, back_populates='movies')
+    # Same indexes as sql-scripts/01_create_movie_table.sql, one (sort field, id) index per sort of GET /movies
+    __table_args__ = (
+        db.Index("idx_movies_title_id", "title", "id"),
+        db.Index("idx_movies_year_id", "year", "id"),
+        db.Index("idx_movies_rating_id", "rating", "id"),
+    )
+
+class CatalogState(db.Model):
+    # Single row whose version is bumped on every write of the catalog, by the data-loader after a load and by
+    # POST /movies, so responses cached by catalog version are never served after a write
+    __tablename__ = "catalog_state"
+    id = db.Column(db.SmallInteger, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
+def get_catalog_state():
+    '''(version, updated_at) of the catalog, (0, None) until the first write'''
+    state = db.session.query(CatalogState.version, CatalogState.updated_at).filter_by(id=1).first()
+    return tuple(state) if state is not None else (0, None)
+
+def bump_catalog_version():
+    '''Returns the new version. Part of the transaction of the write, the new version is only visible once it
+    commits and the row stays locked until then'''
+    version = db.session.execute(
+        update(CatalogState).where(CatalogState.id == 1)
+        .values(version=CatalogState.version + 1, updated_at=func.now())
+        .returning(CatalogState.version)).scalar()
+    if version is None:
+        db.session.add(CatalogState(id=1, version=1))
+        version = 1
+    return version
+
+
+def get_genre_mask(genres):
+    mask = 0
+    for genre in genres:
+        if genre.bit is not None:
+            mask |= 1 << genre.bit
+    return mask
 
+@event.listens_for(db.session, 'before_flush')
+def sync_genre_masks(session, flush_context, instances):
+    # New genres take the lowest free bit and movies whose genres changed get their mask recomputed, so rows
+    # written through the API stay in sync with the ones written by the data-loader
+    new_genres = [obj for obj in session.new if isinstance(obj, Genre) and obj.bit is None]
+    if new_genres:
+        with session.no_autoflush:
+            used_bits = {bit for (bit,) in session.query(Genre.bit).filter(Genre.bit.isnot(None))}
+        used_bits.update(obj.bit for obj in session.new if isinstance(obj, Genre) and obj.bit is not None)
+        free_bits = sorted(set(range(GENRE_MASK_BITS)) - used_bits, reverse=True)
+        for genre in new_genres:
+            if free_bits:
+                genre.bit = free_bits.pop()
+    for movie in list(session.new) + list(session.dirty):
+        if isinstance(movie, Movie) and (movie in session.new or inspect(movie).attrs.genres.history.has_changes()):
+            movie.genre_mask = get_genre_mask(movie.genres)
 
 class GenreSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Genre
+        exclude = ("bit",)
 
 class MovieSchema(SQLAlchemyAutoSchema):
     class Meta:
-        model = Movie
\ No newline at end of file
+        model = Movie
+        exclude = ("genre_mask",)
\ No newline at end of file
@@ -0,0 +1,9 @@
+from flask import current_app
+from flask_restful import Resource
+
+
+class CacheStatsResource(Resource):
+
+    def get(self):
+        '''Entries, size and hit/miss counters of the response cache'''
+        return current_app.extensions['response_cache'].stats()
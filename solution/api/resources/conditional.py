@@ -0,0 +1,42 @@
+import hashlib
+from datetime import timezone
+
+from flask import Response, request
+
+
+def make_etag(version, key, variant=None):
+    '''Strong ETag of a response: the body only changes with the catalog version, the normalized query and how
+    it is rendered (variant)'''
+    return hashlib.sha1(repr((version, variant) + key).encode()).hexdigest()
+
+
+def as_utc(updated_at):
+    # catalog_state.updated_at is a TIMESTAMPTZ on Postgres, SQLite returns it naive in UTC
+    if updated_at is None:
+        return None
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at.replace(microsecond=0)
+
+
+def is_not_modified(etag, updated_at):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2) and uses the weak comparison, proxies
+    # that compress a response send back the ETag prefixed with W/
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and updated_at is not None:
+        return updated_at <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag, updated_at, max_age):
+    response.set_etag(etag)
+    if updated_at is not None:
+        response.last_modified = updated_at
+    # Clients and CDNs may reuse the page for max_age seconds and must revalidate it afterwards
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, must-revalidate'
+    return response
+
+
+def not_modified_response(etag, updated_at, max_age):
+    return set_validators(Response(status=304), etag, updated_at, max_age)
@@ -0,0 +1,24 @@
+from itsdangerous import BadSignature, URLSafeSerializer
+
+CURSOR_SALT = 'movies-cursor'
+
+
+def get_serializer(secret_key):
+    return URLSafeSerializer(secret_key, salt=CURSOR_SALT)
+
+
+def encode_cursor(secret_key, sort_field, descending, sort_value, movie_id):
+    '''Signed token with the (sort value, id) of the last row of a page'''
+    return get_serializer(secret_key).dumps([sort_field, descending, sort_value, movie_id])
+
+
+def decode_cursor(secret_key, token, sort_field, descending):
+    '''Returns the (sort value, id) anchor of the token, raises ValueError if it was tampered with or it was
+    issued for another sort'''
+    try:
+        cursor_sort_field, cursor_descending, sort_value, movie_id = get_serializer(secret_key).loads(token)
+    except (BadSignature, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort_field != sort_field or cursor_descending != descending:
+        raise ValueError('Cursor issued for another sort')
+    return sort_value, movie_id
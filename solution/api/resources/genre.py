@@ -1,12 +1,15 @@
+from flask import Response
 from flask_restful import Resource
 
-from models.main import GenreSchema, Genre
+from resources.movie import cached_response, get_genre_catalog
 
 
 class GenreResource(Resource):
 
     def get(self):
-        genres_schema = GenreSchema(many=True)
         '''List all genres'''
-        genres = Genre.query.all()
-        return genres_schema.dump(genres)
+        return cached_response(('genres',), self.get_genres_response)
+
+    def get_genres_response(self):
+        # Prebuilt by the genre registry once per catalog version
+        return Response(get_genre_catalog().body, status=200, mimetype='application/json')
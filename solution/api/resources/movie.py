@@ -1,27 +1,50 @@
-import sqlalchemy
-from flask import request
+import json
+import operator
+import time
+from flask import Response, current_app, g, request
 from flask_restful import Resource
-from sqlalchemy import desc
-from sqlalchemy.orm import joinedload
+from sqlalchemy import asc, desc, false, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, make_transient_to_detached
 import re
 
-from models.main import MovieSchema, Movie, Genre, db
+from models.main import Movie, Genre, bump_catalog_version, commit_with_retry, db, get_catalog_state, \
+    is_unique_violation, movie_genre_association
+from resources.conditional import as_utc, is_not_modified, make_etag, not_modified_response, set_validators
+from resources.cursor import decode_cursor, encode_cursor
+from resources.search import SEARCH_MAX_LENGTH, SEARCH_MIN_LENGTH, title_search
+from resources.serializer import json_documents_response, json_response, movie_json_document, serialize_movie, \
+    serialize_movie_rows
+from resources.total import count_total, total_headers
+
+# Columns of the rows serialize_movie_rows renders
+MOVIE_LIST_COLUMNS = [Movie.id, Movie.title, Movie.year, Movie.rating, Movie.runtime, Movie.imdb_id, Movie.genre_mask]
+# Fields of a posted movie, the IMDb id is extracted from a link in the format "https://www.imdb.com/title/<imdb_id>/"
+MOVIE_FIELDS = {'title', 'year', 'rating', 'runtime', 'imdb_link', 'genres'}
+IMDB_LINK_PATTERN = re.compile(r'https://www.imdb.com/title/(\w+)(?:/)?')
 
 
 class MovieResource(Resource):
 
     def get(self):
-        movies_schema = MovieSchema(many=True)
         '''List all movies with sorting, filtering, and keyset pagination'''
         query_params = request.args.to_dict()
 
+        # Extract and validate the title search, its results are sorted by relevance unless another sort is given
+        q = query_params.get('q', '').strip() or None
+        if q is not None and not SEARCH_MIN_LENGTH <= len(q) <= SEARCH_MAX_LENGTH:
+            return {'message': f'q must have between {SEARCH_MIN_LENGTH} and {SEARCH_MAX_LENGTH} characters'}, 400
+
         # Extract and validate sorting parameters
-        valid_sort_fields = ['title', 'year', 'rating']
-        sort_field = query_params.get('sort', 'title')
+        valid_sort_fields = ['title', 'year', 'rating'] + (['relevance'] if q is not None else [])
+        sort_field = query_params.get('sort', 'relevance' if q is not None else 'title')
         if sort_field not in valid_sort_fields:
             return {'message': 'Invalid sort field'}, 400
 
         # Extract and validate filtering parameters
+        genre_match = query_params.get('genre_match', 'all')
+        if genre_match not in ['all', 'any']:
+            return {'message': 'Invalid genre_match, it must be all or any'}, 400
         filter_params = {}
         valid_filter_fields = ['genre', 'rating_gt']
         for key, value in query_params.items():
@@ -29,121 +52,342 @@ class MovieResource(Resource):
                 filter_params[key] = value
 
         # Extract and validate keyset pagination parameters
-        valid_pagination_fields = ['id', 'title', 'year', 'rating']
+        valid_pagination_fields = ['id', 'title', 'year', 'rating', 'relevance']
         after_id = query_params.get('after_id')
         if after_id and sort_field not in valid_pagination_fields:
             return {'message': 'Invalid pagination field for keyset pagination'}, 400
 
-        # Build the query based on sorting and filtering parameters
-        query = Movie.query
-
-        for key, value in filter_params.items():
-            if key == 'genre':
-                query = query.join(Movie.genres).filter(Genre.name == value)
-            elif key == 'rating_gt':
-                query = query.filter(Movie.rating > float(value))
-
-        # Apply sorting as there are fields with no unique values add a second field to ensure being deterministic
-        # Implement keyset pagination
-        # Use a subquery to get the value of the sorting field for the specified after_id
-        if 'desc' not in query_params.keys():
-            if after_id:
-                subquery = Movie.query.filter(Movie.id == after_id).subquery()
-                query = query.filter(sqlalchemy.or_(
-                    getattr(Movie, sort_field) > subquery.c[sort_field],
-                    sqlalchemy.and_(
-                        getattr(Movie, sort_field) == subquery.c[sort_field],
-                        Movie.id > subquery.c.id
-                    )
-                )).params(after_id=after_id)
-            query = query.order_by(getattr(Movie, sort_field), Movie.id)
-        else:
-            if after_id:
-                subquery = Movie.query.filter(Movie.id == after_id).subquery()
-                query = query.filter(sqlalchemy.or_(
-                    getattr(Movie, sort_field) < subquery.c[sort_field],
-                    sqlalchemy.and_(
-                        getattr(Movie, sort_field) == subquery.c[sort_field],
-                        Movie.id > subquery.c.id
-                    )
-                )).params(after_id=after_id)
-            query = query.order_by(desc(getattr(Movie, sort_field)), Movie.id)
         page_size = query_params.get('page_size')
         if not page_size or not page_size.isdigit():
             page_size=10
-        # Retrieve and paginate the results taking genres in eager mode
-        movies = query.options(joinedload(Movie.genres)).limit(int(page_size)).all()  # Adjust the limit as needed
+        page_size = int(page_size)
+        descending = 'desc' in query_params.keys()
+        include_total = 'include_total' in query_params.keys()
+        genre_names = None
+        if 'genre' in filter_params:
+            genre_names = tuple(sorted({name.strip() for name in filter_params['genre'].split(',')}))
+
+        # Requests differing only in parameter order, desc values or genre order share the cached page
+        cache_key = ('movies', sort_field, descending, genre_names, genre_match if genre_names else None,
+                     filter_params.get('rating_gt'), page_size, query_params.get('cursor'), after_id,
+                     q.lower() if q is not None else None, include_total)
+        return cached_response(cache_key, lambda: self.get_page_response(
+            sort_field, descending, genre_names, genre_match, filter_params.get('rating_gt'), page_size,
+            query_params.get('cursor'), after_id, q, include_total))
+
+    def get_page_response(self, sort_field, descending, genre_names, genre_match, rating_gt, page_size, cursor,
+                          after_id, q=None, include_total=False):
+        search_filter = None
+        if q is not None:
+            # The genre and rating filters are applied before the candidates are bounded, or the nearest titles
+            # could all be filtered out afterwards
+            search_filter, rank = title_search(q, db.engine.dialect.name, lambda candidate: filter_movies(
+                candidate, genre_names, genre_match, rating_gt, None))
+        if sort_field == 'relevance':
+            sort_column = rank.label('relevance')
+        else:
+            sort_column = getattr(Movie, sort_field)
+
+        # Build the query based on sorting and filtering parameters. The list is read only, so it selects the
+        # response columns as plain rows instead of hydrating Movie instances, or with database JSON rendering
+        # the id, the sort value and the movie already rendered as JSON
+        render_in_database = current_app.config['DB_JSON_RENDERING'] and db.engine.dialect.name == 'postgresql'
+        if render_in_database:
+            query = select(Movie.id, sort_column, movie_json_document())
+        else:
+            query = select(*MOVIE_LIST_COLUMNS)
+            if sort_field == 'relevance':
+                query = query.add_columns(sort_column)
 
-        serialized_movies = movies_schema.dump(movies)
-        # genres aren't serializing as they should. this is a workaround
-        for serialized_movie, movie in zip(serialized_movies, movies):
-            custom_serialize(movie, serialized_movie)
-        
-        return serialized_movies
+        query = filter_movies(query, genre_names, genre_match, rating_gt, search_filter)
+
+        # The page starts after an anchor (sort value, id). A cursor carries it signed so no row has to be looked
+        # up, the anchor of after_id is read once
+        anchor = None
+        if cursor is not None:
+            try:
+                anchor = decode_cursor(current_app.config['SECRET_KEY'], cursor, sort_field, descending)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+        elif after_id:
+            anchor = db.session.query(sort_column, Movie.id).filter(Movie.id == after_id).first()
+            if anchor is None:
+                return []
+            anchor = tuple(anchor)
+
+        # Retrieve one row more than the page to know if there is a next one
+        movies = get_page(query, sort_column, descending, anchor, page_size + 1, sort_field != 'relevance')
+        has_next_page = len(movies) > page_size
+        movies = movies[:page_size]
+        headers = {}
+        if has_next_page and movies:
+            headers['X-Next-Cursor'] = encode_cursor(current_app.config['SECRET_KEY'], sort_field, descending,
+                                                     getattr(movies[-1], sort_field), movies[-1].id)
+        if include_total:
+            headers.update(get_total_headers(genre_names, genre_match, rating_gt, q, search_filter))
+
+        if render_in_database:
+            return json_documents_response([movie.document for movie in movies], 200, headers)
+
+        # Genres are rendered from genre_mask, unless there are genres without bit which have to be read from
+        # movie_genres
+        genre_catalog = get_genre_catalog()
+        if genre_catalog.has_unmasked:
+            genres_by_movie = get_movie_genres([movie.id for movie in movies])
+            serialized_movies = serialize_movie_rows(movies, genres_by_movie=genres_by_movie)
+        else:
+            serialized_movies = serialize_movie_rows(movies, genre_names=genre_catalog.genre_bits)
+        return json_response(serialized_movies, 200, headers)
 
     def post(self):
-        movies_schema = MovieSchema(many=False)
         '''Create a new movie'''
-        data = request.json
-
-        # Extract genres from the request data
-        genres_data = data.pop('genres', [])
-        if 'imdb_link' in data.keys():
-            # Assuming the URL is in the format "https://www.imdb.com/title/<imdb_id>/"
-            imdb_url = data['imdb_link']
-
-            # Extract IMDb ID using regular expression
-            match = re.search(r'https://www.imdb.com/title/(\w+)(?:/)?', imdb_url)
-            if match:
-                imdb_id = match.group(1)
-                data['imdb_id'] = imdb_id
-                data.pop('imdb_link')
-            else:
-                # Handle the case where the URL doesn't match the expected format
-                # You can raise an exception, log an error, or handle it as needed
-                return {'message': 'Invalid IMDb URL format'}, 400
+        # Validated as every movie of POST /movies/bulk, only a single movie may be given its id
+        movie, errors = validate_movie(request.get_json(silent=True), MOVIE_FIELDS | {'id'})
+        if errors:
+            return {'message': 'Invalid movie', 'errors': errors}, 400
+
+        try:
+            serialized_movie, new_version, created_genres = commit_with_retry(lambda: self.insert_movie(movie))
+        except IntegrityError as e:
+            if not is_unique_violation(e):
+                return {'message': 'The movie violates a constraint of the catalog'}, 400
+            return {'message': 'The movie conflicts with an existing one'}, 409
+        if not created_genres:
+            current_app.extensions['genre_registry'].advance(new_version - 1, new_version)
+        # The write is visible right away in this worker even when the catalog version is only read periodically
+        current_app.extensions.pop('catalog_state', None)
+        current_app.extensions['title_index'].expire()
+
+        return json_response(serialized_movie, 201)
+
+    def insert_movie(self, movie):
+        # Bumping the version first locks the catalog row until the commit, so no load can change the genres
+        # meanwhile and the registry holding the genres of the previous version is current
+        new_version = bump_catalog_version()
+        genre_catalog = current_app.extensions['genre_registry'].get(new_version - 1)
 
         # Create a new movie without genres
-        new_movie = Movie(**data)
+        new_movie = Movie(**{field: value for field, value in movie.items() if field != 'genres'})
 
         db.session.add(new_movie)
 
-        # Add genres to the new movie
-        for genre_data in genres_data:
-            print(genre_data['name'])
-            genre = Genre.query.filter_by(name=genre_data['name']).first()
-            if not genre:
-                genre = Genre(name=genre_data['name'])
+        # Add genres to the new movie, existing ones are attached by id without being read
+        created_genres = False
+        for name in movie['genres']:
+            if name in genre_catalog.by_name:
+                genre_id, bit = genre_catalog.by_name[name]
+                genre = Genre(id=genre_id, name=name, bit=bit)
+                make_transient_to_detached(genre)
+                genre = db.session.merge(genre, load=False)
+            else:
+                genre = Genre(name=name)
                 db.session.add(genre)
+                created_genres = True
             new_movie.genres.append(genre)
-        db.session.commit()
-        serialized_movie = movies_schema.dump(new_movie)
-        custom_serialize(new_movie, serialized_movie)
+        # Serialized before the commit expires the movie, which would read it and its genres back
+        db.session.flush()
+        return serialize_movie(new_movie), new_version, created_genres
+
 
-        return serialized_movie, 201
+def validate_movie(item, fields=MOVIE_FIELDS):
+    '''Returns the movie in the shape of a movies row, with the names of its genres, and the list of errors of
+    the item'''
+    if not isinstance(item, dict):
+        return None, ['Expected a movie object']
+    errors = [f'Unknown field {field}' for field in sorted(set(item) - fields)]
+    title = item.get('title')
+    if not isinstance(title, str) or not title.strip() or len(title) > 300:
+        errors.append('title is required and must be a string of at most 300 characters')
+    for field in ['year', 'runtime']:
+        if item.get(field) is not None and (not isinstance(item[field], int) or isinstance(item[field], bool)
+                                            or item[field] < 1):
+            errors.append(f'{field} must be a positive integer')
+    rating = item.get('rating')
+    if rating is not None and (not isinstance(rating, (int, float)) or isinstance(rating, bool)
+                               or not 0 <= rating <= 10):
+        errors.append('rating must be a number between 0 and 10')
+    imdb_id = None
+    if item.get('imdb_link') is not None:
+        match = IMDB_LINK_PATTERN.search(item['imdb_link']) if isinstance(item['imdb_link'], str) else None
+        if match and len(match.group(1)) <= 15:
+            imdb_id = match.group(1)
+        else:
+            errors.append('Invalid IMDb URL format')
+    genre_names = []
+    genres = item.get('genres', [])
+    if not isinstance(genres, list):
+        errors.append('genres must be a list')
+        genres = []
+    for genre in genres:
+        name = genre.get('name') if isinstance(genre, dict) else None
+        if not isinstance(name, str) or not name or len(name) > 50:
+            errors.append('Every genre must have a name of at most 50 characters')
+        elif name not in genre_names:
+            genre_names.append(name)
+    movie = {'title': title, 'year': item.get('year'), 'rating': rating, 'runtime': item.get('runtime'),
+             'imdb_id': imdb_id, 'genres': genre_names}
+    if 'id' in fields and item.get('id') is not None:
+        if isinstance(item['id'], str) and 0 < len(item['id']) <= 36:
+            movie['id'] = item['id']
+        else:
+            errors.append('id must be a string of at most 36 characters')
+    return movie, errors
 
 
 class MovieSingleResource(Resource):
     def get(self, movie_id):
-        movie_schema = MovieSchema(many=False)
         '''Get a single movie by its ID'''
+        return cached_response(('movie', movie_id), lambda: self.get_movie_response(movie_id))
+
+    def get_movie_response(self, movie_id):
         movie = Movie.query.options(joinedload(Movie.genres)).get(movie_id)
 
         if not movie:
             return {'message': 'Movie not found'}, 404
 
-        # Manually construct the serialized output with genres
-        serialized_movie = movie_schema.dump(movie)
-        custom_serialize(movie, serialized_movie)
+        return json_response(serialize_movie(movie))
+
+def cached_response(key, render):
+    # Pages are cached per catalog version, reading it is a primary key lookup that replaces the page query and
+    # its serialization on a hit. A request revalidating the current ETag gets a 304 without reaching the cache.
+    # Only successful responses are cached
+    # Read afresh for each request, g outlives a request run inside an app context pushed beforehand (the tests)
+    g.pop('catalog_state', None)
+    version, updated_at = read_catalog_state()
+    updated_at = as_utc(updated_at)
+    etag = make_etag(version, key, current_app.config['DB_JSON_RENDERING'])
+    max_age = current_app.config['CACHE_CONTROL_MAX_AGE']
+    if is_not_modified(etag, updated_at):
+        return not_modified_response(etag, updated_at, max_age)
+
+    response_cache = current_app.extensions['response_cache']
+    response_cache.sync_version(version)
+    key = (version,) + key
+    cached = response_cache.get(key)
+    if cached is not None:
+        response = Response(cached.body, status=200, headers=cached.headers, mimetype='application/json')
+        return set_validators(response, etag, updated_at, max_age)
+    response = render()
+    if isinstance(response, Response) and response.status_code == 200:
+        headers = {name: value for name, value in response.headers.items()
+                   if name not in ('Content-Type', 'Content-Length')}
+        response_cache.set(key, response.get_data(), headers)
+        set_validators(response, etag, updated_at, max_age)
+    return response
+
+def get_genre_catalog():
+    return current_app.extensions['genre_registry'].get(read_catalog_state()[0])
+
+def read_catalog_state():
+    # With CATALOG_VERSION_TTL the version is read at most once per interval in each worker: cached pages and
+    # 304s are then served without touching the database, at the cost of serving the previous catalog for up to
+    # that long after a write made by another process
+    if 'catalog_state' in g:
+        return g.catalog_state
+    ttl = current_app.config['CATALOG_VERSION_TTL']
+    state = current_app.extensions.get('catalog_state')
+    now = time.monotonic()
+    if ttl > 0 and state is not None and now - state[0] < ttl:
+        g.catalog_state = state[1:]
+    else:
+        g.catalog_state = get_catalog_state()
+        current_app.extensions['catalog_state'] = (now,) + g.catalog_state
+    return g.catalog_state
+
+def filter_movies(query, genre_names, genre_match, rating_gt, search_filter, by_mask=True):
+    if search_filter is not None:
+        query = query.filter(search_filter)
+    if genre_names is not None:
+        query = filter_genres(query, list(genre_names), genre_match == 'any', by_mask)
+    if rating_gt is not None:
+        query = query.filter(Movie.rating > float(rating_gt))
+    return query
+
+def get_total_headers(genre_names, genre_match, rating_gt, q, search_filter):
+    # The total only depends on the filters, every page and sort of a filter shares it until the catalog changes
+    response_cache = current_app.extensions['response_cache']
+    key = (read_catalog_state()[0], 'total', genre_names, genre_match if genre_names else None, rating_gt,
+           q.lower() if q is not None else None)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return total_headers(*json.loads(cached.body))
+    # The planner has statistics for movie_genres.genre_id but not for the bits of genre_mask, the estimate
+    # matches the genres through movie_genres
+    total, exact = count_total(
+        filter_movies(select(Movie.id), genre_names, genre_match, rating_gt, search_filter),
+        filter_movies(select(Movie.id), genre_names, genre_match, rating_gt, search_filter, by_mask=False),
+        db.engine.dialect.name)
+    response_cache.set(key, json.dumps([total, exact]).encode())
+    return total_headers(total, exact)
+
+def filter_genres(query, names, match_any, by_mask=True):
+    # Genres with a bit are matched on genre_mask, no join needed. Genres without one (past the 63 bits) are
+    # matched through movie_genres by id, all of them without by_mask. So are selective genres: the planner has
+    # no statistics for the bits, it would walk the whole sort index for a genre with a few hundred movies
+    # instead of reading them from the (genre_id, movie_id) index and sorting them. A match on any genre only
+    # does so when every genre is selective
+    version = read_catalog_state()[0]
+    genre_registry = current_app.extensions['genre_registry']
+    by_name = genre_registry.get(version).by_name
+    known_names = [name for name in names if name in by_name]
+    selective = genre_registry.get_selective(version) if by_mask else frozenset()
+    by_join = frozenset() if match_any and not set(known_names) <= selective else selective
+    genre_bits = {name: by_name[name][1] if by_mask and name not in by_join else None for name in known_names}
+    mask = 0
+    unmasked_names = []
+    for name in set(names) & set(genre_bits):
+        if genre_bits[name] is None:
+            unmasked_names.append(name)
+        else:
+            mask |= 1 << genre_bits[name]
+    if match_any:
+        conditions = []
+        if mask:
+            conditions.append(Movie.genre_mask.op('&')(mask) != 0)
+        if unmasked_names:
+            conditions.append(with_genres([by_name[name][0] for name in unmasked_names]))
+        return query.filter(or_(*conditions) if conditions else false())
+    if set(names) - set(genre_bits):
+        # A movie can't have a genre that doesn't exist
+        return query.filter(false())
+    if mask:
+        query = query.filter(Movie.genre_mask.op('&')(mask) == mask)
+    for name in unmasked_names:
+        query = query.filter(with_genres([by_name[name][0]]))
+    return query
 
-        return serialized_movie
+def with_genres(genre_ids):
+    # An IN on movie_genres rather than an EXISTS correlated to each movie, so the movies can be read from the
+    # (genre_id, movie_id) index instead of checked one by one while walking the sort index
+    return Movie.id.in_(select(movie_genre_association.c.movie_id)
+                        .where(movie_genre_association.c.genre_id.in_(genre_ids)))
 
-def serialize_imbd_reference(serialized_movie):
-    if 'imdb_id' in serialized_movie.keys():
-        if serialized_movie['imdb_id'] is not None:
-            serialized_movie['imdb_link'] = f"https://www.imdb.com/title/{serialized_movie['imdb_id']}/"
-        serialized_movie.pop('imdb_id')
+def get_page(query, sort_column, descending, anchor, limit, nullable=True):
+    # Rows are ordered by (sort value, id) in a single direction so a page is one row-value comparison a
+    # (sort value, id) index can serve. Rows without sort value go after the rest ordered by id, the relevance of
+    # a title search is never null and skips that query
+    compare = operator.lt if descending else operator.gt
+    order = desc if descending else asc
+    movies = []
+    if anchor is None or anchor[0] is not None:
+        page_query = query.filter(sort_column.isnot(None)) if nullable else query
+        if anchor is not None:
+            page_query = page_query.filter(compare(tuple_(sort_column, Movie.id), tuple_(*anchor)))
+        movies = db.session.execute(page_query.order_by(order(sort_column), order(Movie.id)).limit(limit)).all()
+    if nullable and len(movies) < limit:
+        null_query = query.filter(sort_column.is_(None))
+        if anchor is not None and anchor[0] is None:
+            null_query = null_query.filter(compare(Movie.id, anchor[1]))
+        movies += db.session.execute(null_query.order_by(order(Movie.id)).limit(limit - len(movies))).all()
+    return movies
 
-def custom_serialize(movie, serialized_movie):
-    serialized_movie['genres'] = [{'name': genre.name} for genre in movie.genres]
-    serialize_imbd_reference(serialized_movie)
\ No newline at end of file
+def get_movie_genres(movie_ids):
+    # Genres of the movies of a page, loaded by movie id through the movie_genres primary key
+    genres_by_movie = {}
+    rows = db.session.execute(
+        select(movie_genre_association.c.movie_id, Genre.name)
+        .join(Genre, Genre.id == movie_genre_association.c.genre_id)
+        .where(movie_genre_association.c.movie_id.in_(movie_ids)))
+    for movie_id, name in rows:
+        genres_by_movie.setdefault(movie_id, []).append({'name': name})
+    return genres_by_movie
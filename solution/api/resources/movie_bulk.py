@@ -0,0 +1,102 @@
+import json
+
+from flask import current_app, request
+from flask_restful import Resource
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from models.main import GENRE_MASK_BITS, Genre, Movie, bump_catalog_version, commit_with_retry, db, \
+    generate_uuid, is_unique_violation, movie_genre_association
+from resources.movie import validate_movie
+from resources.serializer import json_response
+
+# Movies accepted in a single request
+BULK_MAX_MOVIES = 10000
+
+
+class MovieBulkResource(Resource):
+
+    def post(self):
+        '''Create a batch of movies given as a JSON array or as NDJSON, all of them or none'''
+        try:
+            items = read_items()
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        if len(items) > BULK_MAX_MOVIES:
+            return {'message': f'At most {BULK_MAX_MOVIES} movies per request'}, 400
+
+        # The whole batch is validated before writing anything
+        movies = []
+        results = []
+        for index, item in enumerate(items):
+            movie, errors = validate_movie(item)
+            movies.append(movie)
+            results.append({'index': index, 'errors': errors} if errors else {'index': index})
+        if any('errors' in result for result in results):
+            return json_response(results, 400)
+
+        try:
+            new_version, created_genres = commit_with_retry(lambda: self.insert_movies(movies, results))
+        except IntegrityError as e:
+            if not is_unique_violation(e):
+                return {'message': 'The batch violates a constraint of the catalog'}, 400
+            return {'message': 'The batch conflicts with existing movies or genres'}, 409
+        if not created_genres:
+            current_app.extensions['genre_registry'].advance(new_version - 1, new_version)
+        current_app.extensions.pop('catalog_state', None)
+        current_app.extensions['title_index'].expire()
+
+        return json_response(results, 201)
+
+    def insert_movies(self, movies, results):
+        # As in POST /movies, bumping the version locks the catalog until the commit and the genre registry of the
+        # previous version resolves every genre of the batch without a query
+        new_version = bump_catalog_version()
+        genre_catalog = current_app.extensions['genre_registry'].get(new_version - 1)
+        genres = dict(genre_catalog.by_name)
+        genre_rows = []
+        free_bits = sorted(set(range(GENRE_MASK_BITS)) - {bit for _, bit in genres.values() if bit is not None},
+                           reverse=True)
+        for movie in movies:
+            for name in movie['genres']:
+                if name not in genres:
+                    genres[name] = (generate_uuid(), free_bits.pop() if free_bits else None)
+                    genre_rows.append({'id': genres[name][0], 'name': name, 'bit': genres[name][1]})
+
+        movie_rows = []
+        movie_genre_rows = []
+        for movie, result in zip(movies, results):
+            movie_id = generate_uuid()
+            genre_mask = 0
+            for name in movie['genres']:
+                genre_id, bit = genres[name]
+                if bit is not None:
+                    genre_mask |= 1 << bit
+                movie_genre_rows.append({'movie_id': movie_id, 'genre_id': genre_id})
+            movie_rows.append({'id': movie_id, 'title': movie['title'], 'year': movie['year'],
+                               'rating': movie['rating'], 'runtime': movie['runtime'], 'imdb_id': movie['imdb_id'],
+                               'genre_mask': genre_mask})
+            result['id'] = movie_id
+
+        # One executemany per table in a single transaction
+        if genre_rows:
+            db.session.execute(insert(Genre.__table__), genre_rows)
+        db.session.execute(insert(Movie.__table__), movie_rows)
+        if movie_genre_rows:
+            db.session.execute(insert(movie_genre_association), movie_genre_rows)
+        return new_version, len(genre_rows)
+
+
+def read_items():
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        try:
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid NDJSON: {e}')
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise ValueError('Expected a JSON array of movies')
+    if not items:
+        raise ValueError('No movies given')
+    return items
@@ -0,0 +1,66 @@
+import re
+
+from sqlalchemy import Float, case, func, select, union
+
+from models.main import Movie
+
+# Default pg_trgm.similarity_threshold, the one the % operator filters with
+SIMILARITY_THRESHOLD = 0.3
+SEARCH_MIN_LENGTH = 2
+SEARCH_MAX_LENGTH = 100
+# Titles nearest to q read for each of the prefix and the similarity matches, the relevance of at most twice as many
+# movies is ranked and sorted for a page
+SEARCH_CANDIDATES = 1000
+
+
+def title_search(q, dialect_name, filter_candidates=None):
+    '''(filter, rank) of the movies whose title starts with q or is similar to it, the SEARCH_CANDIDATES nearest
+    to q of each. filter_candidates applies the other filters of the request to each candidate query, so the
+    nearest are taken among the movies they keep. Titles starting with q rank first, then every title ranks by
+    trigram distance to q, lower ranks first'''
+    prefix = Movie.title.ilike(escape_like(q) + '%', escape='\\')
+    if dialect_name == 'postgresql':
+        # The gist_trgm_ops index on movies.title answers the ILIKE and the % operator and returns the titles
+        # nearest first (ORDER BY title <-> q), so each candidate query stops after SEARCH_CANDIDATES entries
+        # instead of ranking every match
+        similar = Movie.title.op('%')(q)
+        distance = Movie.title.op('<->', return_type=Float)(q)
+    else:
+        # similarity is registered on SQLite connections by register_sqlite_functions
+        similar = func.similarity(Movie.title, q) >= SIMILARITY_THRESHOLD
+        distance = 1 - func.similarity(Movie.title, q)
+    candidates = []
+    for condition in (prefix, similar):
+        candidate = select(Movie.id).where(condition)
+        if filter_candidates is not None:
+            candidate = filter_candidates(candidate)
+        candidates.append(candidate.order_by(distance).limit(SEARCH_CANDIDATES).subquery())
+    search_filter = Movie.id.in_(union(*[select(candidate.c.id) for candidate in candidates]))
+    return search_filter, case((prefix, 0.0), else_=1.0) + distance
+
+
+def escape_like(value):
+    return re.sub(r'([\\%_])', r'\\\1', value)
+
+
+def trigrams(text):
+    # Same trigrams as pg_trgm: every alphanumeric word lowercased and padded with two spaces before and one after
+    result = set()
+    for word in re.findall(r'[^\W_]+', text.lower()):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a, b):
+    '''pg_trgm similarity: shared trigrams over the trigrams of either string'''
+    if a is None or b is None:
+        return None
+    trigrams_a, trigrams_b = trigrams(a), trigrams(b)
+    if not trigrams_a or not trigrams_b:
+        return 0.0
+    return len(trigrams_a & trigrams_b) / len(trigrams_a | trigrams_b)
+
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    dbapi_connection.create_function('similarity', 2, similarity, deterministic=True)
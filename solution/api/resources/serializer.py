@@ -0,0 +1,101 @@
+import json
+from operator import attrgetter
+
+from flask import Response
+from sqlalchemy import BigInteger, Text, and_, case, cast, exists, func, literal, or_, select, text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from models.main import Genre, Movie, movie_genre_association
+
+try:
+    import orjson
+except ImportError:  # Optional, the json module is used without it
+    orjson = None
+
+movie_fields = attrgetter('id', 'title', 'year', 'rating', 'runtime', 'imdb_id')
+
+
+def serialize_movie(movie, genre_names=None, genres_by_mask=None):
+    '''Wire shape of a movie: id, title, year, rating, runtime, genres and imdb_link when it has an IMDb id.
+    genre_names are the (bit, name) of all the genres to render genres from the genre mask, without them the
+    genres relationship is read'''
+    movie_id, title, year, rating, runtime, imdb_id = movie_fields(movie)
+    if genre_names is None:
+        genres = [{'name': genre.name} for genre in movie.genres]
+    else:
+        genres = render_genre_mask(movie.genre_mask, genre_names, genres_by_mask)
+    return build_movie(movie_id, title, year, rating, runtime, imdb_id, genres)
+
+
+def build_movie(movie_id, title, year, rating, runtime, imdb_id, genres):
+    serialized = {'id': movie_id, 'title': title, 'year': year, 'rating': rating, 'runtime': runtime,
+                  'genres': genres}
+    if imdb_id is not None:
+        serialized['imdb_link'] = f'https://www.imdb.com/title/{imdb_id}/'
+    return serialized
+
+
+def serialize_movies(movies, genre_names=None):
+    # Movies share a few hundred genre combinations, each one is rendered once per page
+    genres_by_mask = {}
+    return [serialize_movie(movie, genre_names, genres_by_mask) for movie in movies]
+
+
+def serialize_movie_rows(rows, genre_names=None, genres_by_movie=None):
+    '''Same shape as serialize_movie for (id, title, year, rating, runtime, imdb_id, genre_mask) rows, further
+    columns are ignored. Genres are rendered from the genre mask with genre_names or taken from genres_by_movie
+    (movie id -> genres)'''
+    genres_by_mask = {}
+    serialized_movies = []
+    for movie_id, title, year, rating, runtime, imdb_id, genre_mask, *_ in rows:
+        if genres_by_movie is None:
+            genres = render_genre_mask(genre_mask, genre_names, genres_by_mask)
+        else:
+            genres = genres_by_movie.get(movie_id, [])
+        serialized_movies.append(build_movie(movie_id, title, year, rating, runtime, imdb_id, genres))
+    return serialized_movies
+
+
+def render_genre_mask(mask, genre_names, genres_by_mask=None):
+    if genres_by_mask is not None and mask in genres_by_mask:
+        return genres_by_mask[mask]
+    genres = [{'name': name} for bit, name in genre_names if mask >> bit & 1]
+    if genres_by_mask is not None:
+        genres_by_mask[mask] = genres
+    return genres
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def json_response(payload, status=200, headers=None):
+    # Returned as is by flask_restful, skipping its own json encoding
+    return Response(dumps(payload), status=status, headers=headers, mimetype='application/json')
+
+
+def json_documents_response(documents, status=200, headers=None):
+    # Documents already rendered as JSON by the database are joined into the page array without parsing them
+    return Response('[' + ','.join(documents) + ']', status=status, headers=headers, mimetype='application/json')
+
+
+def movie_json_document():
+    '''Postgres expression rendering a movie row as JSON text in the wire shape of serialize_movie_rows'''
+    genre_bit = cast(literal(1), BigInteger).op('<<')(Genre.bit)
+    in_movie_genres = exists().where(movie_genre_association.c.movie_id == Movie.id,
+                                     movie_genre_association.c.genre_id == Genre.id).correlate(Movie, Genre)
+    # Genres with a bit are read from the mask, the ones past the 63 bits from movie_genres
+    has_genre = or_(and_(Genre.bit.isnot(None), Movie.genre_mask.op('&')(genre_bit) != 0),
+                    and_(Genre.bit.is_(None), in_movie_genres))
+    genres = select(func.coalesce(
+        func.jsonb_agg(aggregate_order_by(func.jsonb_build_object('name', Genre.name), Genre.bit)),
+        text("'[]'::jsonb"))).where(has_genre).correlate(Movie).scalar_subquery()
+    document = func.jsonb_build_object('id', Movie.id, 'title', Movie.title, 'year', Movie.year,
+                                       'rating', Movie.rating, 'runtime', Movie.runtime, 'genres', genres)
+    imdb_link = case(
+        (Movie.imdb_id.isnot(None),
+         func.jsonb_build_object('imdb_link', func.concat('https://www.imdb.com/title/', Movie.imdb_id, '/'))),
+        else_=text("'{}'::jsonb"))
+    return cast(document.op('||')(imdb_link), Text).label('document')
@@ -0,0 +1,23 @@
+from flask import current_app, request
+from flask_restful import Resource
+
+from cache.title_index import SUGGEST_MAX_LIMIT, normalize_title
+from models.main import get_catalog_state
+from resources.serializer import json_documents_response
+
+SUGGEST_MAX_LENGTH = 100
+
+
+class MovieSuggestResource(Resource):
+
+    def get(self):
+        '''Best rated movies whose title starts with prefix, answered from the in-memory title index'''
+        prefix = request.args.get('prefix', '')
+        if not normalize_title(prefix) or len(prefix) > SUGGEST_MAX_LENGTH:
+            return {'message': f'prefix must have between 1 and {SUGGEST_MAX_LENGTH} characters'}, 400
+        limit = request.args.get('limit', '10')
+        if not limit.isdigit() or not 1 <= int(limit) <= SUGGEST_MAX_LIMIT:
+            return {'message': f'limit must be a number between 1 and {SUGGEST_MAX_LIMIT}'}, 400
+
+        index = current_app.extensions['title_index'].get(get_catalog_state)
+        return json_documents_response(index.suggest(prefix, int(limit)))
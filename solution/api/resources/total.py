@@ -0,0 +1,47 @@
+import json
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from models.main import db
+
+# Filters matching up to this many movies are counted exactly, broader ones are estimated by the planner
+EXACT_TOTAL_LIMIT = 10000
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+def count_total(query, estimate_query, dialect_name, exact_limit=EXACT_TOTAL_LIMIT):
+    '''(total, exact) of the movies selected by query, a select of the movie ids with the filters of a listing.
+    On Postgres counting stops past exact_limit movies and the total is then the planner estimate of
+    estimate_query, the same filters written in a form it has statistics for. Other databases count them all'''
+    if dialect_name != 'postgresql':
+        return db.session.execute(select(func.count()).select_from(query.subquery())).scalar(), True
+    bounded = db.session.execute(
+        select(func.count()).select_from(query.limit(exact_limit + 1).subquery())).scalar()
+    if bounded <= exact_limit:
+        return bounded, True
+    # Never fewer than the movies already counted
+    return max(estimate_rows(estimate_query), bounded), False
+
+
+def estimate_rows(query):
+    plan = db.session.execute(Explain(query)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def total_headers(total, exact):
+    return {'X-Total-Count': str(total), 'X-Total-Count-Exact': 'true' if exact else 'false'}
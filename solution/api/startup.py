@@ -1,6 +1,7 @@
 import json
 
 from app import MovieAPI
+from cache.backends import create_response_cache
 
 def start():
     with open('config.json') as config_file:
@@ -14,6 +15,14 @@ def start():
             "database": config_data["DB_NAME"],
         }
         connectionString = 'postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}'.format(**db_params)
-        movie_api = MovieAPI(connectionString)
+        movie_api = MovieAPI(connectionString, config_data.get("SECRET_KEY"),
+                             str(config_data.get("DB_JSON_RENDERING")).lower() == "true",
+                             create_response_cache(config_data),
+                             float(config_data.get("CATALOG_VERSION_TTL") or 0),
+                             int(config_data.get("CACHE_CONTROL_MAX_AGE") or 0),
+                             config_data.get("TITLE_INDEX_DIR") or None,
+                             float(config_data.get("SUGGEST_REFRESH_INTERVAL") or 5),
+                             float(config_data.get("SUGGEST_REBUILD_INTERVAL") or 60))
+        movie_api.preload_catalog()
         return movie_api.app
 
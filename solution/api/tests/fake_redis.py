@@ -0,0 +1,54 @@
+import fnmatch
+import time
+
+
+class FakeRedis:
+    # Local stand-in with the subset of the redis-py client used by RedisResponseCache. Several caches built on
+    # the same instance behave like workers sharing one server
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.values = {}
+        self.expires_at = {}
+
+    def get(self, key):
+        if key in self.expires_at and self.expires_at[key] <= self.clock():
+            self.delete(key)
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.expires_at.pop(key, None)
+        if ex is not None:
+            self.expires_at[key] = self.clock() + ex
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.expires_at.pop(key, None)
+
+    def hincrby(self, key, field, amount=1):
+        counters = self.values.setdefault(key, {})
+        counters[field.encode()] = counters.get(field.encode(), 0) + amount
+        return counters[field.encode()]
+
+    def hgetall(self, key):
+        return dict(self.values.get(key, {}))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.values) if fnmatch.fnmatch(key, match)]
+
+
+class FakePipeline:
+    # Buffers the commands and runs them on execute, as a redis-py pipeline does in a single round trip
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in commands]
@@ -0,0 +1,93 @@
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+from app import MovieAPI
+from models.main import db, Genre, Movie
+
+
+class TestGenreRegistry(TestCase):
+
+    def create_app(self):
+        movieApi = MovieAPI('sqlite:///:memory:')
+        app = movieApi.app
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+            movie = Movie(id='1', title='Movie 1')
+            movie.genres.extend([Genre(id='action', name='Action'), Genre(id='drama', name='Drama')])
+            db.session.add(movie)
+            db.session.commit()
+        self.registry = self.app.extensions['genre_registry']
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def get_statements(self, request):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = request()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return response, statements
+
+    def test_catalog_is_loaded_once_per_version(self):
+        catalog = self.registry.get(0)
+
+        self.assertEqual(catalog.by_name, {'Action': ('action', 0), 'Drama': ('drama', 1)})
+        self.assertEqual(catalog.genre_bits, [(0, 'Action'), (1, 'Drama')])
+        self.assertFalse(catalog.has_unmasked)
+        self.assertIsNone(catalog.selective)
+        self.assertIs(self.registry.get(0), catalog)
+        self.registry.advance(0, 1)
+        self.assertEqual(self.registry.get(1).by_name, catalog.by_name)
+        self.assertIsNot(self.registry.get(2), self.registry.get(1))
+
+    def test_selective_genres(self):
+        db.session.add_all([Movie(id=str(i), title=f'Movie {i}') for i in range(2, 101)])
+        db.session.commit()
+
+        # Action and Drama have 1 of the 100 movies
+        self.assertEqual(self.registry.get_selective(0), {'Action', 'Drama'})
+        self.assertEqual(self.registry.get(0).selective, {'Action', 'Drama'})
+        self.registry.advance(0, 1)
+        self.assertEqual(self.registry.get(1).selective, {'Action', 'Drama'})
+        # A version bumped by another worker reloads the genres and keeps the counts while they are the same
+        _, statements = self.get_statements(lambda: self.registry.get_selective(2))
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(self.registry.get(2).selective, {'Action', 'Drama'})
+        db.session.add(Genre(id='comedy', name='Comedy'))
+        db.session.commit()
+        self.assertIsNone(self.registry.get(3).selective)
+
+    def test_genres_are_served_from_registry(self):
+        client = self.app.test_client()
+        self.assertEqual(client.get('/genres').json, [{'id': 'action', 'name': 'Action'},
+                                                       {'id': 'drama', 'name': 'Drama'}])
+
+        client.post('/movies', json={'title': 'Posted', 'genres': [{'name': 'Western'}]})
+        self.assertEqual([genre['name'] for genre in client.get('/genres').json], ['Action', 'Drama', 'Western'])
+
+    def test_post_resolves_genres_without_reading_them(self):
+        client = self.app.test_client()
+        client.get('/genres')
+
+        response, statements = self.get_statements(lambda: client.post('/movies', json={
+            'title': 'Posted', 'genres': [{'name': 'Drama'}, {'name': 'Action'}, {'name': 'Drama'}]}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(genre['name'] for genre in response.json['genres']), ['Action', 'Drama'])
+        self.assertFalse([statement for statement in statements if 'FROM genres' in statement], statements)
+        self.assertEqual(db.session.get(Movie, response.json['id']).genre_mask, 3)
+        # The catalog moved to the version of the POST without being reloaded
+        self.assertEqual(self.registry.catalog.version, 1)
+        self.assertEqual(client.get('/movies?genre=Drama').json[1]['id'], response.json['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
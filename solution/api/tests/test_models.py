@@ -0,0 +1,92 @@
+import unittest
+import uuid
+from unittest.mock import MagicMock, patch
+from flask_testing import TestCase
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import MovieAPI
+from models.main import commit_with_retry, db, generate_uuid, is_unique_violation, Movie
+
+
+class TestGenerateUuid(unittest.TestCase):
+
+    def test_uuid7(self):
+        value = uuid.UUID(generate_uuid())
+
+        self.assertEqual(value.version, 7)
+        self.assertEqual(value.variant, uuid.RFC_4122)
+
+    def test_ids_are_time_ordered(self):
+        with patch('models.main.time.time_ns', side_effect=[1_700_000_000_000_000_000 + i * 1_000_000
+                                                            for i in range(100)]):
+            ids = [generate_uuid() for _ in range(100)]
+
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(len(set(ids)), 100)
+
+
+class TestMovieIds(TestCase):
+
+    def create_app(self):
+        movieApi = MovieAPI('sqlite:///:memory:')
+        app = movieApi.app
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_post_does_not_read_movies(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = self.app.test_client().post('/movies', json={'title': 'Posted'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(uuid.UUID(response.json['id']).version, 7)
+        self.assertFalse([statement for statement in statements if 'FROM movies' in statement], statements)
+
+    def test_post_retries_colliding_id(self):
+        client = self.app.test_client()
+        random_bits = [bytes(10), bytes(10), bytes(9) + b'\x01']
+        with patch('models.main.time.time_ns', return_value=1_700_000_000_000_000_000), \
+                patch('models.main.os.urandom', side_effect=random_bits):
+            first = client.post('/movies', json={'title': 'First'})
+            second = client.post('/movies', json={'title': 'Second'})
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(second.json['id'], first.json['id'])
+        self.assertEqual(sorted(movie.title for movie in Movie.query.all()), ['First', 'Second'])
+
+    def test_post_conflicting_id(self):
+        client = self.app.test_client()
+        movie_id = client.post('/movies', json={'title': 'First'}).json['id']
+
+        self.assertEqual(client.post('/movies', json={'id': movie_id, 'title': 'Second'}).status_code, 409)
+
+    def test_only_unique_violations_are_retried(self):
+        class PostgresError(Exception):
+            def __init__(self, pgcode):
+                self.pgcode = pgcode
+
+        for pgcode, calls in [('23505', 3), ('23502', 1), ('23503', 1)]:
+            error = IntegrityError('INSERT INTO movies', {}, PostgresError(pgcode))
+            write = MagicMock(side_effect=error)
+            with self.assertRaises(IntegrityError):
+                commit_with_retry(write)
+            self.assertEqual(write.call_count, calls, pgcode)
+            self.assertEqual(is_unique_violation(error), pgcode == '23505')
+
+
+if __name__ == '__main__':
+    unittest.main()
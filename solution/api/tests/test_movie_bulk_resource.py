@@ -0,0 +1,82 @@
+import json
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+from app import MovieAPI
+from models.main import db, Genre, Movie
+
+
+class TestMovieBulkResource(TestCase):
+
+    def create_app(self):
+        movieApi = MovieAPI('sqlite:///:memory:')
+        app = movieApi.app
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(Genre(id='action', name='Action'))
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_bulk_create_json_array(self):
+        client = self.app.test_client()
+        response = client.post('/movies/bulk', json=[
+            {'title': 'Movie 1', 'year': 2020, 'rating': 7.5, 'runtime': 100,
+             'imdb_link': 'https://www.imdb.com/title/tt0000001/', 'genres': [{'name': 'Action'}, {'name': 'Drama'}]},
+            {'title': 'Movie 2', 'genres': [{'name': 'Drama'}, {'name': 'Drama'}]},
+            {'title': 'Movie 3'}])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['index'] for result in response.json], [0, 1, 2])
+        movie = client.get('/movies/' + response.json[0]['id']).json
+        self.assertEqual(movie['imdb_link'], 'https://www.imdb.com/title/tt0000001/')
+        self.assertEqual(sorted(genre['name'] for genre in movie['genres']), ['Action', 'Drama'])
+        self.assertEqual([movie.genre_mask for movie in Movie.query.order_by(Movie.title)], [3, 2, 0])
+        self.assertEqual(Genre.query.filter_by(name='Drama').one().bit, 1)
+        self.assertEqual([movie['title'] for movie in client.get('/movies?genre=Drama').json], ['Movie 1', 'Movie 2'])
+
+    def test_bulk_create_ndjson(self):
+        body = '\n'.join(json.dumps({'title': f'Movie {i}', 'genres': [{'name': 'Action'}]}) for i in range(50))
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = self.app.test_client().post('/movies/bulk', data=body + '\n',
+                                                   content_type='application/x-ndjson')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Movie.query.count(), 50)
+        # Catalog version, genres of the registry, then one insert for movies and one for their genres
+        self.assertEqual(len([statement for statement in statements if statement.startswith('INSERT INTO movies')]), 1)
+        self.assertEqual(len(statements), 5, statements)
+
+    def test_invalid_items_reject_the_batch(self):
+        client = self.app.test_client()
+        response = client.post('/movies/bulk', json=[
+            {'title': 'Valid'}, {'year': 'soon'}, {'title': 'Link', 'imdb_link': 'https://example.com'}, 'movie'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json[0], {'index': 0})
+        self.assertEqual(response.json[1]['errors'], ['title is required and must be a string of at most 300 characters',
+                                                      'year must be a positive integer'])
+        self.assertEqual(response.json[2]['errors'], ['Invalid IMDb URL format'])
+        self.assertEqual(response.json[3]['errors'], ['Expected a movie object'])
+        self.assertEqual(Movie.query.count(), 0)
+
+        self.assertEqual(client.post('/movies/bulk', json={'title': 'Not a list'}).status_code, 400)
+        self.assertEqual(client.post('/movies/bulk', json=[]).status_code, 400)
+        self.assertEqual(client.post('/movies/bulk', data='{"title": "A"}\n{', content_type='application/x-ndjson')
+                         .status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,14 @@
 import unittest
+from unittest.mock import patch
 from flask import Flask, request
 from flask.testing import FlaskClient
 from flask_sqlalchemy import SQLAlchemy
 from flask_restful import Api
 from flask_testing import TestCase
 from sqlalchemy.orm import joinedload
-from sqlalchemy import desc
+from sqlalchemy import desc, event
 from resources.movie import MovieResource
-from models.main import db, Movie, Genre
+from models.main import db, CatalogState, Movie, Genre
 from app import MovieAPI
 
 class TestMovieListResource(TestCase):
@@ -160,9 +161,9 @@ class TestMovieListResource(TestCase):
         self.assertEqual(response.status_code, 200)
         data = response.json
         self.assertEqual(len(data), 2)
-        # Since the rating is the same, the sorting should be based on the 'id'
-        self.assertEqual(data[0]['title'], 'Movie 1')
-        self.assertEqual(data[1]['title'], 'Movie 2')
+        # Since the rating is the same, the sorting should be based on the 'id' in the same direction
+        self.assertEqual(data[0]['title'], 'Movie 2')
+        self.assertEqual(data[1]['title'], 'Movie 1')
 
     def test_get_movies_desc_with_same_year_value(self):
         # Arrange
@@ -199,12 +200,12 @@ class TestMovieListResource(TestCase):
         self.assertEqual(len(data), 4)
         # Since the rating is the same, the sorting should be based on the 'id'
         self.assertEqual(data[0]['title'], 'Movie 4')
-        self.assertEqual(data[1]['title'], 'Movie 2')
-        self.assertEqual(data[2]['title'], 'Movie 1')
+        self.assertEqual(data[1]['title'], 'Movie 1')
+        self.assertEqual(data[2]['title'], 'Movie 2')
         self.assertEqual(data[3]['title'], 'Movie 3')
         self.assertEqual(data[0]['id'], '4')
-        self.assertEqual(data[1]['id'], '1')
-        self.assertEqual(data[2]['id'], '2')
+        self.assertEqual(data[1]['id'], '2')
+        self.assertEqual(data[2]['id'], '1')
         self.assertEqual(data[3]['id'], '3')
 
     def test_get_movies_desc_with_same_year_value_next_page(self):
@@ -234,15 +235,296 @@ class TestMovieListResource(TestCase):
 
         # Act
         client = self.app.test_client()
-        response = client.get('/movies?sort=year&desc&after_id=1')
+        response = client.get('/movies?sort=year&desc&after_id=2')
 
         # Assert
         self.assertEqual(response.status_code, 200)
         data = response.json
         self.assertEqual(len(data), 2)
 
-        self.assertEqual(data[0]['title'], 'Movie 1')
+        self.assertEqual(data[0]['title'], 'Movie 2')
         self.assertEqual(data[1]['title'], 'Movie 3')
 
+    def add_movies(self, movies):
+        for movie_id, title, year in movies:
+            db.session.add(Movie(id=movie_id, title=title, year=year, rating=8.0, runtime=100))
+        db.session.commit()
+
+    def get_all_pages(self, url):
+        client = self.app.test_client()
+        pages = []
+        response = client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([movie['id'] for movie in response.json])
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return pages
+            response = client.get(url + '&cursor=' + cursor)
+
+    def test_get_movies_with_cursor(self):
+        self.add_movies([('1', 'Movie 1', 2020), ('2', 'Movie 2', 2020), ('3', 'Movie 3', 2019),
+                         ('4', 'Movie 4', None), ('5', 'Movie 5', 2021), ('6', 'Movie 6', None)])
+
+        self.assertEqual(self.get_all_pages('/movies?sort=year&page_size=2'),
+                         [['3', '1'], ['2', '5'], ['4', '6']])
+        self.assertEqual(self.get_all_pages('/movies?sort=year&desc&page_size=4'),
+                         [['5', '2', '1', '3'], ['6', '4']])
+
+    def test_get_movies_with_cursor_of_last_page(self):
+        self.add_movies([('1', 'Movie 1', 2020), ('2', 'Movie 2', 2021)])
+
+        self.assertEqual(self.get_all_pages('/movies?sort=year&page_size=2'), [['1', '2']])
+
+    def test_get_movies_with_invalid_cursor(self):
+        self.add_movies([('1', 'Movie 1', 2020), ('2', 'Movie 2', 2021)])
+        client = self.app.test_client()
+        cursor = client.get('/movies?sort=year&page_size=1').headers['X-Next-Cursor']
+
+        self.assertEqual(client.get('/movies?sort=year&page_size=1&cursor=' + cursor[:-2]).status_code, 400)
+        self.assertEqual(client.get('/movies?sort=title&page_size=1&cursor=' + cursor).status_code, 400)
+
+    def add_genre_movies(self):
+        genres = {name: Genre(name=name) for name in ['Action', 'Drama', 'Comedy']}
+        for movie_id, genre_names in [('1', ['Action']), ('2', ['Action', 'Drama']), ('3', ['Drama', 'Comedy']),
+                                      ('4', [])]:
+            movie = Movie(id=movie_id, title=f'Movie {movie_id}', year=2020, rating=8.0, runtime=100)
+            movie.genres.extend(genres[name] for name in genre_names)
+            db.session.add(movie)
+        db.session.commit()
+        return genres
+
+    def get_ids(self, url):
+        response = self.app.test_client().get(url)
+        self.assertEqual(response.status_code, 200)
+        return [movie['id'] for movie in response.json]
+
+    def test_get_movies_with_multiple_genres(self):
+        self.add_genre_movies()
+
+        self.assertEqual(self.get_ids('/movies?genre=Drama'), ['2', '3'])
+        self.assertEqual(self.get_ids('/movies?genre=Action,Drama'), ['2'])
+        self.assertEqual(self.get_ids('/movies?genre=Action,Comedy&genre_match=any'), ['1', '2', '3'])
+        self.assertEqual(self.get_ids('/movies?genre=Action,Unknown'), [])
+        self.assertEqual(self.get_ids('/movies?genre=Comedy,Unknown&genre_match=any'), ['3'])
+        response = self.app.test_client().get('/movies?genre=Action&genre_match=some')
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_movies_with_genres_without_bit(self):
+        genres = self.add_genre_movies()
+        # Genres past the 63 bits of the mask are matched and rendered through movie_genres
+        genres['Drama'].bit = None
+        db.session.commit()
+        db.session.execute(Movie.__table__.update().values(genre_mask=Movie.genre_mask.op('&')(~(1 << 1))))
+        db.session.commit()
+
+        self.assertEqual(self.get_ids('/movies?genre=Action,Drama'), ['2'])
+        self.assertEqual(self.get_ids('/movies?genre=Action,Drama&genre_match=any'), ['1', '2', '3'])
+        movies = self.app.test_client().get('/movies?genre=Drama').json
+        self.assertEqual(sorted(genre['name'] for genre in movies[1]['genres']), ['Comedy', 'Drama'])
+
+    def test_genre_masks_follow_genres(self):
+        genres = self.add_genre_movies()
+
+        self.assertEqual([genres[name].bit for name in ['Action', 'Drama', 'Comedy']], [0, 1, 2])
+        self.assertEqual([db.session.get(Movie, movie_id).genre_mask for movie_id in ['1', '2', '3', '4']],
+                         [1, 3, 6, 0])
+        movie = db.session.get(Movie, '4')
+        movie.genres.append(genres['Comedy'])
+        db.session.commit()
+        self.assertEqual(movie.genre_mask, 4)
+
+        response = self.app.test_client().post('/movies', json={
+            'title': 'Posted', 'genres': [{'name': 'Comedy'}, {'name': 'Western'}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(genre['name'] for genre in response.json['genres']), ['Comedy', 'Western'])
+        self.assertEqual(Genre.query.filter_by(name='Western').one().bit, 3)
+        self.assertEqual(self.get_ids('/movies?genre=Western'), [response.json['id']])
+
+    def test_post_validates_movie(self):
+        client = self.app.test_client()
+        response = client.post('/movies', json={'title': 'Posted', 'year': 0, 'rating': 11, 'director': 'Unknown',
+                                                'imdb_link': 'https://example.com'})
+
+        # Same rules as POST /movies/bulk
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['errors'], ['Unknown field director', 'year must be a positive integer',
+                                                   'rating must be a number between 0 and 10',
+                                                   'Invalid IMDb URL format'])
+        self.assertEqual(client.post('/movies', json=['Posted']).status_code, 400)
+        self.assertEqual(Movie.query.count(), 0)
+
+    def test_db_json_rendering_falls_back_outside_postgres(self):
+        self.add_genre_movies()
+        client = self.app.test_client()
+        expected = client.get('/movies?genre=Drama&page_size=1')
+
+        self.app.config['DB_JSON_RENDERING'] = True
+        response = client.get('/movies?genre=Drama&page_size=1')
+        self.assertEqual(response.json, expected.json)
+        self.assertEqual(response.headers.get('X-Next-Cursor'), expected.headers.get('X-Next-Cursor'))
+
+    def test_get_movies_is_cached_until_catalog_changes(self):
+        self.add_genre_movies()
+        client = self.app.test_client()
+        response_cache = self.app.extensions['response_cache']
+
+        first = client.get('/movies?sort=rating&desc=true&genre=Action,Drama&genre_match=any&page_size=1')
+        # Same page with the parameters in another order and spelling
+        second = client.get('/movies?page_size=1&genre_match=any&genre=Drama,%20Action&desc&sort=rating')
+        self.assertEqual(second.json, first.json)
+        self.assertEqual(second.headers['X-Next-Cursor'], first.headers['X-Next-Cursor'])
+        self.assertEqual((response_cache.stats()['hits'], response_cache.stats()['misses']), (1, 1))
+
+        # A movie posted through the API is listed right away
+        posted = client.post('/movies', json={'title': 'Posted', 'rating': 9.0, 'genres': [{'name': 'Action'},
+                                                                                             {'name': 'Drama'}]})
+        third = client.get('/movies?sort=rating&desc=true&genre=Action,Drama&genre_match=any&page_size=1')
+        self.assertEqual(third.json[0]['id'], posted.json['id'])
+
+        # The data-loader bumps the catalog version after a load
+        db.session.add(Movie(id='5', title='Loaded', rating=9.5, genres=Genre.query.all()))
+        db.session.execute(CatalogState.__table__.update().values(version=CatalogState.version + 1))
+        db.session.commit()
+        fourth = client.get('/movies?sort=rating&desc=true&genre=Action,Drama&genre_match=any&page_size=1')
+        self.assertEqual(fourth.json[0]['id'], '5')
+        self.assertEqual(response_cache.stats()['entries'], 1)
+
+    def test_get_movie_is_cached(self):
+        self.add_genre_movies()
+        client = self.app.test_client()
+
+        self.assertEqual(client.get('/movies/1').json, client.get('/movies/1').json)
+        self.assertEqual(client.get('/movies/unknown').status_code, 404)
+        self.assertEqual(client.get('/cache/stats').json['hits'], 1)
+        self.assertEqual(client.get('/cache/stats').json['entries'], 1)
+
+    def count_statements(self, request):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = request()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return response, statements
+
+    def test_conditional_requests(self):
+        self.add_genre_movies()
+        client = self.app.test_client()
+        url = '/movies?sort=rating&genre=Action'
+
+        response = client.get(url)
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=0, must-revalidate')
+        self.assertEqual(client.get('/movies?genre=Action&sort=rating').headers['ETag'], etag)
+        self.assertNotEqual(client.get('/movies?sort=year&genre=Action').headers['ETag'], etag)
+        self.assertIn('ETag', client.get('/movies/1').headers)
+        self.assertIn('ETag', client.get('/genres').headers)
+        self.assertNotIn('ETag', client.get('/movies/unknown').headers)
+
+        # Revalidating only reads the catalog version
+        not_modified, statements = self.count_statements(lambda: client.get(url, headers={'If-None-Match': etag}))
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+        self.assertEqual(not_modified.headers['ETag'], etag)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('catalog_state', statements[0])
+        self.assertEqual(client.get(url, headers={'If-None-Match': 'W/' + etag}).status_code, 304)
+
+        # A write changes the ETag of every page
+        client.post('/movies', json={'title': 'Posted', 'genres': [{'name': 'Action'}]})
+        response = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.json), 3)
+        last_modified = response.headers['Last-Modified']
+        self.assertEqual(client.get(url, headers={'If-Modified-Since': last_modified}).status_code, 304)
+        self.assertEqual(client.get(url, headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+                         .status_code, 200)
+
+    def test_catalog_version_ttl(self):
+        self.add_genre_movies()
+        self.app.config['CATALOG_VERSION_TTL'] = 60
+        client = self.app.test_client()
+        etag = client.get('/movies').headers['ETag']
+
+        not_modified, statements = self.count_statements(lambda: client.get('/movies', headers={'If-None-Match': etag}))
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(statements, [])
+        # Writes made by this worker are seen right away
+        client.post('/movies', json={'title': 'Posted'})
+        self.assertEqual(client.get('/movies', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_search_titles(self):
+        self.add_movies([('1', 'The Matrix', 1999), ('2', 'The Matrix Reloaded', 2003), ('3', 'Matrimony', 2001),
+                         ('4', 'Metrix', 2010), ('5', 'Casablanca', 1942), ('6', 'Enter the Matrix 100%', None)])
+
+        # Title prefix matches first, then the rest by trigram similarity, ids break ties
+        self.assertEqual(self.get_ids('/movies?q=the%20matrix'), ['1', '2', '6', '3'])
+        self.assertEqual(self.get_ids('/movies?q=matri'), ['3', '1'])
+        self.assertEqual(self.get_ids('/movies?q=Matrix'), ['1', '3', '4', '2', '6'])
+        # LIKE wildcards are searched as text
+        self.assertEqual(self.get_ids('/movies?q=%25matrix'), ['1', '3', '4', '2', '6'])
+        self.assertEqual(self.get_ids('/movies?q=matrix&sort=year&desc'), ['4', '2', '3', '1', '6'])
+        # Only the titles nearest to q are ranked
+        self.app.extensions['response_cache'].clear()
+        with patch('resources.search.SEARCH_CANDIDATES', 2):
+            self.assertEqual(self.get_ids('/movies?q=Matrix'), ['1', '3'])
+            # The nearest titles are taken among the movies the other filters keep
+            db.session.query(Movie).filter(Movie.id.in_(['1', '3'])).update({'rating': 5.0})
+            db.session.commit()
+            self.assertEqual(self.get_ids('/movies?q=Matrix&rating_gt=6'), ['4', '2'])
+            self.assertEqual(self.get_total('/movies?q=Matrix&rating_gt=6&include_total')[0], 2)
+
+    def test_search_pages(self):
+        self.add_movies([(str(i), f'Star {"x" * (i % 4)} Wars {i}', 1970 + i) for i in range(1, 13)])
+        first_pages = self.get_all_pages('/movies?q=star%20wars&page_size=5')
+
+        self.assertEqual([len(page) for page in first_pages], [5, 5, 2])
+        ranked = [movie_id for page in first_pages for movie_id in page]
+        self.assertEqual(sorted(ranked, key=int), [str(i) for i in range(1, 13)])
+        self.assertEqual(self.get_ids('/movies?q=star%20wars&page_size=12'), ranked)
+        response = self.app.test_client().get('/movies?q=star%20wars&page_size=3&after_id=' + ranked[2])
+        self.assertEqual([movie['id'] for movie in response.json], ranked[3:6])
+
+    def test_search_validation(self):
+        client = self.app.test_client()
+
+        self.assertEqual(client.get('/movies?q=a').status_code, 400)
+        self.assertEqual(client.get('/movies?q=' + 'a' * 101).status_code, 400)
+        self.assertEqual(client.get('/movies?sort=relevance').status_code, 400)
+        self.assertEqual(client.get('/movies?q=%20%20').status_code, 200)
+
+    def get_total(self, url):
+        response = self.app.test_client().get(url)
+        self.assertEqual(response.status_code, 200)
+        return int(response.headers['X-Total-Count']), response.headers['X-Total-Count-Exact']
+
+    def test_include_total(self):
+        self.add_genre_movies()
+
+        self.assertEqual(self.get_total('/movies?include_total&page_size=1'), (4, 'true'))
+        self.assertEqual(self.get_total('/movies?genre=Drama&include_total'), (2, 'true'))
+        self.assertEqual(self.get_total('/movies?genre=Action,Comedy&genre_match=any&include_total'), (3, 'true'))
+        self.assertEqual(self.get_total('/movies?genre=Action,Unknown&include_total'), (0, 'true'))
+        self.assertEqual(self.get_total('/movies?q=movie&include_total'), (4, 'true'))
+        self.assertNotIn('X-Total-Count', self.app.test_client().get('/movies').headers)
+
+    def test_total_is_cached_per_filter(self):
+        self.add_genre_movies()
+        client = self.app.test_client()
+        client.get('/movies?genre=Drama&include_total&page_size=1')
+
+        # Other pages and sorts of the same filter reuse its total
+        for url in ['/movies?genre=Drama&include_total&sort=year&desc', '/movies?include_total&genre=Drama']:
+            response, statements = self.count_statements(lambda: client.get(url))
+            self.assertEqual(response.headers['X-Total-Count'], '2')
+            self.assertFalse([statement for statement in statements if 'count(' in statement], statements)
+
+        client.post('/movies', json={'title': 'Posted', 'genres': [{'name': 'Drama'}]})
+        self.assertEqual(self.get_total('/movies?genre=Drama&include_total'), (3, 'true'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,188 @@
+import os
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event, select, text
+from models.main import db, get_catalog_state, Movie, Genre
+from app import MovieAPI
+from resources.movie import filter_movies
+from resources.total import count_total
+
+
+class QueryPlanTestCase(TestCase):
+    # Runs GET /movies, captures the statements it executes and explains them, so a change in the query shapes
+    # or in the indexes that leaves a listing without its index shows up here
+    database_url = 'sqlite:///:memory:'
+
+    def create_app(self):
+        movieApi = MovieAPI(self.database_url, 'test-secret')
+        app = movieApi.app
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.database_url
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+            action = Genre(name='Action')
+            drama = Genre(name='Drama')
+            for i in range(200):
+                movie = Movie(id=f'{i:04d}', title=f'Movie {i}', year=1950 + i % 70, rating=i % 100 / 10,
+                              runtime=90)
+                movie.genres.append(action if i % 3 else drama)
+                db.session.add(movie)
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def add_selective_genre(self):
+        # 2 of the 200 movies
+        film_noir = Genre(name='Film-Noir')
+        for movie in Movie.query.filter(Movie.id.in_(['0010', '0020'])):
+            movie.genres.append(film_noir)
+        db.session.commit()
+
+    def get_movies_statements(self, url):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        # The selective genres are counted once per catalog version, not by the page statements
+        self.app.extensions['genre_registry'].get_selective(get_catalog_state()[0])
+        client = self.app.test_client()
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response = client.get(url + '&cursor=' + response.headers['X-Next-Cursor'])
+            self.assertEqual(response.status_code, 200)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        return statements
+
+    def get_movies_plans(self, url):
+        # Plans of the statements reading the page of movies
+        plans = []
+        for statement, parameters in self.get_movies_statements(url):
+            if 'FROM movies' in statement:
+                plans.append(self.explain(statement, parameters))
+        self.assertTrue(plans)
+        return plans
+
+
+class TestSqliteQueryPlans(QueryPlanTestCase):
+
+    def explain(self, statement, parameters):
+        rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[3] for row in rows]
+
+    def test_sorted_pages_use_sort_index(self):
+        for sort_field in ['title', 'year', 'rating']:
+            for direction in ['', '&desc']:
+                for plan in self.get_movies_plans(f'/movies?sort={sort_field}{direction}&page_size=5'):
+                    self.assertTrue(any(f'USING INDEX idx_movies_{sort_field}_id' in step for step in plan), plan)
+                    self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_rating_filter_pages_use_sort_index(self):
+        for plan in self.get_movies_plans('/movies?sort=rating&desc&rating_gt=5&page_size=5'):
+            self.assertTrue(any('USING INDEX idx_movies_rating_id' in step for step in plan), plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_genre_filter_pages_use_sort_index(self):
+        # Most movies are Action, the sort index is walked matching genre_mask
+        for plan in self.get_movies_plans('/movies?genre=Action&sort=rating&desc&page_size=5'):
+            self.assertTrue(any('idx_movies_rating_id' in step for step in plan), plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_selective_genre_filter_pages_use_genre_index(self):
+        self.add_selective_genre()
+        for url in ['/movies?genre=Film-Noir&sort=rating&desc&page_size=1',
+                    '/movies?genre=Film-Noir,Action&sort=rating&desc&page_size=1']:
+            for plan in self.get_movies_plans(url):
+                self.assertTrue(any('USING COVERING INDEX idx_movie_genres_genre_movie_id' in step
+                                    for step in plan), plan)
+                self.assertFalse([step for step in plan if step.startswith('SCAN movies')], plan)
+        self.assertEqual([movie['id'] for movie in self.client.get('/movies?genre=Film-Noir&sort=rating&desc').json],
+                         ['0020', '0010'])
+
+    def test_genres_of_page_are_rendered_from_mask(self):
+        for url in ['/movies?sort=title&page_size=5', '/movies?genre=Drama,Action&genre_match=any&page_size=5']:
+            statements = self.get_movies_statements(url)
+            self.assertFalse([statement for statement, _ in statements if 'movie_genres' in statement])
+
+    def test_genres_without_bit_use_primary_key(self):
+        Genre.query.filter_by(name='Drama').update({'bit': None})
+        db.session.commit()
+        statements = self.get_movies_statements('/movies?sort=title&page_size=5')
+        self.assertTrue([statement for statement, _ in statements if 'movie_genres' in statement])
+        for statement, parameters in statements:
+            if 'movie_genres' in statement:
+                plan = self.explain(statement, parameters)
+                self.assertFalse([step for step in plan if step.startswith('SCAN')], plan)
+
+
+class TestPostgresQueryPlans(QueryPlanTestCase):
+    database_url = os.environ.get('TEST_POSTGRES_URL', '')
+
+    @classmethod
+    def setUpClass(cls):
+        # Skipped here rather than with skipUnless, flask_testing creates the app before a skip decorator applies
+        if not cls.database_url:
+            raise unittest.SkipTest('TEST_POSTGRES_URL not set, e.g. the database of tests/utils/docker-compose.yml')
+        super().setUpClass()
+
+    def explain(self, statement, parameters):
+        connection = db.session.connection()
+        # The test tables are tiny, without this the planner would rightly prefer sorting them
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        connection.exec_driver_sql('SET LOCAL enable_sort = off')
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+        return [row[0] for row in rows]
+
+    def test_sorted_pages_use_sort_index(self):
+        for sort_field in ['title', 'year', 'rating']:
+            for direction in ['', '&desc']:
+                for plan in self.get_movies_plans(f'/movies?sort={sort_field}{direction}&page_size=5'):
+                    self.assertTrue(any(f'idx_movies_{sort_field}_id' in step for step in plan), plan)
+                    self.assertFalse([step for step in plan if 'Sort' in step and 'Sort Key' not in step], plan)
+
+    def test_genre_filter_pages_use_indexes(self):
+        for plan in self.get_movies_plans('/movies?genre=Drama&sort=rating&desc&page_size=5'):
+            self.assertFalse([step for step in plan if 'Seq Scan' in step], plan)
+
+    def test_selective_genre_filter_pages_use_genre_index(self):
+        self.add_selective_genre()
+        for plan in self.get_movies_plans('/movies?genre=Film-Noir&sort=rating&desc&page_size=1'):
+            self.assertTrue(any('idx_movie_genres_genre_movie_id' in step for step in plan), plan)
+
+    def test_title_search_uses_trigram_index(self):
+        # Created by sql-scripts/01_create_movie_table.sql and the data-loader, not by the models
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.execute(text('CREATE INDEX idx_movies_title_trgm_gist ON movies USING gist (title gist_trgm_ops)'))
+        db.session.commit()
+        for plan in self.get_movies_plans('/movies?q=movie%201&page_size=5'):
+            # Both candidate queries are ordered scans of the index, the ranked rows are at most their limits
+            self.assertEqual(len([step for step in plan if 'Index Scan using idx_movies_title_trgm_gist' in step]), 2,
+                             plan)
+            self.assertEqual(len([step for step in plan if 'Order By: (title <-> ' in step]), 2, plan)
+
+    def test_broad_filter_total_is_estimated(self):
+        db.session.execute(text('ANALYZE'))
+        query = filter_movies(select(Movie.id), ('Action',), 'all', None, None)
+        estimate_query = filter_movies(select(Movie.id), ('Action',), 'all', None, None, by_mask=False)
+
+        self.assertEqual(count_total(query, estimate_query, 'postgresql'), (133, True))
+        total, exact = count_total(query, estimate_query, 'postgresql', exact_limit=50)
+        self.assertFalse(exact)
+        # Never fewer than the movies counted, close to the 133 with Action
+        self.assertGreater(total, 50)
+        self.assertLess(total, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
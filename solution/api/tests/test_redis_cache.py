@@ -0,0 +1,159 @@
+import unittest
+from unittest.mock import patch
+from flask_testing import TestCase
+from app import MovieAPI
+from cache.backends import create_response_cache
+from cache.redis_cache import RedisError, RedisResponseCache
+from cache.response_cache import ResponseCache
+from models.main import db, Genre, Movie
+from tests.fake_redis import FakeRedis
+from tests.test_response_cache import FakeClock
+
+
+class TestRedisResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = FakeRedis(self.clock)
+        self.cache = RedisResponseCache(self.client, ttl=10, max_bytes=100)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get((1, 'movies')))
+        self.cache.set((1, 'movies'), b'[{"id": "1"}]', {'X-Next-Cursor': 'token'})
+
+        entry = self.cache.get((1, 'movies'))
+        self.assertEqual(entry.body, b'[{"id": "1"}]')
+        self.assertEqual(entry.headers, {'X-Next-Cursor': 'token'})
+        self.assertIsNone(self.cache.get((2, 'movies')))
+        self.assertEqual(self.cache.stats(), {'backend': 'redis', 'version': None, 'available': True, 'hits': 1,
+                                             'misses': 2})
+
+    def test_entries_are_shared_between_workers(self):
+        other_worker = RedisResponseCache(self.client, ttl=10)
+        self.cache.set((1, 'genres'), b'[]')
+
+        self.assertEqual(other_worker.get((1, 'genres')).body, b'[]')
+        # Counters are shared once the worker has written them
+        self.assertEqual(other_worker.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_entries_expire(self):
+        self.cache.set((1, 'genres'), b'[]')
+        self.clock.now = 10
+
+        self.assertIsNone(self.cache.get((1, 'genres')))
+
+    def test_large_bodies_are_not_stored(self):
+        self.cache.set((1, 'movies'), b'x' * 100)
+
+        self.assertIsNone(self.cache.get((1, 'movies')))
+
+    def test_clear(self):
+        self.cache.set((1, 'movies'), b'[]')
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get((1, 'movies')))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_stats_are_written_in_batches(self):
+        cache = RedisResponseCache(self.client, ttl=10, stats_flush_every=3)
+        cache.set((1, 'genres'), b'[]')
+        cache.get((1, 'genres'))
+        cache.get((1, 'movies'))
+        self.assertNotIn('movie-api:stats', self.client.values)
+
+        cache.get((1, 'genres'))
+        self.assertEqual(self.client.hgetall('movie-api:stats'), {b'hits': 2, b'misses': 1})
+        cache.get((1, 'movies'))
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_unavailable_server_is_a_miss(self):
+        class UnavailableRedis(FakeRedis):
+            def get(self, key):
+                raise RedisError('Timeout reading from socket')
+
+            def set(self, key, value, ex=None):
+                raise RedisError('Timeout reading from socket')
+
+        cache = RedisResponseCache(UnavailableRedis(self.clock), ttl=10)
+        with self.assertLogs('cache.redis_cache', 'WARNING'):
+            cache.set((1, 'genres'), b'[]')
+            self.assertIsNone(cache.get((1, 'genres')))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_unavailable_server_stats_and_clear(self):
+        class UnavailableRedis(FakeRedis):
+            def hgetall(self, key):
+                raise RedisError('Connection refused')
+
+            def scan_iter(self, match):
+                raise RedisError('Connection refused')
+
+        cache = RedisResponseCache(UnavailableRedis(self.clock), ttl=10)
+        with self.assertLogs('cache.redis_cache', 'WARNING'):
+            cache.clear()
+            self.assertEqual(cache.stats(), {'backend': 'redis', 'version': None, 'available': False, 'hits': None,
+                                             'misses': None})
+
+    def test_create_response_cache(self):
+        self.assertIsInstance(create_response_cache({}), ResponseCache)
+        self.assertIsInstance(create_response_cache({'CACHE_BACKEND': 'local'}), ResponseCache)
+        with self.assertRaises(ValueError):
+            create_response_cache({'CACHE_BACKEND': 'memcached'})
+
+
+class TestSharedCacheAPI(TestCase):
+
+    def create_app(self):
+        self.client_stand_in = FakeRedis()
+        movieApi = MovieAPI('sqlite:///:memory:', response_cache=RedisResponseCache(self.client_stand_in))
+        app = movieApi.app
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+            movie = Movie(id='1', title='Movie 1', year=2020, rating=8.0, runtime=100)
+            movie.genres.append(Genre(name='Action'))
+            db.session.add(movie)
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_pages_and_genres_are_shared(self):
+        client = self.app.test_client()
+        for url in ['/movies?sort=rating', '/genres']:
+            first = client.get(url)
+            self.assertEqual(client.get(url).json, first.json)
+        self.assertEqual(client.get('/cache/stats').json['hits'], 2)
+
+        # A worker started later is served from the shared entries
+        other_worker = MovieAPI('sqlite:///:memory:', response_cache=RedisResponseCache(self.client_stand_in))
+        other_worker.app.config['TESTING'] = True
+        with other_worker.app.app_context():
+            db.create_all()
+            self.assertEqual(other_worker.app.test_client().get('/genres').json, [{'id': first.json[0]['id'],
+                                                                                   'name': 'Action'}])
+            db.drop_all()
+
+    def test_stats_with_unavailable_server(self):
+        with patch.object(self.client_stand_in, 'hgetall', side_effect=RedisError('Connection refused')), \
+                self.assertLogs('cache.redis_cache', 'WARNING'):
+            response = self.app.test_client().get('/cache/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json['available'])
+
+    def test_post_invalidates_shared_entries(self):
+        client = self.app.test_client()
+        self.assertEqual(len(client.get('/genres').json), 1)
+
+        client.post('/movies', json={'title': 'Posted', 'genres': [{'name': 'Drama'}]})
+        self.assertEqual(sorted(genre['name'] for genre in client.get('/genres').json), ['Action', 'Drama'])
+
+
+if __name__ == '__main__':
+    unittest.main()
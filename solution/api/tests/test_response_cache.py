@@ -0,0 +1,84 @@
+import unittest
+from cache.response_cache import ResponseCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(max_entries=2, max_bytes=100, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', b'[]', {'X-Next-Cursor': 'token'})
+
+        entry = self.cache.get('a')
+        self.assertEqual(entry.body, b'[]')
+        self.assertEqual(entry.headers, {'X-Next-Cursor': 'token'})
+        self.assertEqual(self.cache.stats(), {'backend': 'local', 'entries': 1,
+                                              'bytes': 2 + len('X-Next-Cursor') + len('token'), 'version': None,
+                                              'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', b'a')
+        self.cache.set('b', b'b')
+        self.cache.get('a')
+        self.cache.set('c', b'c')
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_entries_are_evicted_over_max_bytes(self):
+        self.cache.set('a', b'a' * 60)
+        self.cache.set('b', b'b' * 60)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['bytes'], 60)
+        # Bodies larger than the whole cache aren't stored
+        self.cache.set('c', b'c' * 101)
+        self.assertIsNone(self.cache.get('c'))
+        self.assertIsNotNone(self.cache.get('b'))
+
+    def test_entries_expire(self):
+        self.cache.set('a', b'a')
+        self.clock.now = 9.9
+        self.assertIsNotNone(self.cache.get('a'))
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['bytes'], 0)
+
+    def test_new_version_clears_entries(self):
+        self.cache.sync_version(1)
+        self.cache.set('a', b'a')
+        self.cache.sync_version(1)
+        self.assertIsNotNone(self.cache.get('a'))
+
+        self.cache.sync_version(2)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['version'], 2)
+
+    def test_disabled_cache(self):
+        cache = ResponseCache(ttl=0)
+        cache.set('a', b'a')
+
+        self.assertIsNone(cache.get('a'))
+
+    def test_from_config(self):
+        cache = ResponseCache.from_config({'CACHE_MAX_ENTRIES': '10', 'CACHE_MAX_BYTES': '', 'CACHE_TTL': '5'})
+
+        self.assertEqual((cache.max_entries, cache.max_bytes, cache.ttl), (10, 64 * 1024 * 1024, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import patch
+from sqlalchemy.dialects import postgresql
+from models.main import Movie
+from resources.search import escape_like, similarity, title_search, trigrams
+
+
+class TestSearch(unittest.TestCase):
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('Cat!'), {'  c', ' ca', 'cat', 'at '})
+        self.assertEqual(trigrams('a b'), {'  a', ' a ', '  b', ' b '})
+        self.assertEqual(trigrams('%'), set())
+
+    def test_similarity_matches_pg_trgm(self):
+        # SELECT similarity('word', 'two words') returns 0.36363637
+        self.assertAlmostEqual(similarity('word', 'two words'), 4 / 11)
+        self.assertEqual(similarity('The Matrix', 'the  MATRIX'), 1.0)
+        self.assertEqual(similarity('abc', '%'), 0.0)
+        self.assertIsNone(similarity(None, 'abc'))
+
+    def test_escape_like(self):
+        self.assertEqual(escape_like('100%_a\\b'), '100\\%\\_a\\\\b')
+
+    def test_postgres_search_uses_trigram_operators(self):
+        search_filter, rank = title_search('matrix', 'postgresql')
+        dialect = postgresql.psycopg2.dialect()
+
+        sql = str(search_filter.compile(dialect=dialect))
+        self.assertTrue(sql.startswith('movies.id IN (SELECT anon_1.id'), sql)
+        self.assertIn("WHERE movies.title ILIKE %(title_1)s ESCAPE '\\' ORDER BY movies.title <-> %(title_2)s", sql)
+        self.assertIn('WHERE movies.title %% %(title_3)s ORDER BY movies.title <-> %(title_2)s', sql)
+        self.assertEqual(sql.count('LIMIT %(param_'), 2)
+        self.assertIn('movies.title <-> %(title_', str(rank.compile(dialect=dialect)))
+
+    def test_candidates_are_bounded(self):
+        with patch('resources.search.SEARCH_CANDIDATES', 5):
+            search_filter, _ = title_search('matrix', 'postgresql')
+
+        self.assertEqual(search_filter.compile(dialect=postgresql.psycopg2.dialect()).params['param_1'], 5)
+
+    def test_candidates_are_filtered_before_they_are_bounded(self):
+        search_filter, _ = title_search('matrix', 'postgresql', lambda query: query.where(Movie.rating > 6))
+
+        sql = str(search_filter.compile(dialect=postgresql.psycopg2.dialect()))
+        self.assertIn("ILIKE %(title_1)s ESCAPE '\\' AND movies.rating > %(rating_1)s ORDER BY", sql)
+        self.assertIn('(movies.title %% %(title_3)s) AND movies.rating > %(rating_2)s ORDER BY', sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
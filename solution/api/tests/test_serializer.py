@@ -0,0 +1,81 @@
+import json
+import unittest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from models.main import Genre, Movie
+from resources.serializer import dumps, json_documents_response, movie_json_document, serialize_movie, \
+    serialize_movie_rows, serialize_movies
+
+
+class TestSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.action = Genre(name='Action', bit=0)
+        self.drama = Genre(name='Drama', bit=1)
+        self.movie = Movie(id='1', title='Movie 1', year=2020, rating=7.5, runtime=110, imdb_id='tt0000001',
+                           genre_mask=3)
+        self.movie.genres = [self.action, self.drama]
+
+    def test_serialize_movie(self):
+        self.assertEqual(serialize_movie(self.movie), {
+            'id': '1', 'title': 'Movie 1', 'year': 2020, 'rating': 7.5, 'runtime': 110,
+            'genres': [{'name': 'Action'}, {'name': 'Drama'}],
+            'imdb_link': 'https://www.imdb.com/title/tt0000001/'
+        })
+
+    def test_serialize_movie_without_imdb_id(self):
+        movie = Movie(id='2', title='Movie 2', genre_mask=0)
+
+        self.assertEqual(serialize_movie(movie), {
+            'id': '2', 'title': 'Movie 2', 'year': None, 'rating': None, 'runtime': None, 'genres': []
+        })
+
+    def test_serialize_movies_from_genre_mask(self):
+        other = Movie(id='2', title='Movie 2', genre_mask=2)
+        genre_names = [(0, 'Action'), (1, 'Drama')]
+
+        serialized = serialize_movies([self.movie, other], genre_names)
+
+        self.assertEqual([movie['genres'] for movie in serialized],
+                         [[{'name': 'Action'}, {'name': 'Drama'}], [{'name': 'Drama'}]])
+        self.assertEqual(serialized[0], serialize_movie(self.movie))
+
+    def test_serialize_movie_rows(self):
+        rows = [('1', 'Movie 1', 2020, 7.5, 110, 'tt0000001', 3), ('2', 'Movie 2', None, None, None, None, 0)]
+
+        self.assertEqual(serialize_movie_rows(rows, genre_names=[(0, 'Action'), (1, 'Drama')]),
+                         [serialize_movie(self.movie), serialize_movie(Movie(id='2', title='Movie 2'))])
+        self.assertEqual(serialize_movie_rows(rows, genres_by_movie={'1': [{'name': 'Western'}]})[0]['genres'],
+                         [{'name': 'Western'}])
+
+    def test_dumps(self):
+        payload = serialize_movies([self.movie])
+
+        self.assertEqual(json.loads(dumps(payload)), payload)
+
+    def test_json_documents_response(self):
+        response = json_documents_response(['{"id": "1"}', '{"id": "2"}'], headers={'X-Next-Cursor': 'token'})
+
+        self.assertEqual(response.get_data(as_text=True), '[{"id": "1"},{"id": "2"}]')
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.headers['X-Next-Cursor'], 'token')
+        self.assertEqual(json_documents_response([]).get_data(as_text=True), '[]')
+
+    def test_movie_json_document_compiles_for_postgres(self):
+        query = select(Movie.id, movie_json_document())
+        sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+        self.assertIn('jsonb_build_object', sql)
+        self.assertIn('jsonb_agg(jsonb_build_object', sql)
+        self.assertIn('ORDER BY genres.bit', sql)
+        self.assertIn('https://www.imdb.com/title/', sql)
+        self.assertIn('AS TEXT', sql)
+        # The genres subquery is correlated to the movie of the row
+        self.assertIn('FROM genres \nWHERE', sql)
+        self.assertIn('FROM movie_genres \nWHERE', sql)
+        # Bits go up to 62, the shift is done on a bigint
+        self.assertIn('CAST(1 AS BIGINT) << genres.bit', sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+from app import MovieAPI
+from cache.title_index import TitleIndex, TitleIndexRegistry, build_index, normalize_title
+from models.main import db, get_catalog_state, Movie
+
+
+class TestTitleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.movies = [('1', 'The Godfather', 1972, 9.2), ('2', 'Godzilla', 2014, 6.4),
+                       ('3', 'The Godfather Part II', 1974, 9.0), ('4', 'Amélie', 2001, 8.3),
+                       ('5', 'Gods and Monsters', 1998, None), ('6', 'The Good, the Bad and the Ugly', 1966, 8.8)]
+
+    def suggest(self, index, prefix, limit=10):
+        return [json.loads(document)['id'] for document in index.suggest(prefix, limit)]
+
+    def test_suggestions_are_ordered_by_rating(self):
+        index = TitleIndex(build_index(3, self.movies))
+
+        self.assertEqual(index.version, 3)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(self.suggest(index, 'god'), ['1', '3', '2', '5'])
+        self.assertEqual(self.suggest(index, 'the go'), ['1', '3', '6'])
+        self.assertEqual(self.suggest(index, 'god', limit=2), ['1', '3'])
+        self.assertEqual(self.suggest(index, 'x'), [])
+        self.assertEqual(json.loads(index.suggest('godz')[0]),
+                         {'id': '2', 'title': 'Godzilla', 'year': 2014, 'rating': 6.4})
+
+    def test_prefixes_are_normalized(self):
+        index = TitleIndex(build_index(1, self.movies))
+
+        self.assertEqual(normalize_title('  The   GODFATHER '), 'the godfather')
+        self.assertEqual(self.suggest(index, 'AMELIE'), ['4'])
+        self.assertEqual(self.suggest(index, 'amé'), ['4'])
+        self.assertEqual(self.suggest(index, 'THE  god'), ['1', '3'])
+
+    def test_hot_prefixes_match_bisection(self):
+        movies = [(str(i), f'Title {i % 37} {i}', 2000, i % 100 / 10) for i in range(300)] + self.movies
+        hot = TitleIndex(build_index(1, movies, hot_prefix_keys=4))
+        cold = TitleIndex(build_index(1, movies, hot_prefix_keys=10000))
+
+        self.assertTrue(len(hot.hot_offsets) > 1)
+        self.assertEqual(len(cold.hot_offsets), 1)
+        for prefix in ['t', 'ti', 'title 1', 'title 12 ', 'title 3', 'g', 'the', 'z']:
+            for limit in [1, 10, 50]:
+                self.assertEqual(hot.suggest(prefix, limit), cold.suggest(prefix, limit), (prefix, limit))
+
+
+class TestTitleIndexRegistry(TestCase):
+
+    def create_app(self):
+        self.directory = tempfile.TemporaryDirectory()
+        movieApi = MovieAPI('sqlite:///:memory:', title_index_dir=self.directory.name)
+        app = movieApi.app
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([Movie(id='1', title='The Godfather', rating=9.2),
+                                Movie(id='2', title='Godzilla', rating=6.4)])
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.directory.cleanup()
+
+    def get_statements(self, request):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = request()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return response, statements
+
+    def test_suggest(self):
+        client = self.app.test_client()
+
+        response = client.get('/movies/suggest?prefix=God')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([movie['title'] for movie in response.json], ['The Godfather', 'Godzilla'])
+        self.assertEqual(client.get('/movies/suggest?prefix=god&limit=1').json[0]['id'], '1')
+
+    def test_suggest_validation(self):
+        client = self.app.test_client()
+
+        for url in ['/movies/suggest', '/movies/suggest?prefix=%20', '/movies/suggest?prefix=' + 'a' * 101,
+                    '/movies/suggest?prefix=god&limit=0', '/movies/suggest?prefix=god&limit=51',
+                    '/movies/suggest?prefix=god&limit=x']:
+            self.assertEqual(client.get(url).status_code, 400, url)
+
+    def test_index_is_mapped_from_file_shared_by_workers(self):
+        client = self.app.test_client()
+        client.get('/movies/suggest?prefix=god')
+        paths = os.listdir(self.directory.name)
+        self.assertEqual(len(paths), 1)
+
+        # Another worker maps the file written by the first one instead of reading the movies
+        worker = TitleIndexRegistry(self.directory.name)
+        with self.app.app_context():
+            index, statements = self.get_statements(lambda: worker.get(get_catalog_state))
+        self.assertFalse([statement for statement in statements if 'FROM movies' in statement], statements)
+        self.assertEqual(len(index.suggest('god')), 2)
+
+    def test_index_is_rebuilt_after_writes(self):
+        client = self.app.test_client()
+        self.assertEqual(len(client.get('/movies/suggest?prefix=god').json), 2)
+
+        _, statements = self.get_statements(lambda: client.get('/movies/suggest?prefix=god'))
+        self.assertFalse([statement for statement in statements if 'FROM movies' in statement], statements)
+
+        client.post('/movies', json={'title': 'Gods and Monsters', 'rating': 7.4})
+        self.assertEqual([movie['title'] for movie in client.get('/movies/suggest?prefix=god').json],
+                         ['The Godfather', 'Gods and Monsters', 'Godzilla'])
+        # The index of the previous version was removed
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+    def test_rebuilds_are_spaced_by_rebuild_interval(self):
+        worker = TitleIndexRegistry(self.directory.name, rebuild_interval=60)
+        with self.app.app_context():
+            index = worker.get(get_catalog_state)
+        self.app.test_client().post('/movies', json={'title': 'Gods and Monsters', 'rating': 7.4})
+
+        with self.app.app_context():
+            # The index built less than a minute ago keeps answering after the write
+            same_index, statements = self.get_statements(lambda: worker.get(get_catalog_state))
+            self.assertIs(same_index, index)
+            # A worker started meanwhile maps it instead of building one for the new version
+            other_index, statements = self.get_statements(
+                lambda: TitleIndexRegistry(self.directory.name, rebuild_interval=60).get(get_catalog_state))
+            self.assertFalse([statement for statement in statements if 'FROM movies' in statement], statements)
+            self.assertEqual(other_index.version, index.version)
+
+            # A minute later
+            worker.loaded_at -= 60
+            for name in os.listdir(self.directory.name):
+                path = os.path.join(self.directory.name, name)
+                os.utime(path, (os.path.getmtime(path) - 60,) * 2)
+            self.assertEqual(len(worker.get(get_catalog_state).suggest('god')), 3)
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from app import MovieAPI
+from models.main import db, Genre, Movie
+from resources.movie import filter_movies
+from resources.total import Explain, count_total
+
+
+class TestTotal(TestCase):
+
+    def create_app(self):
+        movieApi = MovieAPI('sqlite:///:memory:')
+        app = movieApi.app
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        with self.app.app_context():
+            db.create_all()
+            genres = {name: Genre(name=name) for name in ['Action', 'Drama', 'Comedy']}
+            for i in range(30):
+                movie = Movie(id=f'{i:02d}', title=f'Movie {i}', rating=i % 10)
+                movie.genres.extend(genres[name] for name in ['Action', 'Drama', 'Comedy'][:i % 4])
+                db.session.add(movie)
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def get_ids(self, query):
+        return sorted(db.session.execute(query).scalars())
+
+    def test_estimate_filters_match_mask_filters(self):
+        # The filters the planner estimates select the same movies as the ones counted
+        for genre_names, genre_match, rating_gt in [(('Drama',), 'all', None), (('Action', 'Drama'), 'all', '4'),
+                                                    (('Comedy', 'Drama'), 'any', None), (('Unknown',), 'any', '2'),
+                                                    (None, 'all', '7.5')]:
+            by_mask = filter_movies(select(Movie.id), genre_names, genre_match, rating_gt, None)
+            by_movie_genres = filter_movies(select(Movie.id), genre_names, genre_match, rating_gt, None,
+                                            by_mask=False)
+            self.assertEqual(self.get_ids(by_mask), self.get_ids(by_movie_genres), (genre_names, genre_match))
+            self.assertNotIn('genre_mask', str(by_movie_genres))
+
+    def test_count_total_is_exact_outside_postgres(self):
+        query = filter_movies(select(Movie.id), ('Drama',), 'all', None, None)
+
+        self.assertEqual(count_total(query, query, 'sqlite', exact_limit=5), (14, True))
+
+    def test_explain_compiles_for_postgres(self):
+        query = filter_movies(select(Movie.id), ('Drama',), 'all', '5', None, by_mask=False)
+        sql = str(Explain(query).compile(dialect=postgresql.dialect()))
+
+        self.assertTrue(sql.startswith('EXPLAIN (FORMAT JSON) SELECT movies.id'), sql)
+        self.assertIn('movie_genres', sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
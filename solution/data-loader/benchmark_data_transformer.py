@@ -0,0 +1,69 @@
+import argparse
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from utils.data_transformer import DataTransformer
+
+GENRES = ["Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Documentary", "Drama", "Family",
+          "Fantasy", "History", "Horror", "Music", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+
+
+def synthetic_basics(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    genre_count = rng.integers(0, 4, rows)
+    genres = [",".join(rng.choice(GENRES, count, replace=False)) if count else r"\N" for count in genre_count]
+    return pd.DataFrame({
+        "tconst": [f"tt{i:07d}" for i in range(rows)],
+        "titleType": "movie",
+        "primaryTitle": [f"Movie {i}" for i in range(rows)],
+        "startYear": rng.integers(1900, 2024, rows).astype(str),
+        "runtimeMinutes": rng.integers(1, 240, rows).astype(str),
+        "genres": genres,
+    })
+
+
+def legacy_movie_ids(basics_df):
+    return basics_df["tconst"].apply(lambda x: str(uuid.uuid5(uuid.NAMESPACE_URL, x)))
+
+
+def legacy_genres_data(filtered_basics_df):
+    genres_movie_data = filtered_basics_df[["movie_id", "genres"]].copy()
+    genres_movie_data["genres"] = genres_movie_data["genres"].apply(lambda x: x.split(','))
+    genres_movie_data = genres_movie_data.explode("genres")
+    genres_movie_data = genres_movie_data[genres_movie_data["genres"] != r"\N"]
+    genres_movie_data["genre_id"] = genres_movie_data["genres"].apply(
+        lambda x: str(uuid.uuid5(uuid.NAMESPACE_URL, x)))
+    genres_data = genres_movie_data[["genre_id", "genres"]]
+    genres_data.columns = ["id", "name"]
+    return genres_data.drop_duplicates(subset='id'), genres_movie_data
+
+
+def timed(name, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{name:<28}{time.perf_counter() - start:8.2f}s")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the DataTransformer stages on a synthetic basics frame.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    basics_df = synthetic_basics(args.rows)
+    transformer = DataTransformer()
+    print(f"{args.rows} basics rows")
+
+    print("legacy")
+    movie_ids = timed("movie ids", legacy_movie_ids, basics_df)
+    legacy_genres, _ = timed("genres", legacy_genres_data, basics_df.assign(movie_id=movie_ids))
+
+    print("vectorized")
+    prepared_df = timed("prepare_basics_data", transformer.prepare_basics_data, basics_df.copy())
+    genres_data, _ = timed("get_genres_data", transformer.get_genres_data, prepared_df)
+
+    assert prepared_df["movie_id"].tolist() == movie_ids.tolist()
+    assert sorted(genres_data["id"]) == sorted(legacy_genres["id"])
@@ -1,35 +1,127 @@
 from utils.data_transformer import DataTransformer
-from utils.data_inserter import DataInserter
-from utils.data_source import DataSource
+from utils.data_inserter import DataInserter, PARALLEL_CHUNKSIZE
+from utils.data_source import DataSource, DEFAULT_CHUNKSIZE
+from utils.schema_migrator import SchemaMigrator
+from utils.table_swapper import TableSwapper, SWAPPED_TABLES
+from utils.imdb_schema import TITLE_BASICS, TITLE_RATINGS, TITLE_AKAS
+import argparse
 import json
 
+import pandas as pd
+
 
 class DataLoader:
-    def __init__(self, db_params):
+    def __init__(self, db_params, parallel_workers=0, parallel_chunksize=PARALLEL_CHUNKSIZE):
         self.data_transformer = DataTransformer()
-        self.data_inserter = DataInserter(db_params)
+        self.data_inserter = DataInserter(db_params, parallel_workers=parallel_workers or 1,
+                                          parallel_chunksize=parallel_chunksize)
+        self.parallel_insert = bool(parallel_workers)
+        self.schema_migrator = SchemaMigrator(self.data_inserter.conn)
+        self.table_swapper = TableSwapper(self.data_inserter.conn)
+        # Tables the rows are inserted into, the shadow tables while loading with atomic_swap
+        self.target_tables = {table: table for table in SWAPPED_TABLES}
+        # Genre name -> bit in movies.genre_mask of the current load
+        self.genre_bits = {}
 
-    def etl_movies_genres(self, basics_ds, ratings_ds, akas_ds):
+    def etl_movies_genres(self, basics_ds, ratings_ds, akas_ds, chunksize=None, atomic_swap=False):
         try:
-            self.truncate_tables(["movie_genres", "genres", "movies"])
-            genres_movie_data = self.insert_movies_and_genres_rows_and_retrieve_relation(basics_ds, ratings_ds, akas_ds)
-            movie_genres_data = self.data_transformer.get_movie_genres_data(genres_movie_data)
-            self.data_inserter.execute_insert(movie_genres_data, "movie_genres")
+            self.schema_migrator.migrate()
+            self.genre_bits = {}
+            if atomic_swap:
+                self.target_tables = self.table_swapper.create_shadow_tables()
+            else:
+                self.truncate_tables(["movie_genres", "genres", "movies"])
+            if chunksize:
+                self.insert_movies_and_genres_in_chunks(basics_ds, ratings_ds, akas_ds, chunksize)
+            else:
+                genres_movie_data = self.insert_movies_and_genres_rows_and_retrieve_relation(basics_ds, ratings_ds, akas_ds)
+                movie_genres_data = self.data_transformer.get_movie_genres_data(genres_movie_data)
+                self.data_inserter.execute_insert(movie_genres_data, self.target_tables["movie_genres"], self.parallel_insert)
+            if atomic_swap:
+                self.table_swapper.build_indexes()
+                self.table_swapper.swap()
+                self.target_tables = {table: table for table in SWAPPED_TABLES}
+            self.data_inserter.bump_catalog_version()
             self.data_inserter.close_connection()
         except Exception as e:
             self.data_inserter.rollback()
             print(f"Error: {e}")
 
+    def etl_movies_genres_incremental(self, basics_ds, ratings_ds, akas_ds, chunksize=None):
+        try:
+            self.schema_migrator.migrate()
+            # Only rows written by the loader carry a content hash, movies created through the API are left alone
+            loaded_hashes = self.data_inserter.read_frame(
+                "SELECT id, content_hash FROM movies WHERE content_hash IS NOT NULL")
+            self.genre_bits = self.read_genre_bits()
+            if chunksize:
+                batches = self.data_transformer.iter_movies_data(basics_ds, ratings_ds, akas_ds, chunksize)
+            else:
+                batches = [self.data_transformer.get_movies_data(basics_ds, ratings_ds, akas_ds)]
+            dataset_ids = set()
+            changed_movies = 0
+            for movies_data, basics_df in batches:
+                dataset_ids.update(movies_data["id"])
+                changed_movies += self.upsert_changed_movies(movies_data, basics_df, loaded_hashes)
+            removed_ids = loaded_hashes.loc[~loaded_hashes["id"].isin(dataset_ids), ["id"]]
+            self.data_inserter.delete_keys(removed_ids.rename(columns={"id": "movie_id"}), "movie_genres", "movie_id")
+            self.data_inserter.delete_keys(removed_ids, "movies", "id")
+            print(f'Upserted {changed_movies} and removed {len(removed_ids)} movies from {len(dataset_ids)}')
+            self.data_inserter.bump_catalog_version()
+            self.data_inserter.close_connection()
+        except Exception as e:
+            self.data_inserter.rollback()
+            print(f"Error: {e}")
+
+    def upsert_changed_movies(self, movies_data, basics_df, loaded_hashes):
+        changed_movies_data = self.data_transformer.get_movies_delta(movies_data, loaded_hashes)
+        if changed_movies_data.empty:
+            return 0
+        changed_basics_df = basics_df[basics_df["movie_id"].isin(changed_movies_data["id"])]
+        genres_data, genres_movie_data = self.data_transformer.get_genres_data(changed_basics_df)
+        genres_data = self.data_transformer.assign_genre_bits(genres_data, self.genre_bits)
+        changed_movies_data = self.data_transformer.assign_genre_masks(changed_movies_data, genres_movie_data,
+                                                                       self.genre_bits)
+        self.data_inserter.upsert(changed_movies_data, "movies", ["id"])
+        self.data_inserter.upsert(genres_data, "genres", ["name"], update_columns=[])
+        # Genres created through the API have random ids, so links are resolved by name
+        genre_ids = self.data_inserter.read_frame("SELECT id, name FROM genres")
+        genres_movie_data = genres_movie_data.assign(
+            genre_id=genres_movie_data["genres"].map(dict(zip(genre_ids["name"], genre_ids["id"]))))
+        # Only the links of changed movies are rewritten
+        changed_ids = changed_movies_data[["id"]].rename(columns={"id": "movie_id"})
+        self.data_inserter.delete_keys(changed_ids, "movie_genres", "movie_id")
+        movie_genres_data = self.data_transformer.get_movie_genres_data(genres_movie_data)
+        self.data_inserter.execute_insert(movie_genres_data, "movie_genres")
+        return len(changed_movies_data)
+
     def insert_movies_and_genres_rows_and_retrieve_relation(self, basics_ds, ratings_ds, akas_ds):
-        movie_genres_df = self.insert_movies_data_and_get_movie_genres_data(basics_ds, ratings_ds, akas_ds)
-        genres_data, genres_movie_data = self.data_transformer.get_genres_data(movie_genres_df)
-        self.data_inserter.execute_insert(genres_data, "genres")
+        movies_data, basics_df = self.data_transformer.get_movies_data(basics_ds, ratings_ds, akas_ds)
+        return self.insert_movies_and_genres_rows(movies_data, basics_df, set())
+
+    def insert_movies_and_genres_rows(self, movies_data, basics_df, inserted_genre_ids):
+        # Genres are resolved first, the movies carry the mask of their genre bits
+        genres_data, genres_movie_data = self.data_transformer.get_genres_data(basics_df)
+        genres_data = self.data_transformer.assign_genre_bits(genres_data, self.genre_bits)
+        movies_data = self.data_transformer.assign_genre_masks(movies_data, genres_movie_data, self.genre_bits)
+        self.data_inserter.execute_insert(movies_data, self.target_tables["movies"], self.parallel_insert)
+        # Genre ids are deterministic so each genre only has to be inserted the first time it shows up
+        genres_data = genres_data[~genres_data["id"].isin(inserted_genre_ids)]
+        self.data_inserter.execute_insert(genres_data, self.target_tables["genres"])
+        inserted_genre_ids.update(genres_data["id"])
         return genres_movie_data
 
-    def insert_movies_data_and_get_movie_genres_data(self, basics_ds, ratings_ds, akas_ds):
-        movies_data, basics_df = self.data_transformer.get_movies_data(basics_ds, ratings_ds, akas_ds)
-        self.data_inserter.execute_insert(movies_data, "movies")
-        return basics_df
+    def insert_movies_and_genres_in_chunks(self, basics_ds, ratings_ds, akas_ds, chunksize):
+        # Pipeline each basics chunk through transform and insert so only one chunk is held in memory
+        inserted_genre_ids = set()
+        for movies_data, basics_df in self.data_transformer.iter_movies_data(basics_ds, ratings_ds, akas_ds, chunksize):
+            genres_movie_data = self.insert_movies_and_genres_rows(movies_data, basics_df, inserted_genre_ids)
+            movie_genres_data = self.data_transformer.get_movie_genres_data(genres_movie_data)
+            self.data_inserter.execute_insert(movie_genres_data, self.target_tables["movie_genres"], self.parallel_insert)
+
+    def read_genre_bits(self):
+        genre_bits = self.data_inserter.read_frame("SELECT name, bit FROM genres")
+        return {name: None if pd.isna(bit) else int(bit) for name, bit in zip(genre_bits["name"], genre_bits["bit"])}
 
     def truncate_tables(self, table_names):
         for table in table_names:
@@ -38,6 +130,11 @@ class DataLoader:
 
 # Usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the IMDb movies dataset into the movies database")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only upsert changed movies and delete removed ones instead of a full reload")
+    args = parser.parse_args()
+
     with open('config.json') as config_file:
         config_data = json.load(config_file)
         # Use the config data to construct the db_params dictionary
@@ -49,9 +146,28 @@ if __name__ == "__main__":
             "database": config_data["DB_NAME"],
         }
 
-        basics_ds = DataSource("https://datasets.imdbws.com/title.basics.tsv.gz", True)
-        ratings_ds = DataSource("https://datasets.imdbws.com/title.ratings.tsv.gz", True)
-        akas_ds = None #DataSource("https://datasets.imdbws.com/title.akas.tsv.gz", True)
+        # Keep the downloaded files on disk and only download them again when they changed upstream
+        cache_options = {
+            "cache_dir": config_data.get("DATA_CACHE_DIR") or None,
+            "offline": str(config_data.get("OFFLINE")).lower() == "true",
+        }
+        basics_ds = DataSource("https://datasets.imdbws.com/title.basics.tsv.gz", True, schema=TITLE_BASICS,
+                               **cache_options)
+        ratings_ds = DataSource("https://datasets.imdbws.com/title.ratings.tsv.gz", True, schema=TITLE_RATINGS,
+                                **cache_options)
+        akas_ds = DataSource("https://datasets.imdbws.com/title.akas.tsv.gz", True, schema=TITLE_AKAS,
+                             **cache_options)
+
+        # Number of connections loading movies and movie_genres in parallel, 0 loads serially, and the fewest rows
+        # each of them is given
+        parallel_workers = int(config_data.get("PARALLEL_WORKERS") or 0)
+        parallel_chunksize = int(config_data.get("PARALLEL_CHUNKSIZE") or PARALLEL_CHUNKSIZE)
+        # Basics rows transformed and inserted at a time
+        chunksize = int(config_data.get("LOAD_CHUNKSIZE") or DEFAULT_CHUNKSIZE)
 
-        data_loader = DataLoader(db_params)
-        data_loader.etl_movies_genres(basics_ds, ratings_ds, akas_ds)
+        data_loader = DataLoader(db_params, parallel_workers, parallel_chunksize)
+        if args.incremental:
+            data_loader.etl_movies_genres_incremental(basics_ds, ratings_ds, akas_ds, chunksize=chunksize)
+        else:
+            # Load into shadow tables and swap them in so the API never serves a partial catalog
+            data_loader.etl_movies_genres(basics_ds, ratings_ds, akas_ds, chunksize=chunksize, atomic_swap=True)
@@ -1,7 +1,8 @@
 import json
 
 from data_loader import DataLoader
-from utils.data_source import DataSource
+from utils.data_source import DataSource, DEFAULT_CHUNKSIZE
+from utils.imdb_schema import TITLE_BASICS, TITLE_RATINGS, TITLE_AKAS
 import cProfile
 
 if __name__ == "__main__":
@@ -16,9 +17,17 @@ if __name__ == "__main__":
             "database": config_data["DB_NAME"],
         }
 
-        basics_ds = DataSource("https://datasets.imdbws.com/title.basics.tsv.gz", True)
-        ratings_ds = DataSource("https://datasets.imdbws.com/title.ratings.tsv.gz", True)
-        akas_ds = None #DataSource("https://datasets.imdbws.com/title.akas.tsv.gz", True)
+        # Keep the downloaded files on disk and only download them again when they changed upstream
+        cache_options = {
+            "cache_dir": config_data.get("DATA_CACHE_DIR") or None,
+            "offline": str(config_data.get("OFFLINE")).lower() == "true",
+        }
+        basics_ds = DataSource("https://datasets.imdbws.com/title.basics.tsv.gz", True, schema=TITLE_BASICS,
+                               **cache_options)
+        ratings_ds = DataSource("https://datasets.imdbws.com/title.ratings.tsv.gz", True, schema=TITLE_RATINGS,
+                                **cache_options)
+        akas_ds = DataSource("https://datasets.imdbws.com/title.akas.tsv.gz", True, schema=TITLE_AKAS,
+                             **cache_options)
 
         data_loader = DataLoader(db_params)
-        cProfile.run('data_loader.etl_movies_genres(basics_ds, ratings_ds, akas_ds)')
+        cProfile.run('data_loader.etl_movies_genres(basics_ds, ratings_ds, akas_ds, chunksize=DEFAULT_CHUNKSIZE, atomic_swap=True)')
@@ -0,0 +1,74 @@
+import unittest
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.data_inserter import DataInserter, FrameCsvStream
+
+
+class TestDataInserter(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = pd.DataFrame({
+            'id': ['a', 'b', 'c'],
+            'title': ['Movie, "One"', 'Movie2', 'Movie3'],
+            'year': [2000.0, None, 1995.0],
+            'runtime': pd.Series([120.0, None, 90.0], dtype=object),
+            'rating': [8.0, None, 7.5]
+        })
+
+    def test_frame_csv_stream(self):
+        stream = FrameCsvStream(self.frame, rows_per_read=2)
+
+        content = ''
+        while True:
+            data = stream.read(5)
+            if not data:
+                break
+            content += data
+
+        # Integral columns are written as integers and missing values with the COPY null marker
+        self.assertEqual(content.splitlines(), [
+            'a,"Movie, ""One""",2000,120,8.0',
+            'b,Movie2,\\N,\\N,\\N',
+            'c,Movie3,1995,90,7.5'
+        ])
+
+    def test_execute_insert_falls_back_to_to_sql(self):
+        data_inserter = DataInserter({'url': 'sqlite://'})
+        data_inserter.conn.execute(text(
+            'CREATE TABLE movies (id TEXT PRIMARY KEY, title TEXT, year INTEGER, runtime INTEGER, rating REAL)'))
+
+        data_inserter.execute_insert(self.frame, 'movies')
+
+        self.assertEqual(data_inserter.insert_method, 'to_sql')
+        self.assertEqual(data_inserter.insert_stats['movies'][0], 3)
+        rows = data_inserter.conn.execute(text('SELECT id, year FROM movies ORDER BY id')).fetchall()
+        self.assertEqual([tuple(row) for row in rows], [('a', 2000), ('b', None), ('c', 1995)])
+        data_inserter.close_connection()
+
+    def test_parallel_insert_falls_back_to_serial_without_copy(self):
+        data_inserter = DataInserter({'url': 'sqlite://'}, parallel_workers=2, parallel_chunksize=1)
+        data_inserter.conn.execute(text(
+            'CREATE TABLE movies (id TEXT PRIMARY KEY, title TEXT, year INTEGER, runtime INTEGER, rating REAL)'))
+
+        data_inserter.execute_insert(self.frame, 'movies', enable_parallel_insert=True)
+
+        self.assertEqual(data_inserter.staging_tables, [])
+        self.assertEqual(data_inserter.conn.execute(text('SELECT COUNT(*) FROM movies')).scalar(), 3)
+        data_inserter.close_connection()
+
+    def test_frames_are_split_by_size_for_workers(self):
+        data_inserter = DataInserter({'url': 'sqlite://'}, parallel_workers=4, parallel_chunksize=5000)
+        frame = pd.DataFrame({'id': range(12000)})
+
+        # 12000 movies of a loader chunk go to 2 workers of 6000 rows, 25000 links to 4 workers
+        self.assertEqual([len(chunk) for chunk in data_inserter.split_for_workers(frame)], [6000, 6000])
+        self.assertEqual([len(chunk) for chunk in data_inserter.split_for_workers(pd.DataFrame({'id': range(25000)}))],
+                         [6250] * 4)
+        self.assertEqual(len(data_inserter.split_for_workers(frame.iloc[:9999])), 1)
+        data_inserter.close_connection()
+
+
+if __name__ == '__main__':
+    unittest.main()
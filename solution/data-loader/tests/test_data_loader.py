@@ -0,0 +1,120 @@
+import unittest
+from unittest.mock import MagicMock
+
+import pandas as pd
+from sqlalchemy import text
+
+from data_loader import DataLoader
+from utils.data_source import DataSource
+
+
+class TestDataLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.data_loader = DataLoader({'url': 'sqlite://'})
+        with self.data_loader.data_inserter.engine.begin() as conn:
+            conn.execute(text('CREATE TABLE movies (id TEXT PRIMARY KEY, title TEXT NOT NULL, year INTEGER, '
+                              'rating REAL, runtime INTEGER, imdb_id TEXT, content_hash BIGINT, '
+                              'genre_mask BIGINT NOT NULL DEFAULT 0)'))
+            conn.execute(text('CREATE TABLE genres (id TEXT PRIMARY KEY, name TEXT NOT NULL UNIQUE, '
+                              'bit SMALLINT UNIQUE)'))
+            conn.execute(text('CREATE TABLE movie_genres (movie_id TEXT, genre_id TEXT, PRIMARY KEY (movie_id, genre_id))'))
+            conn.execute(text('CREATE TABLE catalog_state (id SMALLINT PRIMARY KEY, version BIGINT NOT NULL, '
+                              'updated_at TIMESTAMP)'))
+            # Movie and genre created through the API
+            conn.execute(text("INSERT INTO movies (id, title) VALUES ('api-movie', 'Posted')"))
+            conn.execute(text("INSERT INTO genres (id, name, bit) VALUES ('api-genre', 'Drama', 0)"))
+        self.basics_ds = DataSource("mock_basics_source", downloadable=True)
+        self.ratings_ds = DataSource("mock_ratings_source", downloadable=True)
+        self.set_dataset(
+            pd.DataFrame({
+                'tconst': ['tt1', 'tt2', 'tt3'],
+                'titleType': ['movie', 'movie', 'movie'],
+                'runtimeMinutes': ['120', '\\N', '90'],
+                'startYear': ['2000', '\\N', '1995'],
+                'primaryTitle': ['Movie1', 'Movie2', 'Movie3'],
+                'genres': ['Action', 'Drama', 'Action,Comedy']
+            }),
+            pd.DataFrame({'tconst': ['tt1', 'tt2', 'tt3'], 'averageRating': ['8.0', '\\N', '7.5']}))
+
+    def set_dataset(self, basics_df, ratings_df):
+        self.basics_ds.read = MagicMock(return_value=basics_df)
+        self.ratings_ds.read = MagicMock(return_value=ratings_df)
+
+    def query(self, sql):
+        with self.data_loader.data_inserter.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(text(sql)).fetchall()]
+
+    def test_etl_movies_genres_incremental(self):
+        self.data_loader.etl_movies_genres_incremental(self.basics_ds, self.ratings_ds, None)
+
+        self.assertEqual(self.query('SELECT imdb_id, rating FROM movies ORDER BY title'),
+                         [('tt1', 8.0), ('tt2', None), ('tt3', 7.5), (None, None)])
+        # The existing Drama genre is reused instead of inserting the loader's own id
+        self.assertEqual(self.query(
+            "SELECT m.imdb_id FROM movie_genres mg JOIN movies m ON m.id = mg.movie_id "
+            "WHERE mg.genre_id = 'api-genre'"), [('tt2',)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM movie_genres'), [(4,)])
+        # Drama keeps its bit, the new genres take the next free ones
+        self.assertEqual(self.query('SELECT name, bit FROM genres ORDER BY bit'),
+                         [('Drama', 0), ('Action', 1), ('Comedy', 2)])
+        self.assertEqual(self.query('SELECT imdb_id, genre_mask FROM movies ORDER BY title'),
+                         [('tt1', 2), ('tt2', 1), ('tt3', 6), (None, 0)])
+        self.assertEqual(self.query('SELECT version FROM catalog_state'), [(1,)])
+
+        # Next run: tt1 rating refreshed, tt2 gets a new genre and tt3 disappears from the dataset
+        first_hashes = dict(self.query('SELECT imdb_id, content_hash FROM movies WHERE content_hash IS NOT NULL'))
+        self.reconnect()
+        self.set_dataset(
+            pd.DataFrame({
+                'tconst': ['tt1', 'tt2'],
+                'titleType': ['movie', 'movie'],
+                'runtimeMinutes': ['120', '\\N'],
+                'startYear': ['2000', '\\N'],
+                'primaryTitle': ['Movie1', 'Movie2'],
+                'genres': ['Action', 'Drama,Comedy']
+            }),
+            pd.DataFrame({'tconst': ['tt1', 'tt2'], 'averageRating': ['8.2', '\\N']}))
+        self.data_loader.etl_movies_genres_incremental(self.basics_ds, self.ratings_ds, None)
+
+        self.assertEqual(self.query('SELECT imdb_id, rating FROM movies ORDER BY title'),
+                         [('tt1', 8.2), ('tt2', None), (None, None)])
+        second_hashes = dict(self.query('SELECT imdb_id, content_hash FROM movies WHERE content_hash IS NOT NULL'))
+        self.assertNotEqual(second_hashes['tt1'], first_hashes['tt1'])
+        self.assertEqual(self.query(
+            "SELECT g.name FROM movie_genres mg JOIN movies m ON m.id = mg.movie_id "
+            "JOIN genres g ON g.id = mg.genre_id WHERE m.imdb_id = 'tt2' ORDER BY g.name"), [('Comedy',), ('Drama',)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM movie_genres'), [(3,)])
+        self.assertEqual(self.query('SELECT imdb_id, genre_mask FROM movies ORDER BY title'),
+                         [('tt1', 2), ('tt2', 5), (None, 0)])
+        self.assertEqual(self.query('SELECT version FROM catalog_state'), [(2,)])
+
+    def test_chunked_load_inserts_in_parallel(self):
+        # COPY is Postgres only, the inserts are recorded instead of run
+        data_loader = DataLoader({'url': 'sqlite://'}, parallel_workers=2, parallel_chunksize=1)
+        data_inserter = data_loader.data_inserter
+        data_inserter.insert_method = 'copy'
+        data_inserter.parallel_insert = MagicMock()
+        data_inserter.copy_insert = MagicMock()
+        data_inserter.truncate_table = MagicMock()
+        data_loader.schema_migrator.migrate = MagicMock()
+        data_inserter.bump_catalog_version = MagicMock()
+        basics_df = self.basics_ds.read.return_value
+        self.basics_ds.read_chunks = MagicMock(side_effect=lambda chunksize=None, columns=None: iter(
+            [basics_df[columns or basics_df.columns]]))
+
+        data_loader.etl_movies_genres(self.basics_ds, self.ratings_ds, None, chunksize=10)
+
+        inserts = {table: [len(chunk) for chunk in chunks]
+                   for (chunks, table), _ in data_inserter.parallel_insert.call_args_list}
+        self.assertEqual(inserts, {'movies': [2, 1], 'movie_genres': [2, 2]})
+        # Genres are few and always inserted serially
+        self.assertEqual([call.args[1] for call in data_inserter.copy_insert.call_args_list], ['genres'])
+
+    def reconnect(self):
+        # The loader closes its connection at the end of a run, the next run reuses the in-memory database
+        self.data_loader.data_inserter.conn = self.data_loader.data_inserter.engine.connect()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from functools import partial
+
+import pandas as pd
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.data_source import DataSource
+from utils.imdb_schema import TITLE_BASICS
+
+BASICS_TSV = (
+    "tconst\ttitleType\tprimaryTitle\tstartYear\n"
+    "tt1\tmovie\tMovie1\t2000\n"
+    "tt2\tshort\tShort1\t2001\n"
+    "tt3\tmovie\tMovie3\t\\N\n"
+    "tt4\tmovie\tMovie4\t2004\n"
+    "tt5\ttvSeries\tSeries5\t2005\n"
+)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    # Local stand-in for datasets.imdbws.com with ETag revalidation
+    requests_log = []
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        with open(path, 'rb') as file:
+            content = file.read()
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.requests_log.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.requests_log.append(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDataSource(unittest.TestCase):
+
+    def setUp(self):
+        # Serve a gzipped tsv from a temporary directory as a local stand-in for datasets.imdbws.com
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "title.basics.tsv.gz")
+        with gzip.open(self.file_path, "wt") as file:
+            file.write(BASICS_TSV)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=self.directory))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/title.basics.tsv.gz"
+        self.cache_dir = os.path.join(self.directory, "cache")
+        QuietHandler.requests_log = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_read_chunks_local_file(self):
+        chunks = list(DataSource(self.file_path, False).read_chunks(chunksize=2))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([tconst for chunk in chunks for tconst in chunk["tconst"]], ["tt1", "tt2", "tt3", "tt4", "tt5"])
+
+    def test_read_chunks_download(self):
+        chunks = list(DataSource(self.url, True, chunksize=3).read_chunks())
+
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 2])
+        self.assertEqual(chunks[1]["primaryTitle"].tolist(), ["Movie4", "Series5"])
+
+    def test_read_download(self):
+        df = DataSource(self.url, True).read()
+
+        self.assertEqual(df["tconst"].tolist(), ["tt1", "tt2", "tt3", "tt4", "tt5"])
+
+    def test_read_with_row_filter(self):
+        data_source = DataSource(self.url, True, chunksize=2)
+
+        df = data_source.read(row_filter=lambda chunk: chunk[chunk["titleType"] == "movie"])
+
+        self.assertEqual(df["tconst"].tolist(), ["tt1", "tt3", "tt4"])
+        self.assertEqual(df.index.tolist(), [0, 1, 2])
+
+    def test_cache_revalidates_with_etag(self):
+        data_source = DataSource(self.url, True, cache_dir=self.cache_dir)
+
+        first_df = data_source.read()
+        second_chunks = list(data_source.read_chunks(chunksize=5))
+
+        # The second read only revalidates, the body is read from the cache
+        self.assertEqual(QuietHandler.requests_log, [200, 304])
+        self.assertEqual(first_df["tconst"].tolist(), second_chunks[0]["tconst"].tolist())
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, "title.basics.tsv.gz")))
+
+    def test_cache_downloads_changed_file(self):
+        data_source = DataSource(self.url, True, cache_dir=self.cache_dir)
+        data_source.read()
+        with gzip.open(self.file_path, "wt") as file:
+            file.write(BASICS_TSV + "tt6\tmovie\tMovie6\t2006\n")
+
+        df = data_source.read()
+
+        self.assertEqual(QuietHandler.requests_log, [200, 200])
+        self.assertEqual(df["tconst"].tolist()[-1], "tt6")
+
+    def test_cache_discards_corrupted_file(self):
+        data_source = DataSource(self.url, True, cache_dir=self.cache_dir)
+        data_source.read()
+        with open(os.path.join(self.cache_dir, "title.basics.tsv.gz"), "ab") as file:
+            file.write(b"corrupted")
+
+        df = data_source.read()
+
+        # A checksum mismatch means an unconditional download
+        self.assertEqual(QuietHandler.requests_log, [200, 200])
+        self.assertEqual(len(df), 5)
+
+    def test_offline_reads_cache_without_network(self):
+        DataSource(self.url, True, cache_dir=self.cache_dir).read()
+
+        df = DataSource(self.url, True, cache_dir=self.cache_dir, offline=True).read()
+
+        self.assertEqual(QuietHandler.requests_log, [200])
+        self.assertEqual(len(df), 5)
+
+    def test_offline_without_cache(self):
+        data_source = DataSource(self.url, True, cache_dir=self.cache_dir, offline=True)
+
+        with self.assertRaises(FileNotFoundError):
+            data_source.read()
+        self.assertEqual(QuietHandler.requests_log, [])
+
+    def test_read_with_schema(self):
+        path = os.path.join(self.directory, "typed.tsv")
+        with open(path, "w") as file:
+            file.write(
+                "tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\truntimeMinutes\tgenres\n"
+                "tt1\tmovie\t\"Quoted\" Title\tx\t0\t2000\t\\N\t120\tAction,Drama\n"
+                "tt2\tmovie\tNA\tx\t0\t\\N\t\\N\t\\N\t\\N\n")
+
+        df = DataSource(path, False, schema=TITLE_BASICS).read()
+
+        # Only the declared columns, in compact types, and only \N is null
+        self.assertEqual(df.columns.tolist(), TITLE_BASICS.usecols)
+        self.assertEqual(str(df["titleType"].dtype), "category")
+        self.assertEqual(str(df["startYear"].dtype), "Int16")
+        self.assertEqual(str(df["runtimeMinutes"].dtype), "Int32")
+        self.assertEqual(df["primaryTitle"].tolist(), ['"Quoted" Title', 'NA'])
+        self.assertTrue(df["startYear"].isna().tolist()[1])
+        self.assertTrue(pd.isna(df["genres"].tolist()[1]))
+
+    def test_read_chunks_with_schema_coerces_malformed_values(self):
+        path = os.path.join(self.directory, "malformed.tsv")
+        with open(path, "w") as file:
+            file.write("tconst\ttitleType\tprimaryTitle\tstartYear\truntimeMinutes\tgenres\n")
+            for index in range(5):
+                runtime = "Reality-TV" if index == 3 else "90"
+                file.write(f"tt{index}\tmovie\tMovie{index}\t2000\t{runtime}\tDrama\n")
+
+        chunks = list(DataSource(path, False, chunksize=2, schema=TITLE_BASICS).read_chunks())
+
+        # The malformed value becomes null in a single pass, without losing or repeating rows
+        self.assertEqual([tconst for chunk in chunks for tconst in chunk["tconst"]], ["tt0", "tt1", "tt2", "tt3", "tt4"])
+        runtimes = [runtime for chunk in chunks for runtime in chunk["runtimeMinutes"]]
+        self.assertTrue(pd.isna(runtimes[3]))
+        self.assertEqual(runtimes[4], 90)
+
+
+if __name__ == '__main__':
+    unittest.main()
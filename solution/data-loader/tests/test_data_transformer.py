@@ -1,7 +1,8 @@
 import unittest
+import uuid
 import pandas as pd
 from unittest.mock import MagicMock
-from utils.data_transformer import DataTransformer
+from utils.data_transformer import DataTransformer, uuid5_strings
 from utils.data_source import DataSource
 
 
@@ -10,17 +11,25 @@ class TestDataTransformer(unittest.TestCase):
     def setUp(self):
         # Mocking the DataSource for testing
         self.akas_data_source = DataSource("mock_akas_source", downloadable=True)
-        self.akas_data_source.read = MagicMock(return_value=pd.DataFrame({
-            'titleId': ['1', '2', '3', '1'],
-            'title': ['Movie12', 'Movie2', 'Movie3', 'Movie1'],
-            'isOriginalTitle': [0, None, 0, 1]
-        }))
+        self.akas_data_source.read_chunks = MagicMock(side_effect=lambda chunksize=None: iter([
+            pd.DataFrame({
+                'titleId': ['1', '2', '3'],
+                'title': ['Movie12', 'Movie2', 'Movie3'],
+                'isOriginalTitle': [0, None, 0]
+            }),
+            pd.DataFrame({
+                'titleId': ['1', '2'],
+                'title': ['Movie1', 'Movie22'],
+                'isOriginalTitle': [1, 0]
+            }),
+        ]))
         self.basics_df = pd.DataFrame({
             'tconst': ['1', '2', '3'],
             'titleType': ['movie', 'movie', 'tvSeries'],
             'runtimeMinutes': ['120', '\\N', '90'],
             'startYear': ['2000', '\\N', '1995'],
-            'primaryTitle': ['Movie1', 'Movie2', 'TVSeries1']
+            'primaryTitle': ['Movie1', 'Movie2', 'TVSeries1'],
+            'genres': ['Action', 'Drama', 'Comedy']
         })
         self.basics_ds = DataSource("mock_basics_source", downloadable=True)
         self.basics_ds.read = MagicMock(return_value=self.basics_df)
@@ -61,6 +70,63 @@ class TestDataTransformer(unittest.TestCase):
         # For example:
         self.assertEqual(movies_data['rating'].tolist(), [8.0, None])
 
+    def test_get_movies_data_pushes_filters_down(self):
+        transformer = DataTransformer()
+        transformer.get_movies_data(self.basics_ds, self.ratings_ds, None)
+
+        # Basics are filtered to movies while read and ratings to the tconsts of those movies
+        basics_filter = self.basics_ds.read.call_args.kwargs['row_filter']
+        self.assertEqual(basics_filter(self.basics_df)['tconst'].tolist(), ['1', '2'])
+        ratings_filter = self.ratings_ds.read.call_args.kwargs['row_filter']
+        self.assertEqual(ratings_filter(self.ratings_df)['tconst'].tolist(), ['1', '2'])
+
+    def test_iter_movies_data(self):
+        transformer = DataTransformer()
+        basics_df = pd.DataFrame({
+            'tconst': ['1', '2', '3', '4'],
+            'titleType': ['movie', 'movie', 'tvSeries', 'movie'],
+            'runtimeMinutes': ['120', '\\N', '90', '100'],
+            'startYear': ['2000', '\\N', '1995', '2010'],
+            'primaryTitle': ['Movie1', None, 'TVSeries1', 'Movie4'],
+            'genres': ['Action', 'Drama', 'Comedy', 'Action,Drama']
+        })
+        self.basics_ds.read_chunks = MagicMock(side_effect=lambda chunksize, columns=None: iter(
+            [basics_df[:2][columns or basics_df.columns], basics_df[2:][columns or basics_df.columns]]))
+
+        batches = list(transformer.iter_movies_data(self.basics_ds, self.ratings_ds, self.akas_data_source, 2))
+
+        # basics is read once and ratings once, restricted to the movies of that pass
+        self.assertEqual(self.basics_ds.read_chunks.call_count, 1)
+        self.assertEqual(self.ratings_ds.read.call_count, 1)
+        ratings_filter = self.ratings_ds.read.call_args.kwargs['row_filter']
+        ratings_df = pd.DataFrame({'tconst': ['1', '2', '3', '4', '5'], 'averageRating': ['8.0'] * 5})
+        self.assertEqual(ratings_filter(ratings_df)['tconst'].tolist(), ['1', '2', '4'])
+
+        # Rows without title are backfilled from akas once, after the last chunk
+        self.assertEqual([movies_data['title'].tolist() for movies_data, _ in batches], [['Movie1'], ['Movie4'], ['Movie2']])
+        self.assertEqual(self.akas_data_source.read_chunks.call_count, 1)
+
+    def test_get_movies_delta(self):
+        transformer = DataTransformer()
+        movies_data, basics_df = transformer.get_movies_data(self.basics_ds, self.ratings_ds, self.akas_data_source)
+        loaded_hashes = movies_data[["id", "content_hash"]].copy()
+
+        # Same dataset, nothing to upsert
+        self.assertTrue(transformer.get_movies_delta(movies_data, loaded_hashes).empty)
+
+        # A rating refresh only changes the hash of the affected movie
+        self.ratings_df.loc[0, 'averageRating'] = '8.5'
+        refreshed_data, _ = transformer.get_movies_data(self.basics_ds, self.ratings_ds, self.akas_data_source)
+        delta = transformer.get_movies_delta(refreshed_data, loaded_hashes)
+        self.assertEqual(delta['imdb_id'].tolist(), ['1'])
+
+        # Hashes don't depend on the dtype of the numeric columns
+        retyped_df = self.basics_df.copy()
+        retyped_df['startYear'] = retyped_df['startYear'].replace('\\N', None)
+        self.basics_ds.read = MagicMock(return_value=retyped_df)
+        retyped_data, _ = transformer.get_movies_data(self.basics_ds, self.ratings_ds, self.akas_data_source)
+        self.assertEqual(retyped_data['content_hash'].tolist(), refreshed_data['content_hash'].tolist())
+
     def test_get_genres_data(self):
         transformer = DataTransformer()
         filtered_basics_df = pd.DataFrame({
@@ -72,6 +138,37 @@ class TestDataTransformer(unittest.TestCase):
         # Add your assertions based on the expected behavior of get_genres_data
         # For example:
         self.assertEqual(genres_data['name'].tolist(), ['Action', 'Drama', 'Comedy'])
+        self.assertEqual(genres_data['id'].tolist(),
+                         [str(uuid.uuid5(uuid.NAMESPACE_URL, name)) for name in ['Action', 'Drama', 'Comedy']])
+
+    def test_assign_genre_bits_and_masks(self):
+        transformer = DataTransformer()
+        genres_data, genres_movie_data = transformer.get_genres_data(pd.DataFrame({
+            'movie_id': ['1', '2', '3'],
+            'genres': ['Action', 'Drama,Comedy', None]
+        }))
+        genre_bits = {'Drama': 0, 'Western': None}
+
+        genres_data = transformer.assign_genre_bits(genres_data, genre_bits)
+        movies_data = transformer.assign_genre_masks(pd.DataFrame({'id': ['1', '2', '3']}), genres_movie_data,
+                                                     genre_bits)
+
+        self.assertEqual(genre_bits, {'Drama': 0, 'Western': None, 'Action': 1, 'Comedy': 2})
+        self.assertEqual(genres_data['bit'].tolist(), [1, 0, 2])
+        self.assertEqual(movies_data['genre_mask'].tolist(), [2, 5, 0])
+
+    def test_assign_genre_bits_when_all_bits_are_taken(self):
+        transformer = DataTransformer()
+        genre_bits = {f'Genre{bit}': bit for bit in range(63)}
+        genres_data = transformer.assign_genre_bits(pd.DataFrame({'id': ['x'], 'name': ['Film-Noir']}), genre_bits)
+
+        self.assertIsNone(genre_bits['Film-Noir'])
+        self.assertTrue(pd.isna(genres_data['bit'].iloc[0]))
+
+    def test_uuid5_strings(self):
+        values = ['tt0000001', 'tt9916880', 'Action', 'Sci-Fi', 'ñ']
+        self.assertEqual(list(uuid5_strings(values)), [str(uuid.uuid5(uuid.NAMESPACE_URL, v)) for v in values])
+        self.assertEqual(len(uuid5_strings([])), 0)
 
     def test_get_movie_genres_data(self):
         transformer = DataTransformer()
@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import MagicMock
+
+from utils.schema_migrator import MIGRATED_INDEXES, SchemaMigrator
+
+
+class TestSchemaMigrator(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = MagicMock()
+        self.conn.dialect.name = 'postgresql'
+        # A database created before content_hash, genre_mask, genres.bit and the GiST trigram index, with the GIN
+        # one it replaces and the redundant indexes of the first release
+        self.existing = {
+            'information_schema.columns': [('movies', 'id'), ('movies', 'title'), ('genres', 'id')],
+            'pg_constraint': [('genres', 'genres_pkey')],
+            'pg_indexes': [(table, name) for table, name, _ in MIGRATED_INDEXES if name != 'idx_movies_title_trgm_gist']
+            + [('movies', 'idx_movies_title_trgm'), ('movies', 'idx_movies_id'), ('movies', 'idx_movies_title'),
+               ('movie_genres', 'idx_movie_genres_movie_genre_id'), ('genres', 'idx_genres_id')],
+        }
+        self.conn.execute.side_effect = lambda statement, *args: next(
+            (rows for source, rows in self.existing.items() if f'FROM {source}' in str(statement)), MagicMock())
+        self.schema_migrator = SchemaMigrator(self.conn)
+
+    def test_migrate_applies_missing_changes(self):
+        statements = self.schema_migrator.migrate()
+
+        self.assertEqual(statements, [
+            'ALTER TABLE movies ADD COLUMN content_hash BIGINT',
+            'ALTER TABLE movies ADD COLUMN genre_mask BIGINT NOT NULL DEFAULT 0',
+            'ALTER TABLE genres ADD COLUMN bit SMALLINT',
+            'ALTER TABLE genres ADD CONSTRAINT genres_bit_key UNIQUE (bit)',
+            'CREATE INDEX idx_movies_title_trgm_gist ON movies USING gist (title gist_trgm_ops)',
+            'DROP INDEX idx_movies_title_trgm',
+            'DROP INDEX idx_movies_id',
+            'DROP INDEX idx_movies_title',
+            'DROP INDEX idx_movie_genres_movie_genre_id',
+            'DROP INDEX idx_genres_id',
+        ])
+        executed = [str(call.args[0]) for call in self.conn.execute.call_args_list]
+        self.assertEqual(executed[-len(statements):], statements)
+        self.conn.commit.assert_called_once()
+
+    def test_migrate_skips_other_databases(self):
+        self.conn.dialect.name = 'sqlite'
+
+        self.assertEqual(self.schema_migrator.migrate(), [])
+        self.conn.execute.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
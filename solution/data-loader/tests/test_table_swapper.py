@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import MagicMock
+
+from utils.table_swapper import CONSTRAINTS_QUERY, INDEXES_QUERY, TableSwapper
+
+
+class TestTableSwapper(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = MagicMock()
+        # Definitions of the live tables as Postgres returns them
+        self.conn.execute.side_effect = lambda statement, *args: {
+            CONSTRAINTS_QUERY: [
+                ('genres', 'genres_pkey', 'PRIMARY KEY (id)'),
+                ('movies', 'movies_pkey', 'PRIMARY KEY (id)'),
+                ('movie_genres', 'movie_genres_movie_id_fkey',
+                 'FOREIGN KEY (movie_id) REFERENCES movies(id) ON DELETE CASCADE'),
+            ],
+            INDEXES_QUERY: [
+                ('movies', 'idx_movies_title_id',
+                 'CREATE INDEX idx_movies_title_id ON public.movies USING btree (title, id)'),
+                ('movies', 'idx_movies_imdb_id',
+                 'CREATE UNIQUE INDEX idx_movies_imdb_id ON public.movies USING btree (imdb_id)'),
+            ],
+        }.get(str(statement), MagicMock())
+        self.table_swapper = TableSwapper(self.conn)
+
+    def executed_statements(self):
+        return [str(call.args[0]) for call in self.conn.execute.call_args_list
+                if str(call.args[0]) not in (CONSTRAINTS_QUERY, INDEXES_QUERY)]
+
+    def test_create_shadow_tables(self):
+        shadow_tables = self.table_swapper.create_shadow_tables()
+
+        self.assertEqual(shadow_tables, {
+            'movies': 'movies_shadow', 'genres': 'genres_shadow', 'movie_genres': 'movie_genres_shadow'})
+        self.assertEqual(self.executed_statements(), [
+            'DROP TABLE IF EXISTS movie_genres_shadow, genres_shadow, movies_shadow',
+            'CREATE TABLE movies_shadow (LIKE movies INCLUDING DEFAULTS)',
+            'CREATE TABLE genres_shadow (LIKE genres INCLUDING DEFAULTS)',
+            'CREATE TABLE movie_genres_shadow (LIKE movie_genres INCLUDING DEFAULTS)',
+        ])
+
+    def test_build_indexes_copies_live_definitions(self):
+        self.table_swapper.create_shadow_tables()
+        self.conn.execute.reset_mock()
+        self.table_swapper.build_indexes()
+
+        statements = self.executed_statements()
+        self.assertEqual(statements[:5], [
+            'ALTER TABLE genres_shadow ADD CONSTRAINT genres_pkey_shadow PRIMARY KEY (id)',
+            'ALTER TABLE movies_shadow ADD CONSTRAINT movies_pkey_shadow PRIMARY KEY (id)',
+            'ALTER TABLE movie_genres_shadow ADD CONSTRAINT movie_genres_movie_id_fkey_shadow '
+            'FOREIGN KEY (movie_id) REFERENCES movies_shadow(id) ON DELETE CASCADE',
+            'CREATE INDEX idx_movies_title_id_shadow ON movies_shadow USING btree (title, id)',
+            'CREATE UNIQUE INDEX idx_movies_imdb_id_shadow ON movies_shadow USING btree (imdb_id)',
+        ])
+        self.assertEqual(statements[-1], 'ANALYZE movie_genres_shadow')
+
+    def test_swap(self):
+        self.table_swapper.create_shadow_tables()
+        self.conn.execute.reset_mock()
+        self.table_swapper.swap()
+
+        statements = self.executed_statements()
+        self.assertEqual(statements[:5], [
+            "SET LOCAL lock_timeout = '10s'",
+            'DROP TABLE movie_genres, genres, movies',
+            'ALTER TABLE movies_shadow RENAME TO movies',
+            'ALTER TABLE genres_shadow RENAME TO genres',
+            'ALTER TABLE movie_genres_shadow RENAME TO movie_genres',
+        ])
+        self.assertIn('ALTER TABLE movies RENAME CONSTRAINT movies_pkey_shadow TO movies_pkey', statements)
+        self.assertIn('ALTER INDEX idx_movies_title_id_shadow RENAME TO idx_movies_title_id', statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
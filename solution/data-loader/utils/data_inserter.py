@@ -1,35 +1,218 @@
+import io
 import math
+import time
+import uuid
 
-import numpy as np
+import pandas as pd
 from sqlalchemy import create_engine, text
 from concurrent.futures import ThreadPoolExecutor
 
+COPY_NULL = r'\N'
+COPY_ROWS_PER_READ = 10000
+# Fewest rows a parallel worker is given, smaller frames are loaded over fewer workers or serially
+PARALLEL_CHUNKSIZE = 5000
+
+
+class FrameCsvStream:
+    # File-like object that renders a DataFrame to CSV slice by slice while COPY reads from it
+    def __init__(self, frame, rows_per_read=COPY_ROWS_PER_READ):
+        frame = copy_ready(frame)
+        self.slices = (frame.iloc[start:start + rows_per_read] for start in range(0, len(frame), rows_per_read))
+        self.current = io.StringIO()
+
+    def read(self, size=-1):
+        while True:
+            data = self.current.read(size)
+            if data:
+                return data
+            frame_slice = next(self.slices, None)
+            if frame_slice is None:
+                return ''
+            self.current = io.StringIO(frame_slice.to_csv(index=False, header=False, na_rep=COPY_NULL))
+
+
+def copy_ready(frame):
+    # Numeric columns holding integral floats (nullable ints after pandas coercion) would be written
+    # as "120.0", which COPY rejects for INTEGER columns
+    frame = frame.copy()
+    for column in frame.columns:
+        values = frame[column].dropna()
+        if values.empty or frame[column].dtype.kind not in 'fO':
+            continue
+        if frame[column].dtype.kind == 'O' and not values.map(lambda value: isinstance(value, (int, float))).all():
+            continue
+        if (values.astype(float) % 1 == 0).all():
+            frame[column] = frame[column].astype('Int64')
+    return frame
+
 
 class DataInserter:
-    def __init__(self, db_params):
-        self.engine = create_engine(
-            'postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}'.format(**db_params))
+    def __init__(self, db_params, insert_method='copy', parallel_workers=4, parallel_chunksize=PARALLEL_CHUNKSIZE):
+        url = self.get_connection_url(db_params)
+        engine_options = {}
+        if url.startswith('postgresql'):
+            # One pooled connection per parallel worker besides the main transaction connection
+            engine_options = {'pool_size': parallel_workers + 1, 'max_overflow': 0}
+        self.engine = create_engine(url, **engine_options)
         self.conn = self.engine.connect()
         self.conn.autocommit = False
+        # COPY is PostgreSQL only, any other backend (e.g. SQLite) falls back to to_sql
+        self.insert_method = insert_method if self.engine.dialect.name == 'postgresql' else 'to_sql'
+        self.parallel_workers = parallel_workers
+        self.parallel_chunksize = parallel_chunksize
+        self.staging_tables = []
+        self.insert_stats = {}
+
+    @staticmethod
+    def get_connection_url(db_params):
+        if 'url' in db_params:
+            return db_params['url']
+        return 'postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}'.format(**db_params)
 
     def execute_insert(self, frame, table_name, enable_parallel_insert=False):
         num_rows, num_columns = frame.shape
+        if num_rows == 0:
+            return
         print(f"Inserting {num_rows} rows into {table_name}")
-        if enable_parallel_insert:
-            def parallel_insert(chunk):
-                chunk.to_sql(name=table_name, con=self.conn, if_exists='append', index=False, method='multi', chunksize=1000)
-            # Split the DataFrame into chunks
-            chunks = np.array_split(frame, max(math.ceil(num_rows/100),1))
-
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                executor.map(parallel_insert, chunks)
+        start = time.perf_counter()
+        insert_method = self.insert_method
+        chunks = self.split_for_workers(frame) if enable_parallel_insert and self.insert_method == 'copy' else []
+        if len(chunks) > 1:
+            self.parallel_insert(chunks, table_name)
+            insert_method = f'parallel {self.insert_method}'
+        else:
+            self.insert_frame(frame, table_name)
+        self.record_insert(table_name, num_rows, time.perf_counter() - start, insert_method)
+
+    def insert_frame(self, frame, table_name):
+        if self.insert_method == 'copy':
+            self.copy_insert(frame, table_name)
         else:
             frame.to_sql(name=table_name, con=self.conn, if_exists='append', index=False, method='multi', chunksize=1000)
 
+    def split_for_workers(self, frame):
+        # One chunk per worker, of ceil(rows / workers) rows, each of at least parallel_chunksize rows. A loader
+        # chunk of 200k basics rows holds ~12k movies, so the frames are split by size rather than a fixed chunk
+        workers = max(1, min(self.parallel_workers, len(frame) // max(self.parallel_chunksize, 1)))
+        rows_per_worker = math.ceil(len(frame) / workers)
+        return [frame.iloc[start:start + rows_per_worker] for start in range(0, len(frame), rows_per_worker)]
+
+    def parallel_insert(self, chunks, table_name):
+        # Each worker COPYs its chunk over its own connection into its own unlogged staging table and
+        # commits there. The staging tables are merged and dropped on the main connection, inside the
+        # load transaction, so the target table only changes if the whole load commits.
+        columns = chunks[0].columns
+        # Column types are read from the catalog because CREATE TABLE ... LIKE would wait on the
+        # lock the main transaction holds on the target table
+        column_types = self.get_column_types(table_name, columns)
+        suffix = uuid.uuid4().hex[:8]
+        staging_tables = [f'{table_name}_staging_{suffix}_{worker}' for worker in range(len(chunks))]
+        self.staging_tables.extend(staging_tables)
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(self.load_staging_table, staging_table, column_types, chunk)
+                       for staging_table, chunk in zip(staging_tables, chunks)]
+            for future in futures:
+                future.result()
+        columns = ', '.join(columns)
+        for staging_table in staging_tables:
+            self.conn.execute(text(f'INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_table}'))
+            self.conn.execute(text(f'DROP TABLE {staging_table}'))
+            self.staging_tables.remove(staging_table)
+
+    def get_column_types(self, table_name, columns):
+        rows = self.conn.execute(text(
+            'SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute '
+            'WHERE attrelid = CAST(:table_name AS regclass) AND attnum > 0 AND NOT attisdropped'),
+            {'table_name': table_name}).fetchall()
+        types = dict(rows)
+        return [(column, types[column]) for column in columns]
+
+    def load_staging_table(self, staging_table, column_types, chunk):
+        columns = ', '.join(f'{column} {column_type}' for column, column_type in column_types)
+        with self.engine.connect() as conn:
+            conn.execute(text(f'CREATE UNLOGGED TABLE {staging_table} ({columns})'))
+            self.copy_insert(chunk, staging_table, conn)
+            conn.commit()
+
+    def drop_staging_tables(self):
+        # Staging tables are committed by the workers, so after a rollback they are dropped separately
+        with self.engine.connect() as conn:
+            for staging_table in self.staging_tables:
+                conn.execute(text(f'DROP TABLE IF EXISTS {staging_table}'))
+            conn.commit()
+        self.staging_tables = []
+
+    def copy_insert(self, frame, table_name, conn=None):
+        # COPY runs on the raw psycopg2 connection so it joins the ongoing transaction
+        conn = conn or self.conn
+        columns = ', '.join(frame.columns)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                FrameCsvStream(frame), size=1 << 20)
+        finally:
+            cursor.close()
+
+    def read_frame(self, query):
+        return pd.read_sql(text(query), self.conn)
+
+    def upsert(self, frame, table_name, key_columns, update_columns=None):
+        # Rows are bulk inserted into a temporary table and merged with one INSERT ... ON CONFLICT,
+        # conflicting rows get update_columns (by default every non key column) overwritten
+        if frame.empty:
+            return
+        if update_columns is None:
+            update_columns = [column for column in frame.columns if column not in key_columns]
+        staging_table = self.create_temporary_copy(table_name, frame.columns)
+        self.insert_frame(frame, staging_table)
+        columns = ', '.join(frame.columns)
+        updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in update_columns)
+        on_conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        # WHERE true disambiguates ON CONFLICT from a join constraint for SQLite
+        self.conn.execute(text(
+            f'INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_table} WHERE true '
+            f'ON CONFLICT ({", ".join(key_columns)}) {on_conflict}'))
+        self.conn.execute(text(f'DROP TABLE {staging_table}'))
+        print(f'Upserted {len(frame)} rows into {table_name}')
+
+    def delete_keys(self, frame, table_name, key_column):
+        if frame.empty:
+            return
+        staging_table = self.create_temporary_copy(table_name, [key_column])
+        self.insert_frame(frame[[key_column]], staging_table)
+        self.conn.execute(text(
+            f'DELETE FROM {table_name} WHERE {key_column} IN (SELECT {key_column} FROM {staging_table})'))
+        self.conn.execute(text(f'DROP TABLE {staging_table}'))
+        print(f'Deleted {len(frame)} keys from {table_name}')
+
+    def create_temporary_copy(self, table_name, columns):
+        staging_table = f'{table_name}_delta_{uuid.uuid4().hex[:8]}'
+        self.conn.execute(text(
+            f'CREATE TEMPORARY TABLE {staging_table} AS SELECT {", ".join(columns)} FROM {table_name} LIMIT 0'))
+        return staging_table
+
+    def bump_catalog_version(self):
+        # The API caches responses per catalog version, bumping it in the load transaction makes them stale
+        # exactly when the new catalog becomes visible
+        self.conn.execute(text(
+            'INSERT INTO catalog_state (id, version, updated_at) VALUES (1, 1, CURRENT_TIMESTAMP) '
+            'ON CONFLICT (id) DO UPDATE SET version = catalog_state.version + 1, updated_at = CURRENT_TIMESTAMP'))
+
+    def record_insert(self, table_name, num_rows, seconds, insert_method):
+        rows, total_seconds = self.insert_stats.get(table_name, (0, 0.0))
+        self.insert_stats[table_name] = (rows + num_rows, total_seconds + seconds)
+        print(f"Inserted {num_rows} rows into {table_name} in {seconds:.2f}s "
+              f"({num_rows / max(seconds, 1e-9):.0f} rows/s using {insert_method})")
+
+    def report_insert_stats(self):
+        for table_name, (rows, seconds) in self.insert_stats.items():
+            print(f"{table_name}: {rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s)")
 
     def close_connection(self):
         self.conn.commit()
         self.conn.close()
+        self.report_insert_stats()
 
     def truncate_table(self, table_name):
         # Truncate each table
@@ -39,3 +222,5 @@ class DataInserter:
     def rollback(self):
         self.conn.rollback()
         self.conn.close()
+        if self.staging_tables:
+            self.drop_staging_tables()
@@ -1,14 +1,38 @@
 import gzip
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
 from io import BytesIO
+from urllib.parse import urlparse
 
 import pandas as pd
 import requests
 
+try:
+    from pyarrow import csv as pyarrow_csv
+except ImportError:
+    pyarrow_csv = None
+
+DEFAULT_CHUNKSIZE = 200000
+DOWNLOAD_BLOCKSIZE = 1 << 20
+
 
 class DataSource:
-    def __init__(self, source, downloadable):
+    def __init__(self, source, downloadable, chunksize=DEFAULT_CHUNKSIZE, cache_dir=None, offline=False,
+                 schema=None, engine=None):
         self.source = source
         self.downloadable = downloadable
+        self.chunksize = chunksize
+        # Optional TsvSchema (see utils.imdb_schema) restricting and typing the parsed columns
+        self.schema = schema
+        # engine='pyarrow' parses whole files with pyarrow when it's installed, chunked reads always use pandas
+        self.engine = engine
+        # With a cache_dir downloads are kept on disk and only fetched again when the upstream file changed
+        self.cache_dir = cache_dir
+        # Offline sources never touch the network and read the cached file
+        self.offline = offline
 
     def download_and_extract(self):
         response = requests.get(self.source)
@@ -17,10 +41,130 @@ class DataSource:
         return content
 
     def download_df(self):
-        content = self.download_and_extract()
-        return pd.read_csv(BytesIO(content), sep='\t')
+        # Decompress while parsing so neither the compressed nor the decompressed file is held in memory
+        with self.open_download() as file:
+            return self.parse(file)
 
-    def read(self):
-        if self.downloadable:
+    def read(self, row_filter=None):
+        if row_filter is not None:
+            # Filter pushdown: rows are dropped chunk by chunk so only the matching ones are ever held together
+            chunks = [row_filter(chunk) for chunk in self.read_chunks()]
+            return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        if self.downloadable and not self.is_cached_source():
             return self.download_df()
-        return pd.read_csv(self.source, sep='\t')
+        return self.parse(self.get_local_path())
+
+    def parse(self, source):
+        if self.schema is None:
+            return pd.read_csv(source, sep='\t')
+        if self.engine == 'pyarrow' and pyarrow_csv is not None:
+            parse_options, convert_options = self.schema.get_pyarrow_options()
+            table = pyarrow_csv.read_csv(source, parse_options=parse_options, convert_options=convert_options)
+            return self.schema.apply(table.to_pandas())
+        return self.schema.apply(pd.read_csv(source, sep='\t', **self.schema.get_read_options()))
+
+    def read_chunks(self, chunksize=None, columns=None):
+        # Streaming read mode: yields DataFrames of at most chunksize rows, of the given columns only if any
+        chunksize = chunksize or self.chunksize
+        if self.downloadable and not self.is_cached_source():
+            with self.open_download() as file:
+                yield from self.iter_csv(file, chunksize, columns)
+        else:
+            yield from self.iter_csv(self.get_local_path(), chunksize, columns)
+
+    def iter_csv(self, source, chunksize, columns=None):
+        if self.schema:
+            read_options = self.schema.get_read_options(columns)
+        else:
+            read_options = {"usecols": columns} if columns else {}
+        with pd.read_csv(source, sep='\t', chunksize=chunksize, **read_options) as reader:
+            for chunk in reader:
+                yield self.schema.apply(chunk) if self.schema else chunk
+
+    @contextmanager
+    def open_download(self):
+        with requests.get(self.source, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with gzip.GzipFile(fileobj=response.raw, mode='rb') as file:
+                yield file
+
+    def is_cached_source(self):
+        return bool(self.cache_dir or self.offline)
+
+    def get_local_path(self):
+        if self.downloadable:
+            return self.fetch()
+        return self.source
+
+    def get_cache_paths(self):
+        if not self.cache_dir:
+            raise ValueError(f'Offline source {self.source} needs a cache_dir')
+        file_path = os.path.join(self.cache_dir, os.path.basename(urlparse(self.source).path))
+        return file_path, f'{file_path}.json'
+
+    def fetch(self):
+        # Returns the path of a verified local copy of the source, downloading it only when it changed
+        file_path, metadata_path = self.get_cache_paths()
+        metadata = self.read_cache_metadata(file_path, metadata_path)
+        if self.offline:
+            if metadata is None:
+                raise FileNotFoundError(f'{self.source} is not cached in {self.cache_dir}')
+            print(f'Using cached {file_path}')
+            return file_path
+        headers = {}
+        if metadata:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+        with requests.get(self.source, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                print(f'{self.source} not modified, using cached {file_path}')
+                return file_path
+            response.raise_for_status()
+            self.download_to_cache(response, file_path, metadata_path)
+        return file_path
+
+    def read_cache_metadata(self, file_path, metadata_path):
+        # The cached file is only trusted if its checksum matches the one recorded when it was downloaded
+        if not os.path.exists(file_path) or not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata.get('sha256') != self.get_checksum(file_path):
+            print(f'Checksum mismatch for cached {file_path}, discarding it')
+            return None
+        return metadata
+
+    def download_to_cache(self, response, file_path, metadata_path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        checksum = hashlib.sha256()
+        # Written to a temporary file and renamed so an interrupted download never replaces a valid copy
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                for block in response.iter_content(DOWNLOAD_BLOCKSIZE):
+                    checksum.update(block)
+                    file.write(block)
+            os.replace(temporary_path, file_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        metadata = {
+            'source': self.source,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': checksum.hexdigest(),
+        }
+        with open(metadata_path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        print(f'Downloaded {self.source} to {file_path}')
+
+    @staticmethod
+    def get_checksum(file_path):
+        checksum = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(DOWNLOAD_BLOCKSIZE), b''):
+                checksum.update(block)
+        return checksum.hexdigest()
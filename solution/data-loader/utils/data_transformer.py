@@ -1,28 +1,127 @@
+import hashlib
 import uuid
 
 import pandas as pd
 import numpy as np
 
+# movies.genre_mask is a BIGINT, the sign bit is left unused so masks stay positive
+GENRE_MASK_BITS = 63
+
+
+def uuid5_strings(values, namespace=uuid.NAMESPACE_URL):
+    # Same ids as str(uuid.uuid5(namespace, value)) for every value. Only the sha1 digests are computed per
+    # value, the version/variant bits and the hex formatting are applied to all of them at once
+    values = list(values)
+    if not values:
+        return np.array([], dtype=str)
+    prefix = namespace.bytes
+    sha1 = hashlib.sha1
+    digests = b''.join([sha1(prefix + value.encode()).digest()[:16] for value in values])
+    id_bytes = np.frombuffer(digests, dtype=np.uint8).reshape(len(values), 16).copy()
+    id_bytes[:, 6] = (id_bytes[:, 6] & 0x0F) | 0x50
+    id_bytes[:, 8] = (id_bytes[:, 8] & 0x3F) | 0x80
+    hex_chars = np.frombuffer(id_bytes.tobytes().hex().encode(), dtype='S1').reshape(len(values), 32)
+    id_chars = np.full((len(values), 36), b'-', dtype='S1')
+    for start, end, hex_start in ((0, 8, 0), (9, 13, 8), (14, 18, 12), (19, 23, 16), (24, 36, 20)):
+        id_chars[:, start:end] = hex_chars[:, hex_start:hex_start + end - start]
+    return id_chars.view('S36').ravel().astype(str)
+
 
 class DataTransformer:
     def get_movies_data(self, basics_ds, ratings_ds, akas_data_source):
-        basics_df = self.get_basics_data(basics_ds.read(), akas_data_source)
+        # Non movie rows are dropped chunk by chunk while basics is read and only the ratings of the
+        # remaining tconsts are kept
+        basics_df = self.get_basics_data(basics_ds.read(row_filter=self.filter_movies), akas_data_source)
+        movies_data = self.merge_ratings(basics_df, self.get_ratings(ratings_ds, basics_df["tconst"]))
+        return movies_data, basics_df
 
-        movies_data = pd.merge(basics_df, ratings_ds.read(), on="tconst", how="left")
+    def iter_movies_data(self, basics_ds, ratings_ds, akas_data_source, chunksize=None):
+        # Streaming counterpart of get_movies_data: yields (movies_data, basics_df) per basics chunk. basics is
+        # read once and only its movie rows are held, so the ratings can be restricted to their tconsts
+        basics_dfs = []
+        null_titles_dfs = []
+        for basics_chunk in basics_ds.read_chunks(chunksize):
+            basics_df = self.prepare_basics_data(basics_chunk)
+            if akas_data_source:
+                # Keep rows without title aside so akas is scanned once instead of once per chunk
+                null_titles = basics_df['primaryTitle'].isnull()
+                null_titles_dfs.append(basics_df[null_titles])
+                basics_df = basics_df[~null_titles]
+            basics_df = self.drop_null_titles(basics_df)
+            if not basics_df.empty:
+                basics_dfs.append(basics_df)
+        if null_titles_dfs:
+            basics_df = pd.concat(null_titles_dfs)
+            if not basics_df.empty:
+                basics_df = self.assign_non_nulls_titles(basics_df, "primaryTitle", akas_data_source)
+                basics_df = self.drop_null_titles(basics_df)
+                if not basics_df.empty:
+                    basics_dfs.append(basics_df)
+        if not basics_dfs:
+            return
+        ratings = self.get_ratings(ratings_ds, pd.concat([basics_df["tconst"] for basics_df in basics_dfs]))
+        while basics_dfs:
+            # Held chunks are released as they are yielded
+            basics_df = basics_dfs.pop(0)
+            yield self.merge_ratings(basics_df, ratings), basics_df
+
+    def filter_movies(self, basics_df):
+        return basics_df[basics_df['titleType'] == 'movie']
+
+    def get_ratings(self, ratings_ds, tconsts=None):
+        # averageRating indexed by tconst, restricted to the given tconsts while the file is read
+        if tconsts is None:
+            ratings_df = ratings_ds.read()
+        else:
+            tconsts = pd.Index(tconsts)
+            ratings_df = ratings_ds.read(row_filter=lambda chunk: chunk[chunk["tconst"].isin(tconsts)])
+        ratings_df = ratings_df.drop_duplicates(subset="tconst")
+        return ratings_df.set_index("tconst")["averageRating"]
+
+    def merge_ratings(self, basics_df, ratings):
+        # Looked up through the ratings index, which is hashed once for all the chunks
+        movies_data = basics_df.assign(averageRating=basics_df["tconst"].map(ratings))
         movies_data["ratingNumeric"] = pd.to_numeric(movies_data["averageRating"], errors='coerce')
         movies_data["ratingNumeric"] = movies_data["ratingNumeric"].replace({np.nan: None})
+        movies_data["contentHash"] = self.get_content_hash(movies_data)
         movies_data = movies_data[
-            ["movie_id", "primaryTitle", "startYearNumeric", "runtimeMinutesNumeric", "ratingNumeric", "tconst"]]
-        movies_data.columns = ["id", "title", "year", "runtime", "rating", "imdb_id"]
-        return movies_data, basics_df
+            ["movie_id", "primaryTitle", "startYearNumeric", "runtimeMinutesNumeric", "ratingNumeric", "tconst",
+             "contentHash"]]
+        movies_data.columns = ["id", "title", "year", "runtime", "rating", "imdb_id", "content_hash"]
+        return movies_data
+
+    def get_content_hash(self, movies_data):
+        # Deterministic 64 bit hash of everything a movie row and its genre links are built from. Numbers are
+        # hashed as float64 so the hash doesn't depend on the dtype pandas inferred for a given chunk
+        hashed_df = pd.DataFrame({
+            "title": movies_data["primaryTitle"].astype(str),
+            "year": pd.to_numeric(movies_data["startYearNumeric"], errors='coerce').astype("float64"),
+            "runtime": pd.to_numeric(movies_data["runtimeMinutesNumeric"], errors='coerce').astype("float64"),
+            "rating": pd.to_numeric(movies_data["ratingNumeric"], errors='coerce').astype("float64"),
+            "imdb_id": movies_data["tconst"].astype(str),
+            "genres": movies_data["genres"].fillna(r"\N").astype(str),
+        })
+        # Stored in a BIGINT column, so the unsigned hash is reinterpreted as signed
+        return pd.util.hash_pandas_object(hashed_df, index=False).to_numpy().view(np.int64)
+
+    def get_movies_delta(self, movies_data, loaded_hashes):
+        # Rows whose (id, content_hash) pair isn't loaded yet are new or changed and have to be upserted
+        loaded_keys = pd.MultiIndex.from_frame(loaded_hashes[["id", "content_hash"]])
+        changed = ~pd.MultiIndex.from_frame(movies_data[["id", "content_hash"]]).isin(loaded_keys)
+        return movies_data[changed]
 
     def get_genres_data(self, filtered_basics_df):
-        genres_movie_data = filtered_basics_df[["movie_id", "genres"]]
-        genres_movie_data["genres"] = genres_movie_data["genres"].apply(lambda x: x.split(','))
-        genres_movie_data = genres_movie_data.explode("genres").dropna()
-        genres_movie_data = genres_movie_data[genres_movie_data["genres"] != r"\N"]
-        genres_movie_data["genre_id"] = genres_movie_data["genres"].apply(
-            lambda x: str(uuid.uuid5(uuid.NAMESPACE_URL, x)))
+        # Only a few thousand distinct genre lists exist, they are split and given ids once and joined back
+        # to the movies. Typed sources read \N as missing, factorize leaves it out (code -1)
+        combo_codes, combos = pd.factorize(filtered_basics_df["genres"])
+        combo_genres = pd.Series(combos, dtype=object).str.split(',').explode()
+        combo_genres = combo_genres[combo_genres.notna() & (combo_genres != r"\N")]
+        genre_names = combo_genres.unique()
+        genre_ids = pd.Series(uuid5_strings(genre_names), index=genre_names)
+        combo_genres = pd.DataFrame({"combo": combo_genres.index, "genres": combo_genres.values,
+                                     "genre_id": combo_genres.map(genre_ids).values})
+        genres_movie_data = pd.DataFrame({"movie_id": filtered_basics_df["movie_id"].values, "combo": combo_codes})
+        genres_movie_data = genres_movie_data.merge(combo_genres, on="combo").drop(columns="combo")
 
         genres_data = genres_movie_data[["genre_id", "genres"]]
         genres_data.columns = ["id", "name"]
@@ -34,17 +133,42 @@ class DataTransformer:
         movie_genres_data.columns = ["movie_id", "genre_id"]
         return movie_genres_data
 
+    def assign_genre_bits(self, genres_data, genre_bits):
+        # genre_bits maps every known genre name to its bit in movies.genre_mask (None when it has none) and is
+        # shared by all the chunks of a load. New genres take the lowest free bits, once the 63 bits are taken
+        # further genres get none and are filtered through movie_genres instead
+        free_bits = sorted(set(range(GENRE_MASK_BITS)) - set(genre_bits.values()), reverse=True)
+        for name in genres_data["name"]:
+            if name not in genre_bits:
+                genre_bits[name] = free_bits.pop() if free_bits else None
+        return genres_data.assign(bit=genres_data["name"].map(genre_bits).astype("Int16"))
+
+    def assign_genre_masks(self, movies_data, genres_movie_data, genre_bits):
+        # genre_mask has the bits of all the genres of a movie, 0 without genres
+        bits = genres_movie_data.drop_duplicates(subset=["movie_id", "genres"])
+        bits = bits.assign(bit=bits["genres"].map(genre_bits)).dropna(subset=["bit"])
+        masks = np.left_shift(np.int64(1), bits["bit"].to_numpy(dtype=np.int64))
+        masks = pd.Series(masks, index=bits["movie_id"].to_numpy()).groupby(level=0).sum()
+        return movies_data.assign(genre_mask=movies_data["id"].map(masks).fillna(0).astype(np.int64))
+
     def get_basics_data(self, basics_df, akas_data_source):
-        basics_df = basics_df[basics_df['titleType'] == 'movie']
+        basics_df = self.prepare_basics_data(basics_df)
+        if akas_data_source:
+            basics_df = self.assign_non_nulls_titles(basics_df, "primaryTitle", akas_data_source)
+        return self.drop_null_titles(basics_df)
+
+    def prepare_basics_data(self, basics_df):
+        basics_df = self.filter_movies(basics_df)
         basics_df = basics_df.drop_duplicates(subset='tconst')
         #basics_df.loc[:, "imdb_link"] = basics_df["tconst"].apply(lambda movie_id: f"https://www.imdb.com/title/{movie_id}/")
-        basics_df.loc[:, "movie_id"] = basics_df["tconst"].apply(lambda x: str(uuid.uuid5(uuid.NAMESPACE_URL, x)))
+        basics_df.loc[:, "movie_id"] = uuid5_strings(basics_df["tconst"])
         basics_df.loc[:, "runtimeMinutesNumeric"] = pd.to_numeric(basics_df["runtimeMinutes"], errors='coerce')
         basics_df["runtimeMinutesNumeric"] = basics_df["runtimeMinutesNumeric"].replace({np.nan: None})
         basics_df.loc[:, "startYearNumeric"] = pd.to_numeric(basics_df["startYear"], errors='coerce')
         basics_df["startYear"] = basics_df["startYear"].replace({np.nan: None})
-        if akas_data_source:
-            basics_df = self.assign_non_nulls_titles(basics_df, "primaryTitle", akas_data_source)
+        return basics_df
+
+    def drop_null_titles(self, basics_df):
         all_basics = len(basics_df['primaryTitle'])
         basics_df = basics_df.dropna(subset=['primaryTitle'])
         new_all_basics = len(basics_df['primaryTitle'])
@@ -53,17 +177,9 @@ class DataTransformer:
         return basics_df
 
     def assign_non_nulls_titles(self, dataFrame, columnName, akas_data_source):
-        akas_df = akas_data_source.read()
-        filtered_df = akas_df.dropna(subset=['title'])
-
         # Get the tconst values for null titles
         null_title_tconsts = dataFrame[dataFrame[columnName].isnull()]['tconst']
-        # Use isin to filter the rows in filtered_df with the null_title_tconsts
-        filtered_df = filtered_df[filtered_df['titleId'].isin(null_title_tconsts)]
-
-        filtered_df['isOriginalTitle'] = pd.to_numeric(filtered_df['isOriginalTitle'], errors='coerce').fillna(0)
-        sorted_df = filtered_df.sort_values(by='isOriginalTitle', ascending=False)
-        final_titles_df = sorted_df.drop_duplicates(subset='titleId', keep='first')[['titleId', 'title']]
+        final_titles_df = self.get_akas_titles(akas_data_source, set(null_title_tconsts))
 
         # Merge with dataFrame based on tconst
         merged_df = pd.merge(dataFrame, final_titles_df, how='left', left_on='tconst', right_on='titleId')
@@ -78,3 +194,18 @@ class DataTransformer:
         print(f'Filled {len(null_title_tconsts) - still_null_title_tconsts} rows from {len(null_title_tconsts)}')
 
         return merged_df.dropna(subset=[columnName])
+
+    def get_akas_titles(self, akas_data_source, title_ids):
+        # Streaming semi-join: akas is scanned chunk by chunk and only the best candidate (the original title
+        # if there is one, the first one seen otherwise) of the wanted ids is kept
+        if not title_ids:
+            return pd.DataFrame({'titleId': [], 'title': []}, dtype=object)
+        best_titles = {}
+        for akas_df in akas_data_source.read_chunks():
+            akas_df = akas_df[akas_df['titleId'].isin(title_ids) & akas_df['title'].notna()]
+            is_original = pd.to_numeric(akas_df['isOriginalTitle'], errors='coerce').fillna(0) > 0
+            for title_id, title, original in zip(akas_df['titleId'], akas_df['title'], is_original):
+                if title_id not in best_titles or (original and not best_titles[title_id][1]):
+                    best_titles[title_id] = (title, original)
+        return pd.DataFrame({'titleId': list(best_titles), 'title': [title for title, _ in best_titles.values()]},
+                            dtype=object)
@@ -0,0 +1,64 @@
+import csv
+
+import pandas as pd
+
+IMDB_NULL = r'\N'
+
+
+class TsvSchema:
+    # Declared layout of an IMDb dataset file: only usecols are materialized, in the declared dtypes,
+    # and numeric columns end up in compact nullable integer/float types
+    def __init__(self, usecols, dtype=None, numeric=None):
+        self.usecols = usecols
+        self.dtype = dtype or {}
+        self.numeric = numeric or {}
+
+    def get_read_options(self, columns=None):
+        # IMDb files aren't quoted and only \N means null, titles like "NA" or "null" are real titles.
+        # Numeric columns are parsed as text and converted by apply, so a malformed value becomes null
+        # instead of failing the parse halfway through the file. columns restricts the parse to some of usecols
+        columns = columns or self.usecols
+        dtype = {**self.dtype, **{column: str for column in self.numeric}}
+        return {
+            "usecols": columns,
+            "dtype": {column: column_dtype for column, column_dtype in dtype.items() if column in columns},
+            "na_values": [IMDB_NULL],
+            "keep_default_na": False,
+            "quoting": csv.QUOTE_NONE,
+        }
+
+    def get_pyarrow_options(self):
+        from pyarrow import csv as pyarrow_csv
+
+        parse_options = pyarrow_csv.ParseOptions(delimiter='\t', quote_char=False)
+        convert_options = pyarrow_csv.ConvertOptions(
+            include_columns=self.usecols, null_values=[IMDB_NULL], strings_can_be_null=True)
+        return parse_options, convert_options
+
+    def apply(self, df):
+        for column, dtype in self.numeric.items():
+            if column in df:
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+        for column, dtype in self.dtype.items():
+            if column in df and dtype == "category" and df[column].dtype != "category":
+                df[column] = df[column].astype("category")
+        return df
+
+
+TITLE_BASICS = TsvSchema(
+    usecols=["tconst", "titleType", "primaryTitle", "startYear", "runtimeMinutes", "genres"],
+    dtype={"tconst": str, "titleType": "category", "primaryTitle": str, "genres": str},
+    numeric={"startYear": "Int16", "runtimeMinutes": "Int32"},
+)
+
+TITLE_RATINGS = TsvSchema(
+    usecols=["tconst", "averageRating"],
+    dtype={"tconst": str},
+    numeric={"averageRating": "float64"},
+)
+
+TITLE_AKAS = TsvSchema(
+    usecols=["titleId", "title", "isOriginalTitle"],
+    dtype={"titleId": str, "title": str},
+    numeric={"isOriginalTitle": "Int8"},
+)
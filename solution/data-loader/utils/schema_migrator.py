@@ -0,0 +1,76 @@
+from sqlalchemy import text
+
+# Schema changes made after the first release of sql-scripts/01_create_movie_table.sql, which creates a new
+# database in its latest shape. A deployed database gets the missing ones applied before a load; add an entry here
+# whenever a column, constraint or index is added to the script. (table, name, definition)
+MIGRATED_COLUMNS = [
+    ("movies", "content_hash", "BIGINT"),
+    ("movies", "genre_mask", "BIGINT NOT NULL DEFAULT 0"),
+    ("genres", "bit", "SMALLINT"),
+]
+
+MIGRATED_CONSTRAINTS = [
+    ("genres", "genres_bit_key", "UNIQUE (bit)"),
+]
+
+MIGRATED_INDEXES = [
+    ("movies", "idx_movies_title_id", "(title, id)"),
+    ("movies", "idx_movies_year_id", "(year, id)"),
+    ("movies", "idx_movies_rating_id", "(rating, id)"),
+    ("movies", "idx_movies_title_trgm_gist", "USING gist (title gist_trgm_ops)"),
+    ("movie_genres", "idx_movie_genres_genre_movie_id", "(genre_id, movie_id)"),
+]
+
+# Indexes replaced by one of MIGRATED_INDEXES, dropped once it exists, and indexes of the first release that
+# duplicate a primary key or one of MIGRATED_INDEXES and would otherwise be rebuilt on every swap. (table, name)
+DROPPED_INDEXES = [
+    ("movies", "idx_movies_title_trgm"),
+    ("movies", "idx_movies_id"),
+    ("movies", "idx_movies_title"),
+    ("movie_genres", "idx_movie_genres_movie_genre_id"),
+    ("genres", "idx_genres_id"),
+]
+
+
+class SchemaMigrator:
+    # Brings the live tables up to the schema the loader and the API expect. Only the missing changes are
+    # executed, each ALTER TABLE locks its table, and they are committed before the load starts so the load
+    # transaction never holds those locks
+    def __init__(self, conn):
+        self.conn = conn
+
+    def migrate(self):
+        if self.conn.dialect.name != 'postgresql':
+            return []
+        self.conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        self.conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS catalog_state (id SMALLINT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0, '
+            'updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP)'))
+        columns = self.existing(
+            "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()")
+        constraints = self.existing(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE connamespace = current_schema()::regnamespace")
+        indexes = self.existing(
+            "SELECT tablename, indexname FROM pg_indexes WHERE schemaname = current_schema()")
+        statements = []
+        for table, name, definition in MIGRATED_COLUMNS:
+            if (table, name) not in columns:
+                statements.append(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+        for table, name, definition in MIGRATED_CONSTRAINTS:
+            if (table, name) not in constraints:
+                statements.append(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+        for table, name, definition in MIGRATED_INDEXES:
+            if (table, name) not in indexes:
+                statements.append(f'CREATE INDEX {name} ON {table} {definition}')
+        for table, name in DROPPED_INDEXES:
+            if (table, name) in indexes:
+                statements.append(f'DROP INDEX {name}')
+        for statement in statements:
+            self.conn.execute(text(statement))
+            print(f'Migrated: {statement}')
+        self.conn.commit()
+        return statements
+
+    def existing(self, query):
+        return {tuple(row) for row in self.conn.execute(text(query))}
@@ -0,0 +1,87 @@
+import re
+
+from sqlalchemy import text
+
+SHADOW_SUFFIX = '_shadow'
+
+# Tables in dependency order, referenced tables first
+SWAPPED_TABLES = ["movies", "genres", "movie_genres"]
+
+# Foreign keys last, they need the keys they reference
+CONSTRAINTS_QUERY = """
+    SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+    WHERE conrelid = ANY(CAST(:tables AS regclass[])) AND contype IN ('p', 'u', 'c', 'f')
+    ORDER BY contype = 'f', conrelid::regclass::text, conname"""
+# Indexes backing a constraint are created with it
+INDEXES_QUERY = """
+    SELECT i.indrelid::regclass::text, c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = ANY(CAST(:tables AS regclass[]))
+    AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)
+    ORDER BY 1, 2"""
+INDEX_DEFINITION = re.compile(r'^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (.*)$')
+REFERENCES = re.compile(r'REFERENCES (?:\w+\.)?(\w+)\(')
+
+
+class TableSwapper:
+    # Loads go into bare shadow tables; constraints and indexes are built once the bulk load is done
+    # and the shadow tables replace the live ones in the last statements of the load transaction, so
+    # readers keep seeing the previous catalog until the commit and then the new one in full.
+    # Constraints and indexes are read from the live tables, the shadow tables get the same ones whatever the
+    # version of the schema. Missing columns, constraints and indexes are added by SchemaMigrator beforehand
+    def __init__(self, conn, lock_timeout='10s'):
+        self.conn = conn
+        self.lock_timeout = lock_timeout
+        self.constraints = []
+        self.indexes = []
+
+    def shadow_table_names(self):
+        return {table: f'{table}{SHADOW_SUFFIX}' for table in SWAPPED_TABLES}
+
+    def create_shadow_tables(self):
+        shadow_tables = self.shadow_table_names()
+        self.read_definitions()
+        self.conn.execute(text(f'DROP TABLE IF EXISTS {", ".join(reversed(shadow_tables.values()))}'))
+        for table, shadow_table in shadow_tables.items():
+            # LIKE without INCLUDING ALL copies columns, defaults and NOT NULL but no keys or indexes
+            self.conn.execute(text(f'CREATE TABLE {shadow_table} (LIKE {table} INCLUDING DEFAULTS)'))
+        print(f'Shadow tables {", ".join(shadow_tables.values())} created.')
+        return shadow_tables
+
+    def read_definitions(self):
+        # (table, name, definition) of the constraints and of the (unique, definition) of the other indexes
+        tables = '{' + ','.join(SWAPPED_TABLES) + '}'
+        self.constraints = [tuple(row) for row in self.conn.execute(text(CONSTRAINTS_QUERY), {'tables': tables})]
+        self.indexes = []
+        for table, name, definition in self.conn.execute(text(INDEXES_QUERY), {'tables': tables}):
+            unique, rest = INDEX_DEFINITION.match(definition).groups()
+            self.indexes.append((table, name, (unique or '', rest)))
+
+    def build_indexes(self):
+        shadow_tables = self.shadow_table_names()
+        for table, name, definition in self.constraints:
+            # Foreign keys reference the shadow tables until they are renamed
+            definition = REFERENCES.sub(
+                lambda match: f'REFERENCES {shadow_tables.get(match.group(1), match.group(1))}(', definition)
+            self.conn.execute(text(
+                f'ALTER TABLE {shadow_tables[table]} ADD CONSTRAINT {name}{SHADOW_SUFFIX} {definition}'))
+        for table, name, (unique, definition) in self.indexes:
+            self.conn.execute(text(
+                f'CREATE {unique}INDEX {name}{SHADOW_SUFFIX} ON {shadow_tables[table]} {definition}'))
+        for shadow_table in shadow_tables.values():
+            self.conn.execute(text(f'ANALYZE {shadow_table}'))
+        print('Shadow tables indexed.')
+
+    def swap(self):
+        # Only these statements need the exclusive lock on the live tables; the lock timeout keeps
+        # the swap from queueing readers behind it if a long running query holds the tables
+        shadow_tables = self.shadow_table_names()
+        self.conn.execute(text(f"SET LOCAL lock_timeout = '{self.lock_timeout}'"))
+        self.conn.execute(text(f'DROP TABLE {", ".join(reversed(SWAPPED_TABLES))}'))
+        for table, shadow_table in shadow_tables.items():
+            self.conn.execute(text(f'ALTER TABLE {shadow_table} RENAME TO {table}'))
+        for table, name, _ in self.constraints:
+            self.conn.execute(text(f'ALTER TABLE {table} RENAME CONSTRAINT {name}{SHADOW_SUFFIX} TO {name}'))
+        for table, name, _ in self.indexes:
+            self.conn.execute(text(f'ALTER INDEX {name}{SHADOW_SUFFIX} RENAME TO {name}'))
+        print(f'Tables {", ".join(SWAPPED_TABLES)} swapped.')
@@ -1,6 +1,6 @@
 #!/bin/sh
 # Create JSON file with environment variables for API
-config_json="{\"DB_HOST\": \"$DB_HOST\", \"DB_PORT\": \"$DB_PORT\", \"DB_USER\": \"$DB_USER\", \"DB_PASSWORD\": \"$DB_PASSWORD\", \"DB_NAME\": \"$DB_NAME\"}"
+config_json="{\"DB_HOST\": \"$DB_HOST\", \"DB_PORT\": \"$DB_PORT\", \"DB_USER\": \"$DB_USER\", \"DB_PASSWORD\": \"$DB_PASSWORD\", \"DB_NAME\": \"$DB_NAME\", \"PARALLEL_WORKERS\": \"$PARALLEL_WORKERS\", \"PARALLEL_CHUNKSIZE\": \"$PARALLEL_CHUNKSIZE\", \"LOAD_CHUNKSIZE\": \"$LOAD_CHUNKSIZE\", \"DATA_CACHE_DIR\": \"$DATA_CACHE_DIR\", \"OFFLINE\": \"$OFFLINE\", \"SECRET_KEY\": \"$SECRET_KEY\", \"DB_JSON_RENDERING\": \"$DB_JSON_RENDERING\", \"CACHE_BACKEND\": \"$CACHE_BACKEND\", \"REDIS_URL\": \"$REDIS_URL\", \"REDIS_TIMEOUT\": \"$REDIS_TIMEOUT\", \"CACHE_TTL\": \"$CACHE_TTL\", \"CACHE_MAX_ENTRIES\": \"$CACHE_MAX_ENTRIES\", \"CACHE_MAX_BYTES\": \"$CACHE_MAX_BYTES\", \"CATALOG_VERSION_TTL\": \"$CATALOG_VERSION_TTL\", \"CACHE_CONTROL_MAX_AGE\": \"$CACHE_CONTROL_MAX_AGE\", \"TITLE_INDEX_DIR\": \"$TITLE_INDEX_DIR\", \"SUGGEST_REFRESH_INTERVAL\": \"$SUGGEST_REFRESH_INTERVAL\", \"SUGGEST_REBUILD_INTERVAL\": \"$SUGGEST_REBUILD_INTERVAL\"}"
 
 echo "$config_json"
 
@@ -1,4 +1,6 @@
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+-- Trigram similarity and indexes for the title search (q= of GET /movies)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 CREATE TABLE IF NOT EXISTS movies (
     id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
@@ -6,12 +8,17 @@ CREATE TABLE IF NOT EXISTS movies (
     year INTEGER,
     rating DECIMAL(3,1),
     runtime INTEGER,
-    imdb_id VARCHAR(15)
+    imdb_id VARCHAR(15),
+    content_hash BIGINT,
+    -- Bits (genres.bit) of the genres of the movie, filters and renders genres without joins
+    genre_mask BIGINT NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS genres (
     id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
-    name VARCHAR(50) NOT NULL UNIQUE
+    name VARCHAR(50) NOT NULL UNIQUE,
+    -- Bit of the genre in movies.genre_mask (0-62), NULL for genres beyond them which are filtered by movie_genres
+    bit SMALLINT UNIQUE
 );
 
 CREATE TABLE IF NOT EXISTS movie_genres (
@@ -20,11 +27,25 @@ CREATE TABLE IF NOT EXISTS movie_genres (
     PRIMARY KEY (movie_id, genre_id)
 );
 
- CREATE INDEX idx_movies_id ON movies (id);
- CREATE INDEX idx_movies_title ON movies (title);
--- CREATE INDEX idx_movies_id_hash ON movies USING hash (id);
---- CREATE INDEX idx_movie_genres_genre_id ON movie_genres (genre_id);
-CREATE INDEX idx_movie_genres_movie_genre_id ON movie_genres (movie_id, genre_id);
-CREATE INDEX idx_genres_id ON genres (id);
--- CREATE INDEX idx_genres_id_hash ON genres USING hash (id);
---- CREATE INDEX idx_movie_genres_movie_id_hash ON movie_genres USING hash (column_name);;
+-- Single row versioning the catalog, bumped by the data-loader after each load and by POST /movies. The API caches
+-- responses per version so none is served after a write
+CREATE TABLE IF NOT EXISTS catalog_state (
+    id SMALLINT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO catalog_state (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+-- The data-loader rebuilds the constraints and indexes read from the live tables on reload. Columns, constraints
+-- and indexes added here also go to data-loader/utils/schema_migrator.py so deployed databases get them.
+-- The primary keys already index movies(id), genres(id) and movie_genres(movie_id, genre_id).
+-- GET /movies orders by (sort field, id) in a single direction and pages with a (sort field, id) row-value
+-- comparison, so each sort field gets a composite index that serves the order, the page and rating_gt as a range
+CREATE INDEX IF NOT EXISTS idx_movies_title_id ON movies (title, id);
+CREATE INDEX IF NOT EXISTS idx_movies_year_id ON movies (year, id);
+CREATE INDEX IF NOT EXISTS idx_movies_rating_id ON movies (rating, id);
+-- q= searches titles by prefix (ILIKE 'q%') and similarity (title % q), both served by a trigram index. GiST
+-- rather than GIN, it also returns the titles nearest to q first (ORDER BY title <-> q)
+CREATE INDEX IF NOT EXISTS idx_movies_title_trgm_gist ON movies USING gist (title gist_trgm_ops);
+-- genre= filters reach the movies of a genre from genres(name)
+CREATE INDEX IF NOT EXISTS idx_movie_genres_genre_movie_id ON movie_genres (genre_id, movie_id);